@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks module.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
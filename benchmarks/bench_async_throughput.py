@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Throughput benchmark of the sync and async allocation services.
+
+Run with ``python -m benchmarks.bench_async_throughput [--db-uri URI]``.
+Each level runs the same number of allocations, on distinct SKUs, from
+that many threads (sync) or in-flight tasks (async). SQLite serializes
+writers, so the async gains only show against a networked database such
+as the docker-compose Postgres.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    create_async_engine,
+)
+from sqlalchemy.orm import sessionmaker
+
+from corelib.allocation.adapters.async_repository import (
+    AsyncSQLAlchemyRepository,
+)
+from corelib.allocation.adapters.orm import (
+    metadata,
+    start_mappers,
+)
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import (
+    async_services,
+    services,
+)
+
+CONCURRENCY = (1, 4, 16, 64)
+ALLOCATIONS = 512
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_uri(uri: str) -> str:
+    """Swap the driver of a database URI for its asyncio counterpart.
+
+    Args:
+        uri: sync database URI.
+
+    Returns:
+        uri: async database URI.
+    """
+    scheme, rest = uri.split("://", 1)
+    return f"{ASYNC_DRIVERS[scheme.split('+')[0]]}://{rest}"
+
+
+def seed(uri: str, run: str) -> List[OrderLine]:
+    """Create one batch per allocation and return the lines to allocate.
+
+    Args:
+        uri: sync database URI.
+        run: prefix making references and skus unique to this run.
+
+    Returns:
+        lines: order lines, one per batch.
+    """
+    session = sessionmaker(bind=create_engine(uri))()
+    repo = SQLAlchemyRepository(session)
+    repo.add_many(
+        Batch(f"{run}-b{i}", f"{run}-sku{i}", 10, eta=None)
+        for i in range(ALLOCATIONS)
+    )
+    session.commit()
+    session.close()
+    return [
+        OrderLine(f"{run}-o{i}", f"{run}-sku{i}", 1)
+        for i in range(ALLOCATIONS)
+    ]
+
+
+def run_sync(uri: str, concurrency: int) -> float:
+    """Allocate from a thread pool, one session per allocation.
+
+    Args:
+        uri: sync database URI.
+        concurrency: number of threads.
+
+    Returns:
+        throughput: allocations per second.
+    """
+    lines = seed(uri, f"sync{concurrency}")
+    get_session = sessionmaker(
+        bind=create_engine(uri, **_engine_options(uri, concurrency))
+    )
+
+    def allocate(line: OrderLine) -> str:
+        session = get_session()
+        try:
+            repo = SQLAlchemyRepository(session)
+            return services.allocate(line, repo, session)
+        finally:
+            session.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(allocate, lines))
+    return len(lines) / (time.perf_counter() - start)
+
+
+async def run_async(uri: str, concurrency: int) -> float:
+    """Allocate from concurrent tasks, one async session per allocation.
+
+    Args:
+        uri: sync database URI, its async driver is used.
+        concurrency: maximum number of allocations in flight.
+
+    Returns:
+        throughput: allocations per second.
+    """
+    lines = seed(uri, f"async{concurrency}")
+    engine = create_async_engine(
+        async_uri(uri), **_engine_options(uri, concurrency)
+    )
+    get_session = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def allocate(line: OrderLine) -> str:
+        async with in_flight, get_session() as session:
+            repo = AsyncSQLAlchemyRepository(session)
+            return await async_services.allocate(line, repo, session)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(allocate(line) for line in lines))
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return len(lines) / elapsed
+
+
+def _engine_options(uri: str, concurrency: int) -> dict:
+    """Size the pool for the concurrency level.
+
+    SQLite files use a NullPool, there writers wait for the lock instead.
+
+    Args:
+        uri: sync database URI.
+        concurrency: number of concurrent allocations.
+
+    Returns:
+        options: create_engine keyword arguments.
+    """
+    if uri.startswith("sqlite"):
+        return {"connect_args": {"timeout": 30}}
+    return {"pool_size": concurrency}
+
+
+def main(argv: Optional[List[str]] = None) -> List[Tuple[int, float, float]]:
+    """Run the benchmark and print one row per concurrency level.
+
+    Args:
+        argv: command line arguments, sys.argv by default.
+
+    Returns:
+        results: concurrency, sync and async allocations per second.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default=None)
+    args = parser.parse_args(argv)
+    uri = args.db_uri or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    metadata.create_all(create_engine(uri))
+    start_mappers()
+
+    results = []
+    print(f"{'concurrency':>12} {'sync alloc/s':>13} {'async alloc/s':>14}")
+    for concurrency in CONCURRENCY:
+        sync = run_sync(uri, concurrency)
+        asynchronous = asyncio.run(run_async(uri, concurrency))
+        results.append((concurrency, sync, asynchronous))
+        print(f"{concurrency:>12} {sync:>13.1f} {asynchronous:>14.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmark for allocating a line to an already busy batch.
+
+Run with ``python -m benchmarks.bench_batch_allocation``. The cost of
+``can_allocate`` + ``allocate`` should stay flat while the number of lines
+the batch already holds grows.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import timeit
+from typing import (
+    List,
+    Tuple,
+)
+
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+
+HELD_LINES = (10, 100, 1_000, 10_000, 100_000)
+REPEAT = 5
+NUMBER = 10_000
+
+
+def make_busy_batch(held_lines: int) -> Batch:
+    """Create a batch that already holds the given number of lines.
+
+    Args:
+        held_lines: number of order lines allocated to the batch.
+
+    Returns:
+        batch: purchased batch.
+    """
+    batch = Batch("busy-batch", "BUSY-SOFA", held_lines + NUMBER, eta=None)
+    for i in range(held_lines):
+        batch.allocate(OrderLine(f"order-{i}", "BUSY-SOFA", 1))
+    return batch
+
+
+def time_allocation(held_lines: int) -> float:
+    """Time one can_allocate + allocate round trip on a busy batch.
+
+    Args:
+        held_lines: number of order lines allocated to the batch.
+
+    Returns:
+        seconds: best time per allocation.
+    """
+    batch = make_busy_batch(held_lines)
+    lines = iter(
+        OrderLine(f"new-order-{i}", "BUSY-SOFA", 1)
+        for i in range(REPEAT * NUMBER)
+    )
+
+    def allocate_next() -> None:
+        line = next(lines)
+        if batch.can_allocate(line):
+            batch.allocate(line)
+
+    return min(timeit.repeat(allocate_next, repeat=REPEAT, number=NUMBER))
+
+
+def main() -> List[Tuple[int, float]]:
+    """Run the benchmark and print one row per batch size.
+
+    Returns:
+        results: held lines and microseconds per allocation.
+    """
+    results = []
+    print(f"{'held lines':>12} {'us/allocation':>14}")
+    for held_lines in HELD_LINES:
+        micros = time_allocation(held_lines) / NUMBER * 1e6
+        results.append((held_lines, micros))
+        print(f"{held_lines:>12} {micros:>14.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Load benchmark of the allocation coalescer on a popular SKU.
+
+Run with ``python -m benchmarks.bench_coalescer [--db-uri URI]``.
+Each level fires the same number of allocations for a single SKU from that
+many threads, one session and commit per request (direct) or through an
+AllocationCoalescer, and reports throughput, p99 latency and the requests
+that gave up after their version conflict retries.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import argparse
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from corelib.allocation.adapters.orm import (
+    metadata,
+    start_mappers,
+)
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+from corelib.allocation.service_layer.coalescer import AllocationCoalescer
+from corelib.exceptions import VersionConflict
+
+CONCURRENCY = (1, 8, 32)
+REQUESTS = 512
+
+
+def seed(get_session: sessionmaker) -> str:
+    """Create a batch large enough for every request of a run.
+
+    Args:
+        get_session: session factory.
+
+    Returns:
+        sku: the popular SKU of the run.
+    """
+    sku = f"HOT-{uuid.uuid4().hex[:8]}"
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch(f"batch-{sku}", sku, REQUESTS, eta=None)
+    )
+    session.commit()
+    session.close()
+    return sku
+
+
+def run(
+    allocate: Callable[[OrderLine], str], sku: str, concurrency: int
+) -> Tuple[float, float, int]:
+    """Fire the requests and time each of them.
+
+    Args:
+        allocate: allocation function.
+        sku: product identifier.
+        concurrency: number of client threads.
+
+    Returns:
+        throughput: allocations per second.
+        p99: 99th percentile latency, in milliseconds.
+        conflicts: requests that gave up after their retries.
+    """
+    latencies = []
+
+    def request(n: int) -> bool:
+        start = time.perf_counter()
+        try:
+            allocate(OrderLine(f"order-{n}", sku, 1))
+            return True
+        except VersionConflict:
+            return False
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    p99 = statistics.quantiles(latencies, n=100)[98] * 1000
+    return REQUESTS / elapsed, p99, results.count(False)
+
+
+def main(
+    argv: Optional[List[str]] = None,
+) -> List[Tuple[int, float, float, int, float, float, int]]:
+    """Run the benchmark and print one row per concurrency level.
+
+    Args:
+        argv: command line arguments, sys.argv by default.
+
+    Returns:
+        results: concurrency, then direct and coalesced allocations per
+            second, p99 milliseconds and requests that gave up.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default=None)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args(argv)
+    uri = args.db_uri or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    options = (
+        {"connect_args": {"timeout": 30, "check_same_thread": False}}
+        if uri.startswith("sqlite")
+        else {"pool_size": max(CONCURRENCY)}
+    )
+    engine = create_engine(uri, **options)
+    metadata.create_all(engine)
+    start_mappers()
+    get_session = sessionmaker(bind=engine)
+
+    def direct(line: OrderLine) -> str:
+        session = get_session()
+        try:
+            return services.allocate(
+                line, SQLAlchemyRepository(session), session
+            )
+        finally:
+            session.close()
+
+    coalescer = AllocationCoalescer(
+        get_session, window=args.window_ms / 1000, max_batch=args.max_batch
+    )
+
+    results = []
+    print(
+        f"{'concurrency':>12} {'direct/s':>9} {'p99 ms':>8} {'gave up':>8}"
+        f" {'coalesced/s':>12} {'p99 ms':>8} {'gave up':>8}"
+    )
+    for concurrency in CONCURRENCY:
+        plain = run(direct, seed(get_session), concurrency)
+        grouped = run(coalescer.allocate, seed(get_session), concurrency)
+        results.append((concurrency, *plain, *grouped))
+        print(
+            f"{concurrency:>12} {plain[0]:>9.1f} {plain[1]:>8.1f}"
+            f" {plain[2]:>8} {grouped[0]:>12.1f} {grouped[1]:>8.1f}"
+            f" {grouped[2]:>8}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Memory benchmark for the domain model objects.
+
+Run with ``python -m benchmarks.bench_domain_memory``. Reports the bytes
+allocated per order line and per batch, as plain domain objects, once the
+ORM mappers are started, as in production, as the unmapped compact types
+used by simulations, and per batch row of the columnar allocator used for
+large planning runs.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import tracemalloc
+from typing import (
+    Callable,
+    Dict,
+)
+
+from sqlalchemy.orm import clear_mappers
+
+from corelib.allocation.adapters.orm import start_mappers
+from corelib.allocation.domain.columnar import ColumnarAllocator
+from corelib.allocation.domain.compact import (
+    CompactBatch,
+    CompactLine,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+
+INSTANCES = 100_000
+
+
+def bytes_per_instance(factory: Callable[[int], object]) -> float:
+    """Measure the memory allocated per created instance.
+
+    The field values are created before tracing starts, so only the objects
+    themselves are accounted.
+
+    Args:
+        factory: callable building one instance from its index.
+
+    Returns:
+        bytes: traced bytes per instance.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    instances = [factory(i) for i in range(INSTANCES)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return (after - before) / INSTANCES
+
+
+def bytes_per_allocation(
+    batch: object, line: Callable[[int], object]
+) -> float:
+    """Measure the memory a batch holds per allocated line.
+
+    Args:
+        batch: Batch, of any representation, large enough for every line.
+        line: callable building one order line from its index.
+
+    Returns:
+        bytes: traced bytes per allocated line, the line included.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(INSTANCES):
+        batch.allocate(line(i))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / INSTANCES
+
+
+def bytes_per_row(batches: list) -> float:
+    """Measure the memory held by the columnar allocator per batch.
+
+    Args:
+        batches: Order batches, built before tracing starts.
+
+    Returns:
+        bytes: traced bytes per batch row.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    allocator = ColumnarAllocator(batches)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del allocator
+    return (after - before) / len(batches)
+
+
+def main() -> Dict[str, Dict[str, float]]:
+    """Run the benchmark and print bytes per instance and representation.
+
+    Returns:
+        results: bytes per object kind and representation.
+    """
+    orderids = [f"order-{i}" for i in range(INSTANCES)]
+    refs = [f"batch-{i}" for i in range(INSTANCES)]
+    skus = [f"SKU-{i % 100}" for i in range(INSTANCES)]
+
+    def measure() -> Dict[str, float]:
+        return {
+            "line": bytes_per_instance(
+                lambda i: OrderLine(orderids[i], "SOFA", 1)
+            ),
+            "batch": bytes_per_instance(
+                lambda i: Batch(refs[i], skus[i], 1, None)
+            ),
+            "allocation": bytes_per_allocation(
+                Batch("held", "SOFA", INSTANCES, None),
+                lambda i: OrderLine(orderids[i], "SOFA", 1),
+            ),
+        }
+
+    results = {"plain": measure()}
+    start_mappers()
+    try:
+        results["mapped"] = measure()
+    finally:
+        clear_mappers()
+    batches = [Batch(refs[i], skus[i], 1, None) for i in range(INSTANCES)]
+    results["compact"] = {
+        "line": bytes_per_instance(
+            lambda i: CompactLine(orderids[i], "SOFA", 1)
+        ),
+        "batch": bytes_per_instance(
+            lambda i: CompactBatch(refs[i], skus[i], 1, None)
+        ),
+        "allocation": bytes_per_allocation(
+            CompactBatch("held", "SOFA", INSTANCES, None),
+            lambda i: CompactLine(orderids[i], "SOFA", 1),
+        ),
+    }
+    results["columnar"] = {"batch": bytes_per_row(batches)}
+
+    representations = ("plain", "mapped", "compact", "columnar")
+    print(
+        f"{'object':>10}"
+        + "".join(f" {r + ' B':>11}" for r in representations)
+    )
+    for kind in ("line", "batch", "allocation"):
+        sizes = [results[r].get(kind) for r in representations]
+        print(
+            f"{kind:>10}"
+            + "".join(
+                f" {'-' if size is None else f'{size:.1f}':>11}"
+                for size in sizes
+            )
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Lookup latency benchmark of the batches table, without and with indexes.
+
+Run with ``python -m benchmarks.bench_schema_indexes [--sizes N ...]``.
+The table is grown to each size, ten batches per SKU, and the median
+latency of SQLAlchemyRepository.get and list_for_sku is measured on the
+legacy schema, without indexes, and again after upgrade_schema.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import (
+    create_engine,
+    insert,
+    text,
+)
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import sessionmaker
+
+from corelib.allocation.adapters.orm import (
+    batches,
+    metadata,
+    start_mappers,
+    upgrade_schema,
+)
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+
+SIZES = (10_000, 100_000, 1_000_000)
+BATCHES_PER_SKU = 10
+LOOKUPS = 200
+CHUNK = 50_000
+
+
+def grow(engine: Engine, start: int, stop: int) -> None:
+    """Insert the batches numbered from start to stop.
+
+    Args:
+        engine: Database engine.
+        start: First batch number.
+        stop: Batch number after the last one.
+
+    Returns:
+        None
+    """
+    for low in range(start, stop, CHUNK):
+        rows = [
+            dict(
+                reference=f"ref-{i}",
+                sku=f"SKU-{i // BATCHES_PER_SKU}",
+                _purchased_quantity=100,
+                eta=None,
+            )
+            for i in range(low, min(low + CHUNK, stop))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(batches), rows)
+
+
+def drop_indexes(engine: Engine) -> None:
+    """Emulate the legacy schema, created without any index.
+
+    Args:
+        engine: Database engine.
+
+    Returns:
+        None
+    """
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+
+def median_ms(lookup: Callable[[str], object], keys: List[str]) -> float:
+    """Return the median latency of a lookup, in milliseconds.
+
+    Args:
+        lookup: Function run once per key.
+        keys: Lookup keys.
+
+    Returns:
+        latency: median milliseconds per lookup.
+    """
+    timings = []
+    for key in keys:
+        start = time.perf_counter()
+        lookup(key)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def measure(engine: Engine, size: int) -> Tuple[float, float]:
+    """Time get by reference and list_for_sku on random existing keys.
+
+    Args:
+        engine: Database engine.
+        size: Number of batches in the table.
+
+    Returns:
+        latencies: median get and list_for_sku milliseconds.
+    """
+    session = sessionmaker(bind=engine)()
+    repo = SQLAlchemyRepository(session)
+    numbers = random.sample(range(size), LOOKUPS)
+    try:
+        get = median_ms(repo.get, [f"ref-{i}" for i in numbers])
+        session.expunge_all()
+        by_sku = median_ms(
+            repo.list_for_sku,
+            [f"SKU-{i // BATCHES_PER_SKU}" for i in numbers],
+        )
+    finally:
+        session.close()
+    return get, by_sku
+
+
+def main(
+    argv: Optional[List[str]] = None,
+) -> List[Tuple[int, float, float, float, float]]:
+    """Run the benchmark and print one row per table size.
+
+    Args:
+        argv: command line arguments, sys.argv by default.
+
+    Returns:
+        results: size, then get and list_for_sku milliseconds without
+            and with indexes.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args(argv)
+    engine = create_engine(f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    metadata.create_all(engine)
+    start_mappers()
+
+    results = []
+    print(
+        f"{'batches':>10} {'get ms':>8} {'sku ms':>8}"
+        f" {'get ms (ix)':>12} {'sku ms (ix)':>12}"
+    )
+    stored = 0
+    for size in sorted(args.sizes):
+        grow(engine, stored, size)
+        stored = size
+        drop_indexes(engine)
+        legacy = measure(engine, size)
+        upgrade_schema(engine)
+        indexed = measure(engine, size)
+        results.append((size, *legacy, *indexed))
+        print(
+            f"{size:>10} {legacy[0]:>8.3f} {legacy[1]:>8.3f}"
+            f" {indexed[0]:>12.3f} {indexed[1]:>12.3f}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
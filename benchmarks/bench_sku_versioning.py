@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Throughput of the per-SKU concurrency guards of services.allocate.
+
+Run with ``python -m benchmarks.bench_sku_versioning [--db-uri URI]``.
+The same number of allocations is fired from a pool of threads, either all
+on one hot SKU or each on its own SKU, with optimistic versioning or with
+the product row locked. SQLite ignores row locks, so both guards only
+differ against a server such as the docker-compose Postgres.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import argparse
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from corelib.allocation.adapters.orm import (
+    metadata,
+    start_mappers,
+)
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+from corelib.exceptions import VersionConflict
+
+THREADS = 16
+REQUESTS = 400
+
+
+def run(
+    get_session: sessionmaker, concurrency: services.Concurrency, hot: bool
+) -> Tuple[float, int]:
+    """Seed the stock, fire the allocations and time them.
+
+    Args:
+        get_session: session factory.
+        concurrency: guard used by the service.
+        hot: all the requests on one SKU, else one SKU per request.
+
+    Returns:
+        throughput: allocations per second.
+        conflicts: requests that gave up after their retries.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    skus = [f"{run_id}-{0 if hot else n}" for n in range(REQUESTS)]
+    session = get_session()
+    repo = SQLAlchemyRepository(session)
+    for sku in sorted(set(skus)):
+        repo.add(Batch(f"batch-{sku}", sku, REQUESTS, eta=None))
+    session.commit()
+    session.close()
+
+    def request(n: int) -> bool:
+        session = get_session()
+        try:
+            services.allocate(
+                OrderLine(f"order-{n}", skus[n], 1),
+                SQLAlchemyRepository(session),
+                session,
+                concurrency=concurrency,
+            )
+            return True
+        except VersionConflict:
+            return False
+        finally:
+            session.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = list(executor.map(request, range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    return REQUESTS / elapsed, results.count(False)
+
+
+def main(
+    argv: Optional[List[str]] = None,
+) -> List[Tuple[str, str, float, int]]:
+    """Run the benchmark and print one row per guard and workload.
+
+    Args:
+        argv: command line arguments, sys.argv by default.
+
+    Returns:
+        results: guard, workload, allocations per second and conflicts.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default=None)
+    args = parser.parse_args(argv)
+    uri = args.db_uri or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    options = (
+        {"connect_args": {"timeout": 30, "check_same_thread": False}}
+        if uri.startswith("sqlite")
+        else {"pool_size": THREADS}
+    )
+    engine = create_engine(uri, **options)
+    metadata.create_all(engine)
+    start_mappers()
+    get_session = sessionmaker(bind=engine)
+
+    results = []
+    print(f"{'guard':>12} {'workload':>9} {'alloc/s':>9} {'gave up':>8}")
+    for concurrency in services.Concurrency:
+        for workload in ("hot", "spread"):
+            throughput, conflicts = run(
+                get_session, concurrency, workload == "hot"
+            )
+            results.append(
+                (concurrency.value, workload, throughput, conflicts)
+            )
+            print(
+                f"{concurrency.value:>12} {workload:>9}"
+                f" {throughput:>9.1f} {conflicts:>8}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
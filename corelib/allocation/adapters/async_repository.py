@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Async repository module.
+
+Repository pattern over SQLAlchemy's asyncio extension, so one process can
+keep many database round trips in flight. Lazy loading is not available on
+an async session, hence batch allocations are always loaded eagerly.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from typing import (
+    List,
+    Optional,
+)
+
+from sqlalchemy import (
+    exists,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql import Select
+
+import corelib.allocation.adapters.orm as orm
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderId,
+    Reference,
+    Sku,
+)
+from corelib.exceptions import VersionConflict
+
+
+class AsyncSQLAlchemyRepository:
+    """Async SQL repository."""
+
+    def __init__(self, session: AsyncSession):
+        """Initialize an async sql repository with the provided session.
+
+        Args:
+            session: Async database session, created with
+                expire_on_commit=False since expired attributes cannot be
+                reloaded implicitly.
+        """
+        self.session = session
+
+    @staticmethod
+    def _select() -> Select:
+        """Start a batches query loading their allocations eagerly.
+
+        Returns:
+            query: Batch select statement.
+        """
+        return select(Batch).options(selectinload(Batch._allocations))
+
+    def add(self, batch: Batch) -> None:
+        """Add new batch in the SQL database via repository pattern.
+
+        Args:
+            batch: Order batch that will be added to the repository.
+
+        Returns:
+            None
+        """
+        self.session.add(batch)
+
+    async def get(self, reference: Reference) -> Batch:
+        """Return a previously added item to de SQL database via repository.
+
+        Args:
+            reference: Order batch reference.
+
+        Returns:
+            batch: Order batch.
+        """
+        result = await self.session.execute(
+            self._select().filter_by(reference=reference)
+        )
+        return result.scalar_one()
+
+    async def get_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Batch]:
+        """Return the batch an order line is allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Order batch, None if the line is not allocated.
+        """
+        result = await self.session.execute(
+            self._select()
+            .join(Batch._allocations)
+            .filter(
+                orm.order_lines.c.orderid == orderid,
+                orm.order_lines.c.sku == sku,
+            )
+            .limit(1)
+        )
+        return result.scalars().first()
+
+    async def get_reference_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Reference]:
+        """Return the batch reference of an order line, no batch loaded.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Batch reference, None if the line is not allocated.
+        """
+        batches = orm.batches
+        lines = orm.order_lines
+        allocations = orm.allocations
+
+        await self.session.flush()
+        result = await self.session.execute(
+            select(batches.c.reference)
+            .join(allocations, allocations.c.batch_id == batches.c.id)
+            .join(lines, allocations.c.orderline_id == lines.c.id)
+            .where(lines.c.orderid == orderid, lines.c.sku == sku)
+            .limit(1)
+        )
+        return result.scalar()
+
+    async def list_for_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches the lines of an order are allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        result = await self.session.execute(
+            self._select()
+            .join(Batch._allocations)
+            .filter(orm.order_lines.c.orderid == orderid)
+        )
+        return result.scalars().all()
+
+    async def list(self) -> List[Batch]:
+        """Return the open order batches saved in SQL database.
+
+        Returns:
+            batches: List of all open batches in SQL database.
+        """
+        result = await self.session.execute(
+            self._select().filter_by(closed=False)
+        )
+        return result.scalars().all()
+
+    async def list_for_sku(self, sku: Sku) -> List[Batch]:
+        """Return the open batches of one product saved in SQL database.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the open batches with that sku.
+        """
+        result = await self.session.execute(
+            self._select().filter_by(sku=sku, closed=False)
+        )
+        return result.scalars().all()
+
+    async def has_sku(self, sku: Sku) -> bool:
+        """Test if there is any batch of a product, closed ones included.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            True if at least one batch has that sku.
+        """
+        table = orm.batches
+        result = await self.session.execute(
+            select(exists().where(table.c.sku == sku))
+        )
+        return result.scalar()
+
+    async def get_version(
+        self, sku: Sku, for_update: bool = False
+    ) -> Optional[int]:
+        """Return the version of a product, read before loading its batches.
+
+        Args:
+            sku: Product identifier.
+            for_update: Lock the product row until the transaction ends.
+
+        Returns:
+            version: Product version, None if it was never allocated.
+        """
+        products = orm.products
+        query = select(products.c.version_number).where(products.c.sku == sku)
+        if for_update:
+            query = query.with_for_update()
+        return (await self.session.execute(query)).scalar()
+
+    async def bump_version(self, sku: Sku, expected: Optional[int]) -> None:
+        """Increment the version of a product, if nobody else did it first.
+
+        Args:
+            sku: Product identifier.
+            expected: Version returned by get_version.
+
+        Returns:
+            None
+        """
+        products = orm.products
+        if expected is None:
+            try:
+                await self.session.execute(
+                    insert(products).values(sku=sku, version_number=1)
+                )
+            except IntegrityError as e:
+                raise VersionConflict(f"Product {sku} was created") from e
+            return
+
+        result = await self.session.execute(
+            update(products)
+            .where(
+                products.c.sku == sku,
+                products.c.version_number == expected,
+            )
+            .values(version_number=expected + 1)
+        )
+        if result.rowcount != 1:
+            raise VersionConflict(
+                f"Product {sku} changed since version {expected}"
+            )
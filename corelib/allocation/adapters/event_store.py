@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Event store module.
+
+Append-only log of the domain events of each SKU plus periodic snapshots of
+its batches, kept in their own tables so they can live alongside the
+allocation schema or in a local SQLite file. The state of a SKU is its
+latest snapshot with the events logged after it replayed on top.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import json
+from dataclasses import (
+    dataclass,
+    field,
+    fields,
+)
+from datetime import date
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    delete,
+    func,
+    insert,
+    select,
+)
+from sqlalchemy.engine.base import Engine
+
+from corelib.allocation.domain.events import (
+    Event,
+    replay,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+    Reference,
+    Sku,
+)
+from corelib.exceptions import VersionConflict
+
+metadata = MetaData()
+
+events = Table(
+    "events",
+    metadata,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("sku", String(255), nullable=False, index=True),
+    Column("kind", String(64), nullable=False),
+    Column("payload", Text, nullable=False),
+)
+
+snapshots = Table(
+    "snapshots",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("seq", Integer, nullable=False),
+    Column("state", Text, nullable=False),
+)
+
+
+@dataclass
+class SkuState:
+    """Batches of a SKU rebuilt from the store."""
+
+    seq: int = 0
+    batches: Dict[Reference, Batch] = field(default_factory=dict)
+    tail: int = 0
+
+
+def _encode(event: Event) -> str:
+    """Serialize the fields of an event but its sku, stored in a column."""
+    payload = {
+        f.name: getattr(event, f.name)
+        for f in fields(event)
+        if f.name != "sku"
+    }
+    if isinstance(payload.get("eta"), date):
+        payload["eta"] = payload["eta"].isoformat()
+    return json.dumps(payload)
+
+
+def _decode(sku: Sku, kind: str, payload: str) -> Event:
+    """Deserialize an event stored by _encode."""
+    kinds = {cls.__name__: cls for cls in Event.__subclasses__()}
+    values = json.loads(payload)
+    if values.get("eta") is not None:
+        values["eta"] = date.fromisoformat(values["eta"])
+    return kinds[kind](sku=sku, **values)
+
+
+def _dump_batches(batches: Iterable[Batch]) -> str:
+    """Serialize the state of batches, allocated lines included."""
+    return json.dumps(
+        [
+            dict(
+                reference=b.reference,
+                qty=b._purchased_quantity,
+                eta=b.eta.isoformat() if b.eta else None,
+                allocations=sorted(
+                    [line.orderid, line.qty] for line in b._allocations
+                ),
+            )
+            for b in batches
+        ]
+    )
+
+
+def _load_batches(sku: Sku, state: str) -> Dict[Reference, Batch]:
+    """Deserialize batches stored by _dump_batches."""
+    batches = {}
+    for row in json.loads(state):
+        eta = date.fromisoformat(row["eta"]) if row["eta"] else None
+        batch = Batch(row["reference"], sku, row["qty"], eta)
+        for orderid, qty in row["allocations"]:
+            batch.allocate(OrderLine(orderid, sku, qty))
+        batches[batch.reference] = batch
+    return batches
+
+
+class SQLEventStore:
+    """Event log and snapshots stored through a SQLAlchemy engine."""
+
+    def __init__(self, engine: Engine):
+        """Initialize the store, creating its tables if missing.
+
+        Args:
+            engine: Database engine, e.g. on a local SQLite file.
+        """
+        self.engine = engine
+        metadata.create_all(engine)
+
+    def append(
+        self, new_events: Iterable[Event], after: Optional[int] = None
+    ) -> int:
+        """Append events to the log in a single transaction.
+
+        With after, the append raises VersionConflict if events of the same
+        SKUs were logged after that sequence number, i.e. by another writer
+        since the state of the caller was loaded.
+
+        Args:
+            new_events: Domain events, oldest first.
+            after: Sequence number of the last event of their SKUs applied
+                by the writer, not checked if not provided.
+
+        Returns:
+            seq: Sequence number of the last event in the log.
+        """
+        new_events = list(new_events)
+        seq = 0
+        with self.engine.begin() as conn:
+            if after is not None:
+                skus = sorted({event.sku for event in new_events})
+                last = conn.execute(
+                    select(func.max(events.c.seq)).where(
+                        events.c.sku.in_(skus)
+                    )
+                ).scalar()
+                if (last or 0) > after:
+                    raise VersionConflict(
+                        f"Events of {', '.join(skus)} logged after {after}"
+                    )
+            for event in new_events:
+                [seq] = conn.execute(
+                    insert(events).values(
+                        sku=event.sku,
+                        kind=type(event).__name__,
+                        payload=_encode(event),
+                    )
+                ).inserted_primary_key
+        return seq
+
+    def read(self, sku: Sku, after: int = 0) -> Iterator[Tuple[int, Event]]:
+        """Return the events of a SKU logged after a sequence number.
+
+        Args:
+            sku: Product identifier.
+            after: Sequence number already applied.
+
+        Returns:
+            events: Sequence number and event, oldest first.
+        """
+        query = (
+            select(events.c.seq, events.c.kind, events.c.payload)
+            .where(events.c.sku == sku, events.c.seq > after)
+            .order_by(events.c.seq)
+        )
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        for seq, kind, payload in rows:
+            yield seq, _decode(sku, kind, payload)
+
+    def save_snapshot(
+        self, sku: Sku, seq: int, batches: Iterable[Batch]
+    ) -> None:
+        """Replace the snapshot of a SKU.
+
+        Args:
+            sku: Product identifier.
+            seq: Sequence number of the last event applied to the batches.
+            batches: Batches of the SKU.
+
+        Returns:
+            None
+        """
+        state = _dump_batches(batches)
+        with self.engine.begin() as conn:
+            conn.execute(delete(snapshots).where(snapshots.c.sku == sku))
+            conn.execute(
+                insert(snapshots).values(sku=sku, seq=seq, state=state)
+            )
+
+    def load_snapshot(self, sku: Sku) -> Tuple[int, Dict[Reference, Batch]]:
+        """Return the latest snapshot of a SKU.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            seq: Sequence number of the snapshot, 0 if there is none.
+            batches: Batches by reference.
+        """
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(snapshots.c.seq, snapshots.c.state).where(
+                    snapshots.c.sku == sku
+                )
+            ).first()
+        if row is None:
+            return 0, {}
+        return row.seq, _load_batches(sku, row.state)
+
+    def load(self, sku: Sku) -> SkuState:
+        """Rebuild the batches of a SKU from its snapshot and log tail.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            state: Batches, last sequence number applied and number of
+                events replayed after the snapshot.
+        """
+        seq, batches = self.load_snapshot(sku)
+        tail: List[Event] = []
+        for seq, event in self.read(sku, after=seq):
+            tail.append(event)
+        return SkuState(seq, replay(batches, tail), len(tail))
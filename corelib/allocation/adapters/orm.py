@@ -5,41 +5,110 @@ Created on: 20/6/22
 @author: Heber Trujillo <heber.trj.urt@gmail.com>
 Licence,
 """
+from enum import Enum
+from typing import (
+    Iterable,
+    List,
+    Optional,
+)
+
 from sqlalchemy import (
+    Boolean,
     Column,
     Date,
     ForeignKey,
+    Index,
     Integer,
     MetaData,
     String,
     Table,
+    delete,
+    event,
+    exists,
+    false,
+    func,
+    insert,
+    inspect,
+    select,
+    update,
+)
+from sqlalchemy.engine.base import (
+    Connection,
+    Engine,
 )
 from sqlalchemy.orm import (
     mapper,
     relationship,
 )
+from sqlalchemy.orm.session import Session
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.elements import Label
 
 import corelib.allocation.domain.model as model
 
 metadata = MetaData()
 
+
+class AllocationsLoading(Enum):
+    """Loading strategies for the allocations of a batch.
+
+    The aggregated strategy loads only the allocated quantity, summed by the
+    database, and the order lines of a batch on demand.
+    """
+
+    lazy = "select"
+    selectin = "selectin"
+    joined = "joined"
+    aggregated = "aggregated"
+
+    @property
+    def relationship_loading(self) -> str:
+        """Loader strategy name of the _allocations relationship."""
+        if self is AllocationsLoading.aggregated:
+            return AllocationsLoading.lazy.value
+        return self.value
+
+
 order_lines = Table(
     "order_lines",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("sku", String(255)),
+    Column("sku", String(255), index=True),
     Column("qty", Integer, nullable=False),
     Column("orderid", String(255)),
+    Index("ix_order_lines_orderid_sku", "orderid", "sku", unique=True),
+    sqlite_autoincrement=True,
 )
 
 batches = Table(
     "batches",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("reference", String(255)),
-    Column("sku", String(255)),
+    Column("reference", String(255), unique=True, index=True),
+    Column("sku", String(255), index=True),
     Column("_purchased_quantity", Integer, nullable=False),
     Column("eta", Date, nullable=True),
+    Column("closed", Boolean, nullable=False, server_default=false()),
+    Index("ix_batches_sku_closed", "sku", "closed"),
+    sqlite_autoincrement=True,
+)
+
+
+products = Table(
+    "products",
+    metadata,
+    Column("sku", String(255), primary_key=True),
+    Column("version_number", Integer, nullable=False, server_default="0"),
+)
+
+
+availability = Table(
+    "availability",
+    metadata,
+    Column("batchref", String(255), primary_key=True),
+    Column("sku", String(255), nullable=False, index=True),
+    Column("eta", Date, nullable=True),
+    Column("available_qty", Integer, nullable=False),
 )
 
 
@@ -47,14 +116,264 @@ allocations = Table(
     "allocations",
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
-    Column("orderline_id", ForeignKey("order_lines.id")),
-    Column("batch_id", ForeignKey("batches.id")),
+    Column("orderline_id", ForeignKey("order_lines.id"), index=True),
+    Column("batch_id", ForeignKey("batches.id"), index=True),
+    sqlite_autoincrement=True,
 )
 
 
-def start_mappers() -> None:
+def _archive_of(table: Table) -> Table:
+    """Define the archive of a table: same columns, no constraints.
+
+    Rows keep their ids when archived, so the archived allocations still
+    join their archived batches and order lines. The hot tables never reuse
+    the ids of deleted rows, AUTOINCREMENT on SQLite, hence an id is
+    archived once.
+
+    Args:
+        table: Table whose rows get archived.
+
+    Returns:
+        archive: archived_<name> table.
+    """
+    return Table(
+        f"archived_{table.name}",
+        metadata,
+        *[
+            Column(
+                c.name,
+                c.type,
+                primary_key=c.primary_key,
+                autoincrement=False,
+                nullable=c.nullable,
+            )
+            for c in table.columns
+        ],
+    )
+
+
+archived_order_lines = _archive_of(order_lines)
+archived_batches = _archive_of(batches)
+archived_allocations = _archive_of(allocations)
+
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    """Bring an existing database up to the current schema.
+
+    Missing tables are created and the columns and indexes added to
+    existing tables since they were created, so the upgrade can run at
+    every deployment. The unique indexes on batches.reference and on the
+    order line orderid and sku cannot be built while duplicates remain: the
+    database error is raised and the whole upgrade rolls back, where the
+    database has transactional DDL. An empty availability table is filled
+    from the batches, so a rerun after a failed upgrade still fills it.
+
+    Args:
+        engine: Database engine.
+
+    Returns:
+        created: Names of the indexes created.
+    """
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+        existing = {
+            ix["name"] for name in tables for ix in inspector.get_indexes(name)
+        }
+        columns = {
+            name: {c["name"] for c in inspector.get_columns(name)}
+            for name in tables
+        }
+    created = []
+    with engine.begin() as conn:
+        metadata.create_all(conn)
+        for table in metadata.sorted_tables:
+            for column in table.columns:
+                if (
+                    table.name in tables
+                    and column.name not in columns[table.name]
+                ):
+                    conn.execute(
+                        f"ALTER TABLE {table.name} ADD COLUMN "
+                        f"{CreateColumn(column).compile(conn)}"
+                    )
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                if index.name in existing:
+                    continue
+                if table.name in tables:
+                    index.create(conn)
+                created.append(index.name)
+        if not conn.execute(
+            select(exists().select_from(availability))
+        ).scalar():
+            refresh_availability(conn)
+    return created
+
+
+def refresh_availability(
+    conn: Connection, references: Optional[Iterable[str]] = None
+) -> None:
+    """Recompute availability rows from the batches and their allocations.
+
+    Used by the writes bypassing the unit of work, which keeps the rows of
+    the batches it flushes up to date by itself. Closed batches have no
+    row.
+
+    Args:
+        conn: Connection, or session, of the writing transaction.
+        references: Batches to refresh, all of them if not provided.
+
+    Returns:
+        None
+    """
+    rows = select(
+        batches.c.sku,
+        batches.c.reference,
+        batches.c.eta,
+        batches.c._purchased_quantity - allocated_quantity().element,
+    ).where(~batches.c.closed)
+    stale = delete(availability)
+    if references is not None:
+        references = list(references)
+        rows = rows.where(batches.c.reference.in_(references))
+        stale = stale.where(availability.c.batchref.in_(references))
+    conn.execute(stale)
+    conn.execute(
+        insert(availability).from_select(
+            ["sku", "batchref", "eta", "available_qty"], rows
+        )
+    )
+
+
+def bump_versions(conn: Connection, skus: Iterable[str]) -> None:
+    """Increment the version of the products whose batches were written.
+
+    Used by the writes changing batches outside of an allocation, so the
+    transactions that read a product before them fail their version check
+    and the batches cached at an older version are not served anymore.
+    Products never versioned before get their first version.
+
+    Args:
+        conn: Connection, or session, of the writing transaction.
+        skus: Product identifiers.
+
+    Returns:
+        None
+    """
+    skus = sorted(set(skus))
+    if not skus:
+        return
+    conn.execute(
+        update(products)
+        .where(products.c.sku.in_(skus))
+        .values(version_number=products.c.version_number + 1)
+    )
+    versioned = set(
+        conn.execute(
+            select(products.c.sku).where(products.c.sku.in_(skus))
+        ).scalars()
+    )
+    missing = [sku for sku in skus if sku not in versioned]
+    if missing:
+        conn.execute(
+            insert(products).values(
+                [dict(sku=sku, version_number=1) for sku in missing]
+            )
+        )
+
+
+def _sync_availability(session: Session, *args) -> None:
+    """Write the availability of the batches being flushed.
+
+    Runs after the flush, inside its transaction, so the read model commits
+    or rolls back with the allocations.
+
+    Args:
+        session: Session being flushed.
+        *args: Event specific arguments, ignored.
+
+    Returns:
+        None
+    """
+    changed = [
+        obj
+        for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, model.Batch) and not obj.closed
+    ]
+    removed = [
+        obj.reference
+        for obj in list(session.deleted) + list(session.dirty)
+        if isinstance(obj, model.Batch) and obj not in changed
+    ]
+    references = [b.reference for b in changed] + removed
+    if not references:
+        return
+
+    conn = session.connection()
+    conn.execute(
+        delete(availability).where(availability.c.batchref.in_(references))
+    )
+    if changed:
+        conn.execute(
+            insert(availability),
+            [
+                dict(
+                    sku=b.sku,
+                    batchref=b.reference,
+                    eta=b.eta,
+                    available_qty=b.available_quantity,
+                )
+                for b in changed
+            ],
+        )
+
+
+def allocated_quantity() -> Label:
+    """Sum, inside the database, the quantity allocated to each batch.
+
+    The subquery is correlated to the batches table, so it only visits the
+    allocations of the batches being loaded.
+
+    Returns:
+        allocated_quantity: scalar subquery labeled allocated_quantity.
+    """
+    return (
+        select(func.coalesce(func.sum(order_lines.c.qty), 0))
+        .select_from(
+            allocations.join(
+                order_lines, allocations.c.orderline_id == order_lines.c.id
+            )
+        )
+        .where(allocations.c.batch_id == batches.c.id)
+        .scalar_subquery()
+        .label("allocated_quantity")
+    )
+
+
+def _reset_allocation_cache(batch: model.Batch, *args) -> None:
+    """Invalidate the batch derived state after the ORM touches it.
+
+    Args:
+        batch: Order batch being loaded, refreshed or expired, None if it
+            was already garbage collected.
+        *args: Event specific arguments, ignored.
+
+    Returns:
+        None.
+    """
+    if batch is not None:
+        batch.reset_allocation_cache()
+
+
+def start_mappers(
+    allocations_loading: AllocationsLoading = AllocationsLoading.selectin,
+) -> None:
     """Map domain object to database tables.
 
+    Args:
+        allocations_loading: default strategy to load batch allocations,
+            selectin avoids one SELECT per batch when checking availability.
+
     Returns:
         None.
     """
@@ -67,7 +386,17 @@ def start_mappers() -> None:
                 lines_mapper,
                 secondary=allocations,
                 collection_class=set,
-            )
+                cascade="all, delete-orphan",
+                single_parent=True,
+                lazy=allocations_loading.relationship_loading,
+            ),
         },
     )
+    if not event.contains(Session, "after_flush", _sync_availability):
+        event.listen(Session, "after_flush", _sync_availability)
+    for identifier in ("load", "refresh", "expire"):
+        if not event.contains(
+            model.Batch, identifier, _reset_allocation_cache
+        ):
+            event.listen(model.Batch, identifier, _reset_allocation_cache)
     return lines_mapper
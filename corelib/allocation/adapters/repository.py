@@ -8,29 +8,78 @@ Created on: 20/6/22
 @author: Heber Trujillo <heber.trj.urt@gmail.com>
 Licence,
 """
+import threading
+import time
+import zlib
 from abc import (
     ABC,
     abstractmethod,
 )
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
 from enum import Enum
+from itertools import islice
 from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
     List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
     Type,
 )
 
+from sqlalchemy import (
+    bindparam,
+    delete,
+    event,
+    exists,
+    insert,
+    inspect,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import (
+    joinedload,
+    lazyload,
+    make_transient_to_detached,
+    selectinload,
+)
+from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.query import Query
 from sqlalchemy.orm.session import Session
+from sqlalchemy.orm.util import identity_key
 
+import corelib.allocation.adapters.orm as orm
+from corelib.allocation.adapters.orm import (
+    AllocationsLoading,
+    allocated_quantity,
+)
 from corelib.allocation.domain.model import (
     Batch,
+    OrderId,
+    OrderLine,
+    Quantity,
     Reference,
+    Sku,
 )
+from corelib.exceptions import VersionConflict
 
 
 class RepositoryTyep(Enum):
     """Available repository implementations (adapters)."""
 
-    sql: str = "SQLAlchemyRepository"
-    in_memory: str = "InMemoryRepository"
+    sql = "SQLAlchemyRepository"
+    in_memory = "InMemoryRepository"
+    caching = "CachingRepository"
+    sharded = "ShardedRepository"
 
 
 class AbstractRepository(ABC):
@@ -48,6 +97,21 @@ class AbstractRepository(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def add_many(self, batches: Iterable[Batch]) -> int:
+        """Add or update many batches, matched by reference.
+
+        Batches already in the repository get their purchased quantity and
+        ETA updated.
+
+        Args:
+            batches: Order batches, consumed as a stream.
+
+        Returns:
+            count: Number of batches added or updated.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def get(self, reference: Reference) -> Batch:
         """Return a previously added item.
@@ -60,21 +124,182 @@ class AbstractRepository(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def list(self) -> List[Batch]:
+        """Return the open batches of every product.
+
+        Returns:
+            batches: List of all open batches.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_for_sku(self, sku: Sku) -> List[Batch]:
+        """Return the batches of one product.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the batches with that sku.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def has_sku(self, sku: Sku) -> bool:
+        """Test if there is any batch of a product.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            True if at least one batch has that sku.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_version(self, sku: Sku, for_update: bool = False) -> Optional[int]:
+        """Return the version of a product, read before loading its batches.
+
+        Args:
+            sku: Product identifier.
+            for_update: Lock the product row until the transaction ends.
+
+        Returns:
+            version: Product version, None if it was never allocated.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def bump_version(self, sku: Sku, expected: Optional[int]) -> None:
+        """Increment the version of a product, if nobody else did it first.
+
+        Args:
+            sku: Product identifier.
+            expected: Version returned by get_version.
+
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_by_order(self, orderid: OrderId, sku: Sku) -> Optional[Batch]:
+        """Return the batch an order line is allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Order batch, None if the line is not allocated.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_reference_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Reference]:
+        """Return the reference of the batch an order line is allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Batch reference, None if the line is not allocated.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_for_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches the lines of an order are allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def deallocate(self, orderid: OrderId, sku: Sku) -> Optional[Reference]:
+        """Cancel the allocation of an order line.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Reference of the batch the line was deallocated from,
+                None if the line is not allocated.
+        """
+        raise NotImplementedError
+
 
 class SQLAlchemyRepository(AbstractRepository):
     """SQL repository."""
 
-    def __init__(self, session: Session):
+    loaders = {
+        AllocationsLoading.lazy: lazyload,
+        AllocationsLoading.selectin: selectinload,
+        AllocationsLoading.joined: joinedload,
+        AllocationsLoading.aggregated: lazyload,
+    }
+
+    def __init__(
+        self,
+        session: Session,
+        allocations_loading: Optional[AllocationsLoading] = None,
+    ):
         """Initialize a sql repository with the provided session.
 
         Args:
             session: Database session.
+            allocations_loading: strategy to load batch allocations, the
+                mapping default is used if not provided.
         """
         self.session = session
+        self.allocations_loading = allocations_loading
+
+    def _query(self) -> Query:
+        """Start a batches query using the configured loading strategy.
+
+        Returns:
+            query: Batch query.
+        """
+        query = self.session.query(Batch)
+        if self.allocations_loading is not None:
+            loader = self.loaders[self.allocations_loading]
+            query = query.options(loader(Batch._allocations))
+        if self.allocations_loading is AllocationsLoading.aggregated:
+            query = query.add_columns(allocated_quantity())
+        return query
+
+    def _batches(self, rows: Iterable) -> List[Batch]:
+        """Return the batches of a query, seeding aggregated quantities.
+
+        Args:
+            rows: Rows returned by a query started with _query.
+
+        Returns:
+            batches: Order batches.
+        """
+        if self.allocations_loading is not AllocationsLoading.aggregated:
+            return list(rows)
+        batches = []
+        for batch, allocated in rows:
+            batch.seed_allocated_quantity(allocated)
+            batches.append(batch)
+        return batches
 
     def add(self, batch: Batch) -> None:
         """Add new batch in the SQL database via repository pattern.
 
+        The version of its product is bumped, so every worker sees the new
+        batch on its next allocation of the sku.
+
         Args:
             batch: Order batch that will be added to the repository.
 
@@ -82,6 +307,70 @@ class SQLAlchemyRepository(AbstractRepository):
             None
         """
         self.session.add(batch)
+        orm.bump_versions(self.session, [batch.sku])
+
+    def add_many(
+        self, batches: Iterable[Batch], chunk_size: int = 1000
+    ) -> int:
+        """Upsert batches in chunks with multi-row statements.
+
+        Each chunk costs one SELECT to find the references already stored,
+        one multi-row INSERT for the new batches, one UPDATE executemany
+        for the existing ones, the refresh of their availability rows and
+        the bump of their product versions, so the stream is never held in
+        memory. The statements bypass the unit of work: batches already
+        loaded in the session are not refreshed.
+
+        Args:
+            batches: Order batches, consumed as a stream.
+            chunk_size: Number of batches written per round trip.
+
+        Returns:
+            count: Number of batches added or updated.
+        """
+        table = orm.batches
+        count = 0
+        for chunk in _chunked(batches, chunk_size):
+            rows = {
+                b.reference: dict(
+                    reference=b.reference,
+                    sku=b.sku,
+                    _purchased_quantity=b._purchased_quantity,
+                    eta=b.eta,
+                )
+                for b in chunk
+            }
+            existing = set(
+                self.session.execute(
+                    select(table.c.reference).where(
+                        table.c.reference.in_(list(rows))
+                    )
+                ).scalars()
+            )
+            new = [row for ref, row in rows.items() if ref not in existing]
+            if new:
+                self.session.execute(insert(table).values(new))
+            if existing:
+                self.session.execute(
+                    update(table)
+                    .where(table.c.reference == bindparam("b_reference"))
+                    .values(
+                        _purchased_quantity=bindparam("b_qty"),
+                        eta=bindparam("b_eta"),
+                    ),
+                    [
+                        dict(
+                            b_reference=ref,
+                            b_qty=rows[ref]["_purchased_quantity"],
+                            b_eta=rows[ref]["eta"],
+                        )
+                        for ref in existing
+                    ],
+                )
+            orm.refresh_availability(self.session, rows)
+            orm.bump_versions(self.session, {b.sku for b in chunk})
+            count += len(rows)
+        return count
 
     def get(self, reference: Reference) -> Batch:
         """Return a previously added item to de SQL database via repository.
@@ -92,23 +381,425 @@ class SQLAlchemyRepository(AbstractRepository):
         Returns:
             batch: Order batch.
         """
-        return self.session.query(Batch).filter_by(reference=reference).one()
+        [batch] = self._batches(
+            [self._query().filter_by(reference=reference).one()]
+        )
+        return batch
+
+    def get_by_order(self, orderid: OrderId, sku: Sku) -> Optional[Batch]:
+        """Return the batch an order line is allocated to, via an index join.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Order batch, None if the line is not allocated.
+        """
+        rows = (
+            self._query()
+            .join(Batch._allocations)
+            .filter(
+                orm.order_lines.c.orderid == orderid,
+                orm.order_lines.c.sku == sku,
+            )
+            .limit(1)
+        )
+        return next(iter(self._batches(rows)), None)
+
+    def get_reference_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Reference]:
+        """Return the batch reference of an order line, no batch loaded.
+
+        A single scalar SELECT joining the line, through the orderid and sku
+        index, to its allocation and batch.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Batch reference, None if the line is not allocated.
+        """
+        batches = orm.batches
+        lines = orm.order_lines
+        allocations = orm.allocations
+
+        self.session.flush()
+        return self.session.execute(
+            select(batches.c.reference)
+            .join(allocations, allocations.c.batch_id == batches.c.id)
+            .join(lines, allocations.c.orderline_id == lines.c.id)
+            .where(lines.c.orderid == orderid, lines.c.sku == sku)
+            .limit(1)
+        ).scalar()
+
+    def list_for_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches of an order, via the orderid and sku index.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        return self._batches(
+            self._query()
+            .join(Batch._allocations)
+            .filter(orm.order_lines.c.orderid == orderid)
+        )
+
+    def deallocate(self, orderid: OrderId, sku: Sku) -> Optional[Reference]:
+        """Cancel the allocation of an order line, no batch loaded.
+
+        One SELECT finds the line and its batch through the orderid and sku
+        index, two DELETEs remove the allocation and the line, and the
+        availability row of the batch gets the quantity back, as
+        allocate_in_database does. A closed batch is reopened, as
+        Batch.deallocate does, and gets its availability row back. A batch
+        of the session holding the line has its allocations and closed
+        flag expired, they are reloaded on next access.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Reference of the batch the line was deallocated from,
+                None if the line is not allocated.
+        """
+        batches = orm.batches
+        lines = orm.order_lines
+        allocations = orm.allocations
+
+        self.session.flush()
+        row = self.session.execute(
+            select(batches.c.id, batches.c.reference, lines.c.id, lines.c.qty)
+            .select_from(batches)
+            .join(allocations, allocations.c.batch_id == batches.c.id)
+            .join(lines, allocations.c.orderline_id == lines.c.id)
+            .where(lines.c.orderid == orderid, lines.c.sku == sku)
+            .limit(1)
+        ).first()
+        if row is None:
+            return None
+
+        batch_id, reference, orderline_id, qty = row
+        self.session.execute(
+            delete(allocations).where(
+                allocations.c.orderline_id == orderline_id
+            )
+        )
+        self.session.execute(delete(lines).where(lines.c.id == orderline_id))
+        reopened = self.session.execute(
+            update(batches)
+            .where(batches.c.id == batch_id, batches.c.closed)
+            .values(closed=False)
+        ).rowcount
+        if reopened:
+            orm.refresh_availability(self.session, [reference])
+        else:
+            self.session.execute(
+                update(orm.availability)
+                .where(orm.availability.c.batchref == reference)
+                .values(available_qty=orm.availability.c.available_qty + qty)
+            )
+
+        identity_map = self.session.identity_map
+        line = identity_map.get(identity_key(OrderLine, orderline_id))
+        if line is not None:
+            self.session.expunge(line)
+        batch = identity_map.get(identity_key(Batch, batch_id))
+        if batch is not None:
+            self.session.expire(batch, ["_allocations", "closed"])
+        return reference
 
     def list(self) -> List[Batch]:
-        """Return all the order batches saved in SQL database.
+        """Return the open order batches saved in SQL database.
+
+        Returns:
+            batches: List of all open batches in SQL database.
+        """
+        return self._batches(self._query().filter_by(closed=False))
+
+    def list_for_sku(self, sku: Sku) -> List[Batch]:
+        """Return the open batches of one product, via the sku, closed index.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the open batches with that sku.
+        """
+        return self._batches(self._query().filter_by(sku=sku, closed=False))
+
+    def has_sku(self, sku: Sku) -> bool:
+        """Test if there is any batch of a product, with an EXISTS query.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            True if at least one batch has that sku.
+        """
+        table = orm.batches
+        return self.session.execute(
+            select(exists().where(table.c.sku == sku))
+        ).scalar()
+
+    def get_version(self, sku: Sku, for_update: bool = False) -> Optional[int]:
+        """Return the version of a product, read before loading its batches.
+
+        With for_update the product row is locked, SELECT ... FOR UPDATE,
+        serializing the transactions allocating the sku. SQLite ignores
+        the lock and relies on bump_version only.
+
+        Args:
+            sku: Product identifier.
+            for_update: Lock the product row until the transaction ends.
+
+        Returns:
+            version: Product version, None if it was never allocated.
+        """
+        products = orm.products
+        query = select(products.c.version_number).where(products.c.sku == sku)
+        if for_update:
+            query = query.with_for_update()
+        return self.session.execute(query).scalar()
+
+    def bump_version(self, sku: Sku, expected: Optional[int]) -> None:
+        """Increment the version of a product, if nobody else did it first.
+
+        A compare and set on the product row: it raises VersionConflict if
+        another transaction changed the version since it was read, or
+        created the row of a product allocated for the first time.
+
+        Args:
+            sku: Product identifier.
+            expected: Version returned by get_version.
 
         Returns:
-            batches: List of all batches in SQL database.
+            None
+        """
+        products = orm.products
+        if expected is None:
+            try:
+                self.session.execute(
+                    insert(products).values(sku=sku, version_number=1)
+                )
+            except IntegrityError as e:
+                raise VersionConflict(f"Product {sku} was created") from e
+            return
+
+        result = self.session.execute(
+            update(products)
+            .where(
+                products.c.sku == sku,
+                products.c.version_number == expected,
+            )
+            .values(version_number=expected + 1)
+        )
+        if result.rowcount != 1:
+            raise VersionConflict(
+                f"Product {sku} changed since version {expected}"
+            )
+
+    def allocate_in_database(self, line: OrderLine) -> Optional[Reference]:
+        """Allocate an order line with set-based statements, no batch loaded.
+
+        A line already allocated for the orderid and sku gets its batch
+        back, the allocation being idempotent. Otherwise one SELECT picks
+        the earliest open batch of the sku, warehouse stock first and then
+        by ETA and id, whose available quantity covers the line, as
+        model.allocate does, and two INSERTs store the line and its
+        allocation. The statements bypass the unit of work: batches already
+        loaded in the session are not refreshed.
+
+        Args:
+            line: Order line to allocate.
+
+        Returns:
+            batchref: Reference of the batch the line was allocated to,
+                None if no batch can take it.
+        """
+        batches = orm.batches
+        lines = orm.order_lines
+        allocations = orm.allocations
+        available = (
+            batches.c._purchased_quantity - allocated_quantity().element
+        )
+
+        reference = self.get_reference_by_order(line.orderid, line.sku)
+        if reference is not None:
+            return reference
+
+        candidate = self.session.execute(
+            select(batches.c.id, batches.c.reference)
+            .where(
+                batches.c.sku == line.sku,
+                ~batches.c.closed,
+                available >= line.qty,
+            )
+            .order_by(batches.c.eta.isnot(None), batches.c.eta, batches.c.id)
+            .limit(1)
+        ).first()
+        if candidate is None:
+            return None
+
+        batch_id, reference = candidate
+        [orderline_id] = self.session.execute(
+            insert(lines).values(
+                orderid=line.orderid, sku=line.sku, qty=line.qty
+            )
+        ).inserted_primary_key
+        self.session.execute(
+            insert(allocations).values(
+                orderline_id=orderline_id, batch_id=batch_id
+            )
+        )
+        self.session.execute(
+            update(orm.availability)
+            .where(orm.availability.c.batchref == reference)
+            .values(available_qty=orm.availability.c.available_qty - line.qty)
+        )
+        return reference
+
+    def close_exhausted(
+        self, sku: Optional[Sku] = None, chunk_size: int = 1000
+    ) -> int:
+        """Close the open batches with no stock left, set-based.
+
+        Closed batches drop out of list, list_for_sku and the availability
+        read model, so allocations stop visiting them, until a deallocation
+        gives them stock back and reopens them. The versions of their
+        products are bumped. The statements bypass the unit of work:
+        batches already loaded in the session are not refreshed.
+
+        Args:
+            sku: Product identifier, every product if not provided.
+            chunk_size: Number of batches closed per round trip.
+
+        Returns:
+            count: Number of batches closed.
+        """
+        table = orm.batches
+        query = select(table.c.reference, table.c.sku).where(
+            ~table.c.closed,
+            table.c._purchased_quantity - allocated_quantity().element <= 0,
+        )
+        if sku is not None:
+            query = query.where(table.c.sku == sku)
+
+        self.session.flush()
+        rows = self.session.execute(query).all()
+        for chunk in _chunked(rows, chunk_size):
+            references = [reference for reference, _ in chunk]
+            self.session.execute(
+                update(table)
+                .where(table.c.reference.in_(references))
+                .values(closed=True)
+            )
+            orm.refresh_availability(self.session, references)
+            orm.bump_versions(self.session, {sku for _, sku in chunk})
+        return len(rows)
+
+    def archive(
+        self, before: Optional[date] = None, chunk_size: int = 1000
+    ) -> int:
+        """Move fully consumed batches and their allocations to the archive.
+
+        Batches, open or closed, whose allocations use up their purchased
+        quantity are copied with their order lines and allocations, ids
+        included, to the archived_ tables and deleted, so the hot tables
+        and their indexes only hold batches with stock. The versions of
+        their products are bumped. Archived lines are
+        no longer found by get_by_order: they cannot be deallocated and do
+        not count for the idempotency of allocations. The statements bypass
+        the unit of work: batches already loaded in the session are not
+        refreshed.
+
+        Args:
+            before: Only archive batches that arrived before this date,
+                warehouse stock included, every ETA if not provided.
+            chunk_size: Number of batches moved per round trip.
+
+        Returns:
+            count: Number of batches archived.
         """
-        return self.session.query(Batch).all()
+        batches = orm.batches
+        lines = orm.order_lines
+        allocations = orm.allocations
+        query = select(batches.c.id, batches.c.reference, batches.c.sku).where(
+            batches.c._purchased_quantity - allocated_quantity().element <= 0
+        )
+        if before is not None:
+            query = query.where(
+                or_(batches.c.eta.is_(None), batches.c.eta < before)
+            )
+
+        self.session.flush()
+        rows = self.session.execute(query).all()
+        for chunk in _chunked(rows, chunk_size):
+            ids = [batch_id for batch_id, _, _ in chunk]
+            line_ids = (
+                self.session.execute(
+                    select(allocations.c.orderline_id).where(
+                        allocations.c.batch_id.in_(ids)
+                    )
+                )
+                .scalars()
+                .all()
+            )
+            moves = (
+                (orm.archived_batches, batches, batches.c.id.in_(ids)),
+                (
+                    orm.archived_order_lines,
+                    lines,
+                    lines.c.id.in_(line_ids),
+                ),
+                (
+                    orm.archived_allocations,
+                    allocations,
+                    allocations.c.batch_id.in_(ids),
+                ),
+            )
+            for archive, table, where in moves:
+                self.session.execute(
+                    insert(archive).from_select(
+                        [c.name for c in table.columns],
+                        select(table).where(where),
+                    )
+                )
+            for _, table, where in reversed(moves):
+                self.session.execute(delete(table).where(where))
+            self.session.execute(
+                delete(orm.availability).where(
+                    orm.availability.c.batchref.in_(
+                        [reference for _, reference, _ in chunk]
+                    )
+                )
+            )
+            orm.bump_versions(self.session, {sku for _, _, sku in chunk})
+        return len(rows)
 
 
 class InMemoryRepository(AbstractRepository):
     """In memory repository."""
 
     def __init__(self, batches: List[Batch]):
-        """Initialize a in-memory repo using a python set."""
-        self._batches = set(batches)
+        """Initialize a in-memory repo using dicts keyed by reference and sku.
+
+        Args:
+            batches: Order batches.
+        """
+        self._batches: Dict[Reference, Batch] = {}
+        self._skus: Dict[Sku, Dict[Reference, Batch]] = {}
+        self._orders: Dict[Tuple[OrderId, Sku], Batch] = {}
+        self._versions: Dict[Sku, int] = {}
+        self._versions_lock = threading.Lock()
+        for batch in batches:
+            self.add(batch)
 
     def add(self, batch: Batch) -> None:
         """Add batch to oir repository if it was not already on it.
@@ -119,7 +810,29 @@ class InMemoryRepository(AbstractRepository):
         Returns:
             None
         """
-        self._batches.add(batch)
+        if batch.reference in self._batches:
+            return
+        self._batches[batch.reference] = batch
+        self._skus.setdefault(batch.sku, {})[batch.reference] = batch
+
+    def add_many(self, batches: Iterable[Batch]) -> int:
+        """Add or update many batches in the in-memory repository.
+
+        Args:
+            batches: Order batches, consumed as a stream.
+
+        Returns:
+            count: Number of batches added or updated.
+        """
+        count = 0
+        for batch in batches:
+            existing = self._batches.get(batch.reference)
+            if existing is None:
+                self.add(batch)
+            else:
+                existing.amend(batch._purchased_quantity, batch.eta)
+            count += 1
+        return count
 
     def get(self, reference: Reference) -> Batch:
         """Return a previously added to the in-memory repository.
@@ -130,15 +843,947 @@ class InMemoryRepository(AbstractRepository):
         Returns:
             batch: Order batch.
         """
-        return next(b for b in self._batches if b.reference == reference)
+        return self._batches[reference]
+
+    def get_by_order(self, orderid: OrderId, sku: Sku) -> Optional[Batch]:
+        """Return the batch of the in-memory repository holding an order line.
+
+        Batches are allocated outside the repository, so a cached answer is
+        checked against the batch before being returned, and a miss only
+        scans the batches of that sku.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Order batch, None if the line is not allocated.
+        """
+        key = (orderid, sku)
+        batch = self._orders.get(key)
+        if batch is not None and batch.get_line(orderid) is not None:
+            return batch
+
+        batch = next(
+            (
+                b
+                for b in self._skus.get(sku, {}).values()
+                if b.get_line(orderid) is not None
+            ),
+            None,
+        )
+        if batch is None:
+            self._orders.pop(key, None)
+        else:
+            self._orders[key] = batch
+        return batch
+
+    def get_reference_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Reference]:
+        """Return the batch reference of an order line of the repository.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Batch reference, None if the line is not allocated.
+        """
+        batch = self.get_by_order(orderid, sku)
+        return None if batch is None else batch.reference
+
+    def list_for_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches of the in-memory repository holding an order.
+
+        Lines carry no back reference to their batch, so every batch is
+        asked, each in O(1) through its orderid lookup table.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        return [
+            b
+            for b in self._batches.values()
+            if b.get_line(orderid) is not None
+        ]
+
+    def deallocate(self, orderid: OrderId, sku: Sku) -> Optional[Reference]:
+        """Cancel the allocation of an order line of the in-memory repository.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Reference of the batch the line was deallocated from,
+                None if the line is not allocated.
+        """
+        batch = self.get_by_order(orderid, sku)
+        line = None if batch is None else batch.get_line(orderid)
+        if batch is None or line is None:
+            return None
+        batch.deallocate(line)
+        return batch.reference
 
     def list(self) -> List[Batch]:
-        """Return all the order batches saved in the repository.
+        """Return the open order batches saved in the repository.
 
         Returns:
-            batches: List of all batches in SQL database.
+            batches: List of all open batches in the repository.
         """
-        return list(self._batches)
+        return [b for b in self._batches.values() if not b.closed]
+
+    def list_for_sku(self, sku: Sku) -> List[Batch]:
+        """Return the open batches of one product saved in the repository.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the open batches with that sku.
+        """
+        return [b for b in self._skus.get(sku, {}).values() if not b.closed]
+
+    def has_sku(self, sku: Sku) -> bool:
+        """Test if there is any batch of a product.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            True if at least one batch has that sku.
+        """
+        return bool(self._skus.get(sku))
+
+    def get_version(self, sku: Sku, for_update: bool = False) -> Optional[int]:
+        """Return the version of a product, read before loading its batches.
+
+        Args:
+            sku: Product identifier.
+            for_update: Lock the product row until the transaction ends.
+
+        Returns:
+            version: Product version, None if it was never allocated.
+        """
+        return self._versions.get(sku)
+
+    def bump_version(self, sku: Sku, expected: Optional[int]) -> None:
+        """Increment the version of a product, if nobody else did it first.
+
+        Args:
+            sku: Product identifier.
+            expected: Version returned by get_version.
+
+        Returns:
+            None
+        """
+        with self._versions_lock:
+            if self._versions.get(sku) != expected:
+                raise VersionConflict(
+                    f"Product {sku} changed since version {expected}"
+                )
+            self._versions[sku] = (expected or 0) + 1
+
+
+@dataclass
+class CacheStats:
+    """Counters of a batch cache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+
+@dataclass(frozen=True)
+class _CachedBatch:
+    """Plain state of a persistent batch, detached from any session."""
+
+    id: int
+    reference: Reference
+    sku: Sku
+    qty: Quantity
+    eta: Optional[date]
+    closed: bool
+    lines: Tuple[Tuple[int, OrderId, Quantity], ...]
+
+    @classmethod
+    def of(cls, batch: Batch) -> Optional["_CachedBatch"]:
+        """Capture the state of a batch and its allocated lines.
+
+        Args:
+            batch: Persistent order batch, with its allocations loaded.
+
+        Returns:
+            state: Batch state, None if part of it is not loaded.
+        """
+        state = inspect(batch)
+        if state.key is None or {"id", "_allocations"} & state.unloaded:
+            return None
+        lines = []
+        for line in batch._allocations:
+            line_state = inspect(line)
+            if line_state.key is None or line_state.unloaded:
+                return None
+            lines.append((line_state.identity[0], line.orderid, line.qty))
+        return cls(
+            state.identity[0],
+            batch.reference,
+            batch.sku,
+            batch._purchased_quantity,
+            batch.eta,
+            batch.closed,
+            tuple(lines),
+        )
+
+    def restore(self, session: Session) -> Batch:
+        """Attach the batch to a session, without any SELECT.
+
+        Args:
+            session: Session the batch is merged into.
+
+        Returns:
+            batch: Persistent order batch, the instance already in the
+                session if any.
+        """
+        existing = session.identity_map.get(
+            session.identity_key(Batch, self.id)
+        )
+        if existing is not None:
+            return existing
+
+        # The ORM maps an id column the domain model does not declare.
+        batch = Batch(self.reference, self.sku, self.qty, self.eta)
+        setattr(batch, "id", self.id)
+        batch.closed = self.closed
+        for line_id, orderid, qty in self.lines:
+            line = OrderLine(orderid, self.sku, qty)
+            setattr(line, "id", line_id)
+            make_transient_to_detached(line)
+            batch._allocations.add(line)
+        make_transient_to_detached(batch)
+        return session.merge(batch, load=False)
+
+
+class BatchCache:
+    """Process wide cache of the open batches of hot SKUs.
+
+    Entries are tagged with the product version they were read at, so a
+    request reading a newer version misses instead of seeing stale
+    batches. Freshness only covers the writes bumping the version: the
+    allocation and deallocation services and the repository add, add_many,
+    close_exhausted and archive. Batches changed any other way, e.g. a
+    flushed Batch.amend, are served stale for up to ttl seconds, the age
+    limit of the entries of the up to maxsize SKUs kept in least recently
+    used order. Batches of a SQLAlchemy session are kept as plain state and
+    merged into the session of each request, other repositories share
+    their live batches.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize an empty cache.
+
+        Args:
+            maxsize: Maximum number of SKUs cached.
+            ttl: Seconds a cached SKU is served before being reloaded.
+            clock: Monotonic clock, in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Sku, Tuple[float, Optional[int], list]]"
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sku: Sku, version: Optional[int]) -> Optional[list]:
+        """Return the batches cached for a product version.
+
+        Args:
+            sku: Product identifier.
+            version: Current product version.
+
+        Returns:
+            batches: Cached batches, None if missing, expired or older.
+        """
+        with self._lock:
+            entry = self._entries.get(sku)
+            if (
+                entry is not None
+                and entry[1] == version
+                and self.clock() - entry[0] < self.ttl
+            ):
+                self._entries.move_to_end(sku)
+                self.stats.hits += 1
+                return entry[2]
+            self.stats.misses += 1
+            return None
+
+    def put(self, sku: Sku, version: Optional[int], batches: list) -> None:
+        """Cache the batches of a product, unless a newer version is cached.
+
+        Args:
+            sku: Product identifier.
+            version: Product version the batches were read at.
+            batches: Batches, or their plain state.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            entry = self._entries.get(sku)
+            if entry is not None and _newer(entry[1], version):
+                return
+            self._entries[sku] = (self.clock(), version, batches)
+            self._entries.move_to_end(sku)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, sku: Sku) -> None:
+        """Drop the cached batches of a SKU.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._entries.pop(sku, None) is not None:
+                self.stats.invalidations += 1
+
+
+def _newer(version: Optional[int], other: Optional[int]) -> bool:
+    """Test if a product version is newer than another one."""
+    return (-1 if version is None else version) > (
+        -1 if other is None else other
+    )
+
+
+class CachingRepository(AbstractRepository):
+    """Read-through cache of the batches of hot SKUs over any repository.
+
+    Meant to be created per request, like the wrapped repository, over a
+    BatchCache shared by the process. The batches of a SKU are served from
+    the cache when it holds them at the current product version, the one
+    read by get_version in the same transaction, so a hit costs the
+    version lookup only. When the transaction bumping the version commits,
+    the batches it allocated to are cached at the new version. Concurrent
+    writes bumping the version are caught by the version check as without
+    the cache, see BatchCache for the others.
+    """
+
+    def __init__(
+        self, repo: AbstractRepository, cache: Optional[BatchCache] = None
+    ):
+        """Initialize the cache in front of the provided repository.
+
+        Args:
+            repo: Wrapped repository.
+            cache: Shared batch cache, a private one if not provided.
+        """
+        self.repo = repo
+        self.cache = BatchCache() if cache is None else cache
+        self._versions: Dict[Sku, Optional[int]] = {}
+        self._listed: Dict[Sku, List[Batch]] = {}
+        self._staged: Dict[Sku, Tuple[Optional[int], Optional[List]]] = {}
+        self._listening: Set[int] = set()
+
+    @property
+    def stats(self) -> CacheStats:
+        """Counters of the shared batch cache."""
+        return self.cache.stats
+
+    def add(self, batch: Batch) -> None:
+        """Add new batch through the wrapped repository.
+
+        Args:
+            batch: Order batch that will be added to the repository.
+
+        Returns:
+            None
+        """
+        self.repo.add(batch)
+        self.cache.invalidate(batch.sku)
+
+    def add_many(self, batches: Iterable[Batch]) -> int:
+        """Add or update many batches through the wrapped repository.
+
+        Args:
+            batches: Order batches, consumed as a stream.
+
+        Returns:
+            count: Number of batches added or updated.
+        """
+        skus = set()
+
+        def track(batches: Iterable[Batch]) -> Iterator[Batch]:
+            """Record the sku of each batch streamed to the repository."""
+            for batch in batches:
+                skus.add(batch.sku)
+                yield batch
+
+        count = self.repo.add_many(track(batches))
+        for sku in skus:
+            self.cache.invalidate(sku)
+        return count
+
+    def get(self, reference: Reference) -> Batch:
+        """Return a previously added item from the wrapped repository.
+
+        Args:
+            reference: Order batch reference.
+
+        Returns:
+            batch: Order batch.
+        """
+        return self.repo.get(reference)
+
+    def get_by_order(self, orderid: OrderId, sku: Sku) -> Optional[Batch]:
+        """Return the batch an order line is allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Order batch, None if the line is not allocated.
+        """
+        return self.repo.get_by_order(orderid, sku)
+
+    def get_reference_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Reference]:
+        """Return the reference of the batch an order line is allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Batch reference, None if the line is not allocated.
+        """
+        return self.repo.get_reference_by_order(orderid, sku)
+
+    def list_for_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches the lines of an order are allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        return self.repo.list_for_order(orderid)
+
+    def deallocate(self, orderid: OrderId, sku: Sku) -> Optional[Reference]:
+        """Cancel the allocation of an order line in the wrapped repository.
+
+        The cached batches of the product are replaced once the version
+        bump of the transaction commits.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Reference of the batch the line was deallocated from,
+                None if the line is not allocated.
+        """
+        return self.repo.deallocate(orderid, sku)
+
+    def list(self) -> List[Batch]:
+        """Return all the order batches of the wrapped repository.
+
+        Returns:
+            batches: List of all batches.
+        """
+        return self.repo.list()
+
+    def list_for_sku(self, sku: Sku) -> List[Batch]:
+        """Return the open batches of one product, from the cache if fresh.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the open batches with that sku.
+        """
+        if sku in self._versions:
+            version = self._versions[sku]
+        else:
+            version = self.repo.get_version(sku)
+        session = self._session_for(sku)
+
+        cached = self.cache.get(sku, version)
+        if cached is None:
+            batches = self.repo.list_for_sku(sku)
+            # Batches written by this transaction are cached on commit only.
+            if sku not in self._staged:
+                cached = self._freeze(batches, session)
+            if cached is not None:
+                self.cache.put(sku, version, cached)
+        elif session is None:
+            batches = list(cached)
+        else:
+            batches = [state.restore(session) for state in cached]
+
+        self._listed[sku] = batches
+        return list(batches)
+
+    def has_sku(self, sku: Sku) -> bool:
+        """Test if there is any batch of a product, closed ones included.
+
+        Always answered by the wrapped repository: the cache only holds the
+        open batches.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            True if at least one batch has that sku.
+        """
+        return self.repo.has_sku(sku)
+
+    def get_version(self, sku: Sku, for_update: bool = False) -> Optional[int]:
+        """Return the version of a product, read before loading its batches.
+
+        The version is remembered until the transaction ends, for
+        list_for_sku to pick the matching cache entry.
+
+        Args:
+            sku: Product identifier.
+            for_update: Lock the product row until the transaction ends.
+
+        Returns:
+            version: Product version, None if it was never allocated.
+        """
+        version = self.repo.get_version(sku, for_update)
+        self._versions[sku] = version
+        self._listen(self._session_for(sku))
+        return version
+
+    def bump_version(self, sku: Sku, expected: Optional[int]) -> None:
+        """Increment the version of a product, if nobody else did it first.
+
+        The batches listed for the product are cached at the new version
+        once the transaction commits, the cached entry is dropped if they
+        were not listed.
+
+        Args:
+            sku: Product identifier.
+            expected: Version returned by get_version.
+
+        Returns:
+            None
+        """
+        self.repo.bump_version(sku, expected)
+        version = 1 if expected is None else expected + 1
+        self._versions[sku] = version
+        self._staged[sku] = (version, self._listed.get(sku))
+
+        session = self._session_for(sku)
+        if session is None:
+            self._publish(sku, session)
+        else:
+            self._listen(session)
+
+    def invalidate(self, sku: Sku) -> None:
+        """Drop the cached batches of a SKU.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            None
+        """
+        self.cache.invalidate(sku)
+
+    def _session_for(self, sku: Sku) -> Optional[Session]:
+        """Return the SQLAlchemy session holding the batches of a SKU.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            session: Session of the wrapped repository, or of the shard of
+                the SKU, None if the repository has no session.
+        """
+        repo = self.repo
+        if isinstance(repo, ShardedRepository):
+            repo = repo.shards[repo.shard_for(sku)]
+        session = getattr(repo, "session", None)
+        return session if isinstance(session, Session) else None
+
+    @staticmethod
+    def _freeze(
+        batches: List[Batch], session: Optional[Session]
+    ) -> Optional[List]:
+        """Return what the cache keeps of the batches of a SKU.
+
+        Args:
+            batches: Open batches of the SKU.
+            session: Session holding the batches, if any.
+
+        Returns:
+            cached: Plain state of the batches on a session, the batches
+                themselves otherwise, None if they cannot be cached.
+        """
+        if session is None:
+            return list(batches)
+        states = [_CachedBatch.of(batch) for batch in batches]
+        if any(state is None for state in states):
+            return None
+        return states
+
+    def _listen(self, session: Optional[Session]) -> None:
+        """Follow the end of the transactions of a session.
+
+        Args:
+            session: Session of a SKU, ignored if None.
+
+        Returns:
+            None
+        """
+        if session is None or id(session) in self._listening:
+            return
+        self._listening.add(id(session))
+        event.listen(session, "after_commit", self._after_commit)
+        event.listen(session, "after_rollback", self._after_rollback)
+
+    def _skus_of(self, session: Session) -> List[Sku]:
+        """Return the SKUs whose batches live in a session."""
+        skus = set(self._versions) | set(self._staged) | set(self._listed)
+        return [sku for sku in skus if self._session_for(sku) is session]
+
+    def _publish(self, sku: Sku, session: Optional[Session]) -> None:
+        """Cache the batches staged by a committed version bump.
+
+        Args:
+            sku: Product identifier.
+            session: Session holding the batches, if any.
+
+        Returns:
+            None
+        """
+        version, batches = self._staged.pop(sku)
+        cached = None if batches is None else self._freeze(batches, session)
+        if cached is None:
+            self.cache.invalidate(sku)
+        else:
+            self.cache.put(sku, version, cached)
+
+    def _after_commit(self, session: Session) -> None:
+        """Publish the staged batches, before the commit expires them.
+
+        Args:
+            session: Session whose transaction committed.
+
+        Returns:
+            None
+        """
+        for sku in self._skus_of(session):
+            if sku in self._staged:
+                self._publish(sku, session)
+            self._versions.pop(sku, None)
+            self._listed.pop(sku, None)
+
+    def _after_rollback(self, session: Session) -> None:
+        """Forget what the rolled back transaction read and staged.
+
+        Args:
+            session: Session whose transaction rolled back.
+
+        Returns:
+            None
+        """
+        for sku in self._skus_of(session):
+            self._staged.pop(sku, None)
+            self._versions.pop(sku, None)
+            self._listed.pop(sku, None)
+
+
+class ShardedSession:
+    """Unit of work over the sessions of every shard, in shard order.
+
+    Commits are not atomic across shards: a failing shard leaves the
+    previous ones committed. Allocations never span shards since a SKU
+    lives in a single one, only add_many with mixed SKUs does.
+    """
+
+    def __init__(self, sessions: Sequence[Session]):
+        """Initialize the unit of work with one session per shard.
+
+        Args:
+            sessions: Database session of each shard.
+        """
+        self.sessions = list(sessions)
+
+    def commit(self) -> None:
+        """Commit the transaction of every shard."""
+        for session in self.sessions:
+            session.commit()
+
+    def rollback(self) -> None:
+        """Roll back the transaction of every shard."""
+        for session in self.sessions:
+            session.rollback()
+
+    def close(self) -> None:
+        """Close the session of every shard."""
+        for session in self.sessions:
+            session.close()
+
+
+class ShardedRepository(AbstractRepository):
+    """SQL repository partitioned by SKU across several databases.
+
+    Every SKU lives in a single shard, picked from the explicit shard map or
+    else by a stable hash of the SKU, so per SKU operations touch one
+    database only. Lookups without a SKU fan out to every shard in
+    parallel.
+    """
+
+    def __init__(
+        self,
+        session: ShardedSession,
+        shard_map: Optional[Dict[Sku, int]] = None,
+        allocations_loading: Optional[AllocationsLoading] = None,
+    ):
+        """Initialize one sql repository per shard session.
+
+        Args:
+            session: Sessions of the shards.
+            shard_map: Explicit shard index of some SKUs, e.g. hot products
+                moved to a dedicated database.
+            allocations_loading: strategy to load batch allocations, the
+                mapping default is used if not provided.
+        """
+        self.session = session
+        self.shard_map = dict(shard_map or {})
+        self.shards = [
+            SQLAlchemyRepository(s, allocations_loading)
+            for s in session.sessions
+        ]
+
+    def shard_for(self, sku: Sku) -> int:
+        """Return the index of the shard holding a SKU.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            index: Shard index.
+        """
+        index = self.shard_map.get(sku)
+        if index is None:
+            index = zlib.crc32(sku.encode("utf-8")) % len(self.shards)
+        return index
+
+    def _fan_out(
+        self, call: Callable[[SQLAlchemyRepository], List[Batch]]
+    ) -> List[Batch]:
+        """Run a query on every shard in parallel and merge the results.
+
+        Each shard session is used by a single thread.
+
+        Args:
+            call: Query to run on a shard repository.
+
+        Returns:
+            batches: Batches of all the shards, in shard order.
+        """
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            results = executor.map(call, self.shards)
+            return [batch for batches in results for batch in batches]
+
+    def add(self, batch: Batch) -> None:
+        """Add new batch in the shard of its SKU.
+
+        Args:
+            batch: Order batch that will be added to the repository.
+
+        Returns:
+            None
+        """
+        self.shards[self.shard_for(batch.sku)].add(batch)
+
+    def add_many(
+        self, batches: Iterable[Batch], chunk_size: int = 1000
+    ) -> int:
+        """Upsert batches, each chunk split by shard.
+
+        Args:
+            batches: Order batches, consumed as a stream.
+            chunk_size: Number of batches read from the stream at once.
+
+        Returns:
+            count: Number of batches added or updated.
+        """
+        count = 0
+        for chunk in _chunked(batches, chunk_size):
+            by_shard: Dict[int, List[Batch]] = {}
+            for batch in chunk:
+                by_shard.setdefault(self.shard_for(batch.sku), []).append(
+                    batch
+                )
+            for index, shard_batches in by_shard.items():
+                count += self.shards[index].add_many(shard_batches, chunk_size)
+        return count
+
+    def get(self, reference: Reference) -> Batch:
+        """Return a previously added item, searching every shard.
+
+        Args:
+            reference: Order batch reference.
+
+        Returns:
+            batch: Order batch.
+        """
+
+        def find(shard: SQLAlchemyRepository) -> List[Batch]:
+            """Return the batch with that reference in one shard, if any."""
+            try:
+                return [shard.get(reference)]
+            except NoResultFound:
+                return []
+
+        batches = self._fan_out(find)
+        if not batches:
+            raise NoResultFound(f"No batch with reference {reference}")
+        return batches[0]
+
+    def get_by_order(self, orderid: OrderId, sku: Sku) -> Optional[Batch]:
+        """Return the batch an order line is allocated to, from its shard.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Order batch, None if the line is not allocated.
+        """
+        return self.shards[self.shard_for(sku)].get_by_order(orderid, sku)
+
+    def get_reference_by_order(
+        self, orderid: OrderId, sku: Sku
+    ) -> Optional[Reference]:
+        """Return the batch reference of an order line, from its shard.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Batch reference, None if the line is not allocated.
+        """
+        shard = self.shards[self.shard_for(sku)]
+        return shard.get_reference_by_order(orderid, sku)
+
+    def list_for_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches of an order, searching every shard.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        return self._fan_out(lambda shard: shard.list_for_order(orderid))
+
+    def deallocate(self, orderid: OrderId, sku: Sku) -> Optional[Reference]:
+        """Cancel the allocation of an order line, in its shard.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: Reference of the batch the line was deallocated from,
+                None if the line is not allocated.
+        """
+        return self.shards[self.shard_for(sku)].deallocate(orderid, sku)
+
+    def list(self) -> List[Batch]:
+        """Return the order batches of all the shards.
+
+        Returns:
+            batches: List of all batches.
+        """
+        return self._fan_out(SQLAlchemyRepository.list)
+
+    def list_for_sku(self, sku: Sku) -> List[Batch]:
+        """Return the batches of one product, from its shard.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the batches with that sku.
+        """
+        return self.shards[self.shard_for(sku)].list_for_sku(sku)
+
+    def has_sku(self, sku: Sku) -> bool:
+        """Test if there is any batch of a product, in its shard.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            True if at least one batch has that sku.
+        """
+        return self.shards[self.shard_for(sku)].has_sku(sku)
+
+    def get_version(self, sku: Sku, for_update: bool = False) -> Optional[int]:
+        """Return the version of a product, read before loading its batches.
+
+        Args:
+            sku: Product identifier.
+            for_update: Lock the product row until the transaction ends.
+
+        Returns:
+            version: Product version, None if it was never allocated.
+        """
+        return self.shards[self.shard_for(sku)].get_version(sku, for_update)
+
+    def bump_version(self, sku: Sku, expected: Optional[int]) -> None:
+        """Increment the version of a product, if nobody else did it first.
+
+        Args:
+            sku: Product identifier.
+            expected: Version returned by get_version.
+
+        Returns:
+            None
+        """
+        self.shards[self.shard_for(sku)].bump_version(sku, expected)
+
+
+def _chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable in lists of at most size items, lazily.
+
+    Args:
+        items: Any iterable.
+        size: Maximum chunk length.
+
+    Returns:
+        chunks: Iterator over the chunks.
+    """
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
 
 def repository_maker(
@@ -6,6 +6,21 @@ Created on: 20/6/22
 Licence,
 """
 import os
+import time
+from dataclasses import (
+    asdict,
+    dataclass,
+)
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
 
 
 def get_postgres_uri() -> str:
@@ -22,3 +37,139 @@ def get_api_url() -> str:
     host = os.environ.get("API_HOST", "localhost")
     port = 5005 if host == "localhost" else 80
     return f"http://{host}:{port}"
+
+
+@dataclass
+class PoolMetrics:
+    """Connection checkout counters of a metered pool."""
+
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class MeteredQueuePool(QueuePool):
+    """Queue pool timing how long each checkout waits for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the pool with fresh metrics."""
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self) -> "MeteredQueuePool":
+        """Recreate the pool, as on engine.dispose(), keeping the metrics."""
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        """Check out a connection, recording the time spent waiting."""
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.metrics.checkouts += 1
+            self.metrics.wait_seconds += waited
+            self.metrics.max_wait_seconds = max(
+                self.metrics.max_wait_seconds, waited
+            )
+
+
+def get_engine_options(uri: str) -> Dict[str, Any]:
+    """Engine and pool options, overridable through environment variables.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds),
+    DB_POOL_RECYCLE (seconds), DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT
+    (milliseconds, 0 disables it) and DB_EXECUTEMANY_MODE. The last two only
+    apply to Postgres.
+
+    Args:
+        uri: database url.
+
+    Returns:
+        options: create_engine keyword arguments.
+    """
+    if uri in ("sqlite://", "sqlite:///:memory:"):
+        return {}
+
+    options: Dict[str, Any] = dict(
+        poolclass=MeteredQueuePool,
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.environ.get("DB_POOL_PRE_PING", "true").lower()
+        in ("1", "true", "yes"),
+    )
+    if uri.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False}
+    if uri.startswith("postgresql"):
+        statement_timeout = int(os.environ.get("DB_STATEMENT_TIMEOUT", 0))
+        if statement_timeout:
+            options["connect_args"] = {
+                "options": f"-c statement_timeout={statement_timeout}"
+            }
+        options["executemany_mode"] = os.environ.get(
+            "DB_EXECUTEMANY_MODE", "values_plus_batch"
+        )
+    return options
+
+
+def make_engine(uri: Optional[str] = None) -> Engine:
+    """Create an engine configured from the environment.
+
+    Args:
+        uri: database url, the Postgres url by default.
+
+    Returns:
+        engine: database engine.
+    """
+    uri = uri or get_postgres_uri()
+    return create_engine(uri, **get_engine_options(uri))
+
+
+def get_pool_metrics(engine: Engine) -> Dict[str, Any]:
+    """Report the pool occupancy and checkout counters of an engine.
+
+    Args:
+        engine: database engine.
+
+    Returns:
+        metrics: pool size, checked out and overflow connections, plus the
+            checkout and wait counters when the pool is metered.
+    """
+    pool = engine.pool
+    metrics: Dict[str, Any] = {"status": pool.status()}
+    if isinstance(pool, QueuePool):
+        metrics.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, MeteredQueuePool):
+        metrics.update(asdict(pool.metrics))
+    return metrics
+
+
+def get_coalescing_options() -> Dict[str, Any]:
+    """Read the allocation micro-batching options from the environment.
+
+    Coalescing is enabled by setting ALLOCATE_WINDOW_MS, the time the
+    first request of a SKU waits for others, and optionally
+    ALLOCATE_MAX_BATCH.
+
+    Returns:
+        options: AllocationCoalescer keyword arguments, empty if disabled.
+    """
+    window_ms = float(os.environ.get("ALLOCATE_WINDOW_MS", 0))
+    if window_ms <= 0:
+        return {}
+    return dict(
+        window=window_ms / 1000,
+        max_batch=int(os.environ.get("ALLOCATE_MAX_BATCH", 64)),
+    )
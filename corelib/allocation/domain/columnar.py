@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Columnar allocation engine for large planning runs.
+
+Batches are held as column arrays instead of Batch objects and order lines
+get allocated per SKU with vectorized NumPy operations, using the same
+earliest-ETA-first rule as model.allocate. NumPy is an optional dependency,
+only needed by this module.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from importlib.util import find_spec
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+    Sku,
+    eta_key,
+)
+
+HAS_NUMPY = find_spec("numpy") is not None
+if HAS_NUMPY:
+    import numpy as np
+
+NO_BATCH = -1
+MIN_RUN_WINDOW = 16
+MAX_RUN_WINDOW = 65536
+
+
+def _allocate_sku(remaining: "np.ndarray", qtys: "np.ndarray") -> "np.ndarray":
+    """Allocate the lines of one SKU against its ETA ordered batches.
+
+    Consecutive lines that all land in the same batch are allocated at once:
+    while a line is bigger than anything left in the batches before the
+    chosen one, and the running total still fits in it, first fit picks that
+    same batch again.
+
+    Args:
+        remaining: Available quantity per batch, updated in place.
+        qtys: Line quantities in arrival order.
+
+    Returns:
+        positions: Batch position per line, NO_BATCH if out of stock.
+    """
+    positions = np.full(len(qtys), NO_BATCH, dtype=np.int64)
+    window = MIN_RUN_WINDOW
+    i = 0
+    while i < len(qtys):
+        qty = qtys[i]
+        fits = remaining >= qty
+        if not fits.any():
+            i += 1
+            continue
+
+        batch = int(fits.argmax())
+        if qty <= 0:
+            positions[i] = batch
+            remaining[batch] -= qty
+            i += 1
+            continue
+
+        floor = remaining[:batch].max() if batch else 0
+        end = i + window
+        run = qtys[i:end]
+        eligible = (run > floor) & (run > 0)
+        if not eligible.all():
+            run = run[: int(eligible.argmin())]
+        totals = np.cumsum(run)
+        size = int(np.searchsorted(totals, remaining[batch], side="right"))
+
+        end = i + size
+        positions[i:end] = batch
+        remaining[batch] -= totals[size - 1]
+        i = end
+        if size == window:
+            window = min(2 * window, MAX_RUN_WINDOW)
+        else:
+            window = max(window // 2, MIN_RUN_WINDOW)
+
+    return positions
+
+
+class ColumnarAllocator:
+    """Batches stored as columns: sku code, ETA ordinal and quantities.
+
+    Rows are sorted by SKU and then ETA, warehouse stock first, so the
+    batches of one SKU form a contiguous slice of every column. Closed
+    batches are left out.
+    """
+
+    def __init__(self, batches: Iterable[Batch]):
+        """Initialize the columns from the provided batches.
+
+        Args:
+            batches: Order batches.
+        """
+        if not HAS_NUMPY:
+            raise ImportError("ColumnarAllocator requires numpy")
+
+        batches = [b for b in batches if not b.closed]
+        self.sku_codes: Dict[Sku, int] = {}
+        for batch in batches:
+            self.sku_codes.setdefault(batch.sku, len(self.sku_codes))
+        rows = sorted(
+            batches, key=lambda b: (self.sku_codes[b.sku], eta_key(b))
+        )
+
+        self.references = np.array([b.reference for b in rows], dtype=object)
+        self.sku = np.array(
+            [self.sku_codes[b.sku] for b in rows], dtype=np.int64
+        )
+        self.eta = np.array(
+            [b.eta.toordinal() if b.eta else 0 for b in rows], dtype=np.int64
+        )
+        self.purchased = np.array(
+            [b._purchased_quantity for b in rows], dtype=np.int64
+        )
+        self.remaining = np.array(
+            [b.available_quantity for b in rows], dtype=np.int64
+        )
+
+        starts = np.searchsorted(self.sku, np.arange(len(self.sku_codes)))
+        stops = np.append(starts[1:], len(rows))
+        self._slices: List[Tuple[int, int]] = list(
+            zip(starts.tolist(), stops.tolist())
+        )
+
+    def allocate(
+        self, skus: Sequence[Sku], qtys: Sequence[int]
+    ) -> "np.ndarray":
+        """Allocate order lines given as sku and quantity columns.
+
+        Args:
+            skus: Line skus in arrival order.
+            qtys: Line quantities in arrival order.
+
+        Returns:
+            rows: Batch row per line, NO_BATCH if the line is out of stock
+                or its sku is unknown.
+        """
+        codes = np.fromiter(
+            (self.sku_codes.get(sku, NO_BATCH) for sku in skus),
+            dtype=np.int64,
+            count=len(skus),
+        )
+        quantities = np.asarray(qtys, dtype=np.int64)
+        rows = np.full(len(codes), NO_BATCH, dtype=np.int64)
+
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        bounds = np.flatnonzero(np.diff(sorted_codes)) + 1
+        for group in np.split(order, bounds):
+            code = codes[group[0]] if len(group) else NO_BATCH
+            if code == NO_BATCH:
+                continue
+            start, stop = self._slices[code]
+            positions = _allocate_sku(
+                self.remaining[start:stop], quantities[group]
+            )
+            rows[group] = np.where(
+                positions == NO_BATCH, NO_BATCH, positions + start
+            )
+
+        return rows
+
+    def allocate_lines(
+        self, lines: Iterable[OrderLine]
+    ) -> List[Optional[str]]:
+        """Allocate order lines and return their batch references.
+
+        Args:
+            lines: Order lines in arrival order.
+
+        Returns:
+            batch_references: Reference per line, None if out of stock.
+        """
+        lines = list(lines)
+        rows = self.allocate(
+            [line.sku for line in lines], [line.qty for line in lines]
+        )
+        return [
+            None if row == NO_BATCH else self.references[row]
+            for row in rows.tolist()
+        ]
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Compact domain objects for simulations.
+
+OrderLine and Batch are mapped by the ORM, whose instrumentation keeps a
+state object and an instance dict next to every instance. The types of
+this module are never mapped: order lines are named tuples and batches
+keep their fields in slots and their lines as quantities by orderid, so
+planning runs holding millions of lines in memory pay a fraction of the
+cost. They follow the same allocation rules as the model module and
+convert from and to Batch at the boundaries.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import (
+    Dict,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderId,
+    OrderLine,
+    Quantity,
+    Reference,
+    Sku,
+)
+from corelib.exceptions import OutOfStock
+
+
+class CompactLine(NamedTuple):
+    """Order line as a plain tuple."""
+
+    orderid: OrderId
+    sku: Sku
+    qty: Quantity
+
+
+class CompactBatch:
+    """Batch with slotted fields and its lines as quantities by orderid."""
+
+    __slots__ = (
+        "reference",
+        "sku",
+        "eta",
+        "closed",
+        "purchased_quantity",
+        "allocated_quantity",
+        "lines",
+    )
+
+    def __init__(
+        self, ref: Reference, sku: Sku, qty: Quantity, eta: Optional[date]
+    ):
+        """Initialize a compact batch without allocations.
+
+        Args:
+            ref: Reference number to track the batch.
+            sku: Product identifier.
+            qty: Purchased quantity.
+            eta: Estimated time of arrival.
+        """
+        self.reference = ref
+        self.sku = sku
+        self.eta = eta
+        self.closed = False
+        self.purchased_quantity = qty
+        self.allocated_quantity = 0
+        self.lines: Dict[OrderId, Quantity] = {}
+
+    @classmethod
+    def of(cls, batch: Batch) -> CompactBatch:
+        """Return the compact copy of a batch, allocations included.
+
+        Args:
+            batch: Order batch.
+
+        Returns:
+            compact: Compact batch.
+        """
+        compact = cls(
+            batch.reference, batch.sku, batch._purchased_quantity, batch.eta
+        )
+        compact.closed = batch.closed
+        for line in batch._allocations:
+            compact.lines[line.orderid] = line.qty
+        compact.allocated_quantity = sum(compact.lines.values())
+        return compact
+
+    def to_batch(self) -> Batch:
+        """Return the batch the compact one stands for.
+
+        Returns:
+            batch: Order batch with the allocated lines.
+        """
+        batch = Batch(
+            self.reference, self.sku, self.purchased_quantity, self.eta
+        )
+        for orderid, qty in self.lines.items():
+            batch.allocate(OrderLine(orderid, self.sku, qty))
+        batch.closed = self.closed
+        return batch
+
+    @property
+    def available_quantity(self) -> int:
+        """Calculate number of available items inside the batch."""
+        return self.purchased_quantity - self.allocated_quantity
+
+    def can_allocate(self, line: CompactLine) -> bool:
+        """Test if the order line can be allocated, as Batch.can_allocate.
+
+        Args:
+            line: Compact order line.
+
+        Returns:
+            True if the line can be allocated to the batch.
+        """
+        return (
+            not self.closed
+            and self.sku == line.sku
+            and line.qty <= self.available_quantity
+        )
+
+    def allocate(self, line: CompactLine) -> None:
+        """Allocate an order line, once per orderid.
+
+        Args:
+            line: Compact order line.
+
+        Returns:
+            None
+        """
+        if self.can_allocate(line) and line.orderid not in self.lines:
+            self.lines[line.orderid] = line.qty
+            self.allocated_quantity += line.qty
+
+    def deallocate(self, orderid: OrderId) -> None:
+        """Release the line of an order, reopening a closed batch.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            None
+        """
+        qty = self.lines.pop(orderid, None)
+        if qty is not None:
+            self.allocated_quantity -= qty
+            self.closed = False
+
+
+def eta_key(batch: CompactBatch) -> Tuple[bool, date]:
+    """Sort key matching model.eta_key: warehouse stock first, then by ETA.
+
+    Args:
+        batch: Compact batch.
+
+    Returns:
+        key: (is shipment, eta) tuple.
+    """
+    return batch.eta is not None, batch.eta or date.min
+
+
+def allocate(line: CompactLine, batches: Iterable[CompactBatch]) -> str:
+    """Allocate an order line to the earliest compact batch that fits.
+
+    Args:
+        line: Compact order line.
+        batches: Compact batches.
+
+    Returns:
+        batch_reference: Reference of the batch the line was allocated to.
+    """
+    for batch in sorted(batches, key=eta_key):
+        if batch.can_allocate(line):
+            batch.allocate(line)
+            return batch.reference
+    raise OutOfStock(f"Out of stock for sku: {line.sku}")
@@ -7,15 +7,23 @@ Licence,
 """
 from __future__ import annotations
 
+from bisect import bisect_right
 from dataclasses import dataclass
 from datetime import date
 from typing import (
+    Dict,
+    Iterable,
     List,
     NewType,
     Optional,
+    Set,
+    Tuple,
 )
 
-from corelib.exceptions import OutOfStock
+from corelib.exceptions import (
+    OutOfStock,
+    UnallocatedOrder,
+)
 
 OrderId = NewType("OrderId", str)
 Quantity = NewType("Quantity", int)
@@ -32,9 +40,30 @@ class OrderLine:
     qty: Quantity
 
 
+@dataclass(frozen=True)
+class AllocationResult:
+    """Outcome of allocating one order line within a bulk allocation."""
+
+    line: OrderLine
+    batchref: Optional[str] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        """True if the line got allocated to a batch."""
+        return self.error is None
+
+
 class Batch:
     """Model for the batches of stock that the purchasing department orders."""
 
+    _allocations: Set[OrderLine]
+
+    # Instances loaded by the ORM skip __init__, so the derived state falls
+    # back to these class defaults and gets rebuilt on first access.
+    _allocated_quantity: Optional[int] = None
+    _lines_by_order: Optional[Dict[OrderId, OrderLine]] = None
+
     def __init__(
         self, ref: Reference, sku: Sku, qty: Quantity, eta: Optional[date]
     ):
@@ -49,8 +78,37 @@ class Batch:
         self.reference = ref
         self.sku = sku
         self.eta = eta
+        self.closed = False
         self._purchased_quantity = qty
         self._allocations = set()
+        self._allocated_quantity = 0
+        self._lines_by_order = None
+
+    def amend(self, qty: Quantity, eta: Optional[date]) -> None:
+        """Amend the purchased quantity and ETA with an updated purchase.
+
+        Args:
+            qty: Purchased quantity.
+            eta: Estimated time of arrival.
+
+        Returns:
+            None
+        """
+        self._purchased_quantity = qty
+        self.eta = eta
+
+    def close(self) -> None:
+        """Stop the batch from taking new allocations.
+
+        Closed batches are left out of the allocation queries and, once
+        fully consumed, can be moved to the archive. Lines already
+        allocated can still be deallocated, which reopens the batch so the
+        stock they release is allocated again.
+
+        Returns:
+            None
+        """
+        self.closed = True
 
     def allocate(self, line: OrderLine):
         """Allocate customer order line to order batch.
@@ -65,14 +123,17 @@ class Batch:
         Returns:
             None
         """
-        if self.can_allocate(line):
+        if self.can_allocate(line) and line not in self._allocations:
+            self._allocated_quantity = self.allocated_quantity + line.qty
             self._allocations.add(line)
+            if self._lines_by_order is not None:
+                self._lines_by_order[line.orderid] = line
 
     def deallocate(self, line: OrderLine):
         """Deallocate customer order line to order batch.
 
          The order line only ggets deallocated if it as previously allocated
-         to the batch.
+         to the batch. A closed batch is reopened, since it has stock again.
 
         Args:
             line: Customer order line.
@@ -81,12 +142,66 @@ class Batch:
             None
         """
         if line in self._allocations:
+            self._allocated_quantity = self.allocated_quantity - line.qty
             self._allocations.remove(line)
+            if self._lines_by_order is not None:
+                self._lines_by_order.pop(line.orderid, None)
+            self.closed = False
+
+    def get_line(self, orderid: OrderId) -> Optional[OrderLine]:
+        """Return the line of an order allocated to the batch.
+
+        The orderid lookup table is built on first use and then kept up to
+        date by allocate and deallocate.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            line: Allocated order line, None if the order is not in the batch.
+        """
+        if self._lines_by_order is None:
+            self._lines_by_order = {
+                line.orderid: line for line in self._allocations
+            }
+        return self._lines_by_order.get(orderid)
+
+    def seed_allocated_quantity(self, qty: Quantity) -> None:
+        """Set the running counter from a quantity computed elsewhere.
+
+        Lets a repository hand over the allocated quantity summed by the
+        database, so checking availability does not load the order lines.
+
+        Args:
+            qty: Quantity allocated to the batch.
+
+        Returns:
+            None
+        """
+        self._allocated_quantity = qty
+
+    def reset_allocation_cache(self) -> None:
+        """Discard the state derived from the allocations.
+
+        The running counter and the orderid lookup table get rebuilt on
+        first access. The ORM calls this whenever _allocations is (re)loaded
+        from the database behind the domain model's back.
+
+        Returns:
+            None
+        """
+        self._allocated_quantity = None
+        self._lines_by_order = None
 
     @property
     def allocated_quantity(self) -> int:
-        """Calculate number of allocated items inside the batch."""
-        return sum(line.qty for line in self._allocations)
+        """Return number of allocated items inside the batch."""
+        # Instances loaded by the ORM skip __init__ and start without counter.
+        if self._allocated_quantity is None:
+            self._allocated_quantity = sum(
+                line.qty for line in self._allocations
+            )
+        return self._allocated_quantity
 
     @property
     def available_quantity(self) -> int:
@@ -96,8 +211,8 @@ class Batch:
     def can_allocate(self, line: OrderLine) -> bool:
         """Test if the customer order line can be allocated to the batch.
 
-        An order line only can be allocated if its sku matches the batch sku
-        and its quantity <= batch available quantity.
+        An order line only can be allocated if the batch is open, its sku
+        matches the batch sku and its quantity <= batch available quantity.
 
         Args:
             line:
@@ -105,7 +220,11 @@ class Batch:
         Returns:
             True if customer order line can be allocated to batch.
         """
-        return self.sku == line.sku and line.qty <= self.available_quantity
+        return (
+            not self.closed
+            and self.sku == line.sku
+            and line.qty <= self.available_quantity
+        )
 
     def __gt__(self, other: Batch) -> bool:
         """Greater than operator use ETAs."""
@@ -130,6 +249,367 @@ class Batch:
         return hash(self.reference)
 
 
+def eta_key(batch: Batch) -> Tuple[bool, date]:
+    """Sort key matching Batch.__gt__: warehouse stock first, then by ETA.
+
+    Args:
+        batch: Order batch.
+
+    Returns:
+        key: (is shipment, eta) tuple.
+    """
+    return batch.eta is not None, batch.eta or date.min
+
+
+class _SkuIndex:
+    """ETA ordered batches of one SKU with trees of their available stock.
+
+    Every leaf holds the available quantity of one batch. In the max-tree
+    every inner node holds the maximum of its children, so the earliest
+    batch that fits a line is found walking down a single root to leaf
+    path, and used up batches are pruned from the search without being
+    visited. In the sum-tree it holds their sum, so the stock available up
+    to any batch adds O(log k) nodes.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._batches: List[Batch] = []
+        self._positions: Dict[Reference, int] = {}
+        self._keys: List[Tuple[bool, date]] = []
+        self._tree: List[float] = []
+        self._sums: List[int] = []
+        self._size = 0
+        self._dirty = False
+
+    @property
+    def batches(self) -> List[Batch]:
+        """Indexed batches."""
+        return self._batches
+
+    def add(self, batch: Batch) -> None:
+        """Add a batch, the tree gets rebuilt lazily on the next lookup.
+
+        Args:
+            batch: Order batch.
+
+        Returns:
+            None
+        """
+        if batch.reference in self._positions:
+            return
+        self._positions[batch.reference] = len(self._batches)
+        self._batches.append(batch)
+        self._dirty = True
+
+    def _rebuild(self) -> None:
+        """Sort the batches by ETA and rebuild the tree."""
+        self._batches.sort(key=eta_key)
+        self._positions = {b.reference: i for i, b in enumerate(self._batches)}
+        self._keys = [eta_key(b) for b in self._batches]
+        self._size = 1
+        while self._size < len(self._batches):
+            self._size *= 2
+        self._tree = [float("-inf")] * (2 * self._size)
+        self._sums = [0] * (2 * self._size)
+        for i, batch in enumerate(self._batches):
+            self._set_leaf(self._size + i, batch)
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = max(
+                self._tree[2 * node], self._tree[2 * node + 1]
+            )
+            self._sums[node] = self._sums[2 * node] + self._sums[2 * node + 1]
+        self._dirty = False
+
+    def _set_leaf(self, node: int, batch: Batch) -> None:
+        """Store the available quantity of a batch, none if it is closed."""
+        if batch.closed:
+            self._tree[node] = float("-inf")
+            self._sums[node] = 0
+        else:
+            self._tree[node] = batch.available_quantity
+            self._sums[node] = batch.available_quantity
+
+    def update(self, batch: Batch) -> None:
+        """Propagate the batch available quantity up the trees.
+
+        Args:
+            batch: Order batch previously added to the index.
+
+        Returns:
+            None
+        """
+        if self._dirty:
+            return
+        node = self._size + self._positions[batch.reference]
+        self._set_leaf(node, batch)
+        node //= 2
+        while node:
+            self._tree[node] = max(
+                self._tree[2 * node], self._tree[2 * node + 1]
+            )
+            self._sums[node] = self._sums[2 * node] + self._sums[2 * node + 1]
+            node //= 2
+
+    def find(self, qty: Quantity) -> Optional[Batch]:
+        """Return the earliest batch with at least qty available.
+
+        Args:
+            qty: Required quantity.
+
+        Returns:
+            batch: Earliest batch that fits, None if there is none.
+        """
+        if self._dirty:
+            self._rebuild()
+        if not self._batches or self._tree[1] < qty:
+            return None
+        node = 1
+        while node < self._size:
+            node *= 2
+            if self._tree[node] < qty:
+                node += 1
+        return self._batches[node - self._size]
+
+    def available_by(self, eta: Optional[date]) -> int:
+        """Return the stock of the batches arriving by an ETA.
+
+        Args:
+            eta: Estimated time of arrival, None for warehouse stock only.
+
+        Returns:
+            qty: Cumulative available quantity.
+        """
+        if self._dirty:
+            self._rebuild()
+        count = bisect_right(self._keys, (eta is not None, eta or date.min))
+        total = 0
+        low, high = self._size, self._size + count
+        while low < high:
+            if low % 2:
+                total += self._sums[low]
+                low += 1
+            if high % 2:
+                high -= 1
+                total += self._sums[high]
+            low //= 2
+            high //= 2
+        return total
+
+    def timeline(self) -> List[Tuple[Optional[date], int]]:
+        """Return the cumulative available stock at each ETA.
+
+        Returns:
+            timeline: (eta, qty) pairs, warehouse stock first with a None
+                eta, then one pair per shipment date.
+        """
+        if self._dirty:
+            self._rebuild()
+        timeline: List[Tuple[Optional[date], int]] = []
+        total = 0
+        for i, batch in enumerate(self._batches):
+            total += self._sums[self._size + i]
+            if timeline and timeline[-1][0] == batch.eta:
+                timeline[-1] = (batch.eta, total)
+            else:
+                timeline.append((batch.eta, total))
+        return timeline
+
+
+class AllocationIndex:
+    """Batches grouped by SKU and ordered by ETA for fast allocation.
+
+    Finding the batch for a line costs O(log k), k being the number of
+    batches for the line SKU. Batches changed outside the index must be
+    passed to refresh so the index sees their new available quantity.
+    """
+
+    def __init__(self, batches: Iterable[Batch] = ()):
+        """Initialize the index with the provided batches.
+
+        Args:
+            batches: Order batches.
+        """
+        self._skus: Dict[Sku, _SkuIndex] = {}
+        self._orders: Optional[Dict[OrderId, Dict[Sku, Batch]]] = None
+        for batch in batches:
+            self.add(batch)
+
+    def add(self, batch: Batch) -> None:
+        """Add a batch to the index.
+
+        Args:
+            batch: Order batch.
+
+        Returns:
+            None
+        """
+        self._skus.setdefault(batch.sku, _SkuIndex()).add(batch)
+        if self._orders is not None:
+            self._index_orders(self._orders, batch)
+
+    @staticmethod
+    def _index_orders(
+        orders: Dict[OrderId, Dict[Sku, Batch]], batch: Batch
+    ) -> None:
+        """Add the lines allocated to the batch to the orderid index."""
+        for line in batch._allocations:
+            orders.setdefault(line.orderid, {})[line.sku] = batch
+
+    def _order_index(self) -> Dict[OrderId, Dict[Sku, Batch]]:
+        """Return the orderid index, built on first use.
+
+        It is then kept up to date by allocate and deallocate.
+        """
+        if self._orders is None:
+            self._orders = {}
+            for sku_index in self._skus.values():
+                for batch in sku_index.batches:
+                    self._index_orders(self._orders, batch)
+        return self._orders
+
+    def locate(self, orderid: OrderId, sku: Sku) -> Optional[Batch]:
+        """Return the batch an order line is allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch: Batch holding the line, None if it is not allocated.
+        """
+        return self._order_index().get(orderid, {}).get(sku)
+
+    def locate_order(self, orderid: OrderId) -> List[Batch]:
+        """Return the batches the lines of an order are allocated to.
+
+        Args:
+            orderid: Customer order identifier.
+
+        Returns:
+            batches: One batch per allocated line of the order.
+        """
+        return list(self._order_index().get(orderid, {}).values())
+
+    def refresh(self, batch: Batch) -> None:
+        """Refresh the available quantity of an indexed batch.
+
+        Args:
+            batch: Order batch previously added to the index.
+
+        Returns:
+            None
+        """
+        self._skus[batch.sku].update(batch)
+
+    def available_to_promise(
+        self, sku: Sku
+    ) -> List[Tuple[Optional[date], int]]:
+        """Return the cumulative available stock of a SKU over ETAs.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            timeline: (eta, qty) pairs, warehouse stock first with a None
+                eta, then one pair per shipment date. Empty for unknown
+                skus.
+        """
+        sku_index = self._skus.get(sku)
+        return sku_index.timeline() if sku_index else []
+
+    def available_by(self, sku: Sku, eta: Optional[date]) -> int:
+        """Return the stock of a SKU available by an ETA, in O(log k).
+
+        Args:
+            sku: Product identifier.
+            eta: Estimated time of arrival, None for warehouse stock only.
+
+        Returns:
+            qty: Cumulative available quantity.
+        """
+        sku_index = self._skus.get(sku)
+        return sku_index.available_by(eta) if sku_index else 0
+
+    def find(self, sku: Sku, qty: Quantity) -> Batch:
+        """Return the batch allocate would pick for a line, in O(log k).
+
+        Args:
+            sku: Product identifier.
+            qty: Quantity of the line.
+
+        Returns:
+            batch: Earliest batch that can take the line, left unchanged.
+        """
+        sku_index = self._skus.get(sku)
+        batch = sku_index.find(qty) if sku_index else None
+        if batch is None:
+            raise OutOfStock(f"Out of stock for sku: {sku}")
+        return batch
+
+    def earliest_eta(self, sku: Sku, qty: Quantity) -> Optional[date]:
+        """Return when a line of qty could be allocated, in O(log k).
+
+        Lines are never split across batches, so this is the ETA of the
+        batch allocate would pick, not the date the cumulative stock
+        reaches qty.
+
+        Args:
+            sku: Product identifier.
+            qty: Quantity of the line.
+
+        Returns:
+            eta: Estimated time of arrival, None if warehouse stock fits.
+        """
+        return self.find(sku, qty).eta
+
+    def allocate(self, line: OrderLine) -> str:
+        """Allocate order line to the earliest batch that can take it.
+
+        Args:
+            line: Order line.
+
+        Returns:
+            batch_reference:
+                Reference of the batch in which the line was allocated.
+        """
+        batch = self.find(line.sku, line.qty)
+        batch.allocate(line)
+        self.refresh(batch)
+        if self._orders is not None:
+            self._orders.setdefault(line.orderid, {})[line.sku] = batch
+
+        return batch.reference
+
+    def deallocate(self, orderid: OrderId, sku: Sku) -> str:
+        """Deallocate an order line from the batch that holds it.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batch_reference:
+                Reference of the batch the line was deallocated from.
+        """
+        batch = self.locate(orderid, sku)
+        line = None if batch is None else batch.get_line(orderid)
+        if batch is None or line is None:
+            raise UnallocatedOrder(
+                f"Order {orderid} is not allocated for sku: {sku}"
+            )
+
+        batch.deallocate(line)
+        self.refresh(batch)
+        orders = self._order_index()
+        lines = orders[orderid]
+        del lines[sku]
+        if not lines:
+            del orders[orderid]
+
+        return batch.reference
+
+
 def allocate(line: OrderLine, batches: List[Batch]) -> str:
     """Allocate order line to the earliest Batch.
 
@@ -142,12 +622,53 @@ def allocate(line: OrderLine, batches: List[Batch]) -> str:
             Reference of the batch in which the line was allocated.
 
     """
-    try:
-        batch = next(b for b in sorted(batches) if b.can_allocate(line))
+    return AllocationIndex(b for b in batches if b.sku == line.sku).allocate(
+        line
+    )
 
-    except StopIteration:
-        raise OutOfStock(f"Out of stock for sku: {line.sku}")
 
-    batch.allocate(line)
+def available_to_promise(
+    sku: Sku, batches: List[Batch]
+) -> List[Tuple[Optional[date], int]]:
+    """Return the cumulative available stock of a SKU over ETAs.
+
+    Args:
+        sku: Product identifier.
+        batches: List of order batches.
 
-    return batch.reference
+    Returns:
+        timeline: (eta, qty) pairs, warehouse stock first with a None eta,
+            then one pair per shipment date.
+    """
+    return AllocationIndex(
+        b for b in batches if b.sku == sku
+    ).available_to_promise(sku)
+
+
+def allocate_many(
+    lines: Iterable[OrderLine], batches: List[Batch]
+) -> List[AllocationResult]:
+    """Allocate many order lines against one set of batches.
+
+    Lines are allocated in the given order, so the outcome is the same as
+    calling allocate once per line, but the batches are indexed only once.
+
+    Args:
+        lines: Order lines.
+        batches: List of order batches.
+
+    Returns:
+        results: One allocation result per line, in the same order.
+    """
+    lines = list(lines)
+    skus = {line.sku for line in lines}
+    index = AllocationIndex(b for b in batches if b.sku in skus)
+
+    results = []
+    for line in lines:
+        try:
+            results.append(AllocationResult(line, index.allocate(line)))
+        except OutOfStock as e:
+            results.append(AllocationResult(line, error=e))
+
+    return results
@@ -9,25 +9,52 @@ from flask import (
     Flask,
     request,
 )
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.session import Session
 
 import corelib.allocation.adapters.orm as orm
 import corelib.allocation.adapters.repository as repository
 import corelib.allocation.config as config
 import corelib.allocation.domain.model as model
 import corelib.allocation.service_layer.services as services
+import corelib.allocation.service_layer.views as views
+from corelib.allocation.service_layer.catalogue import SkuCatalogue
+from corelib.allocation.service_layer.coalescer import AllocationCoalescer
+from corelib.allocation.service_layer.idempotency import IdempotencyCache
 
 orm.start_mappers()
-get_session = sessionmaker(bind=create_engine(config.get_postgres_uri()))
+engine = config.make_engine()
+get_session = sessionmaker(bind=engine)
+catalogue = SkuCatalogue()
+idempotency = IdempotencyCache()
+batch_cache = repository.BatchCache()
+
+
+def make_repository(session: Session) -> repository.CachingRepository:
+    """Build the repository of a request, over the process batch cache."""
+    return repository.CachingRepository(
+        repository.SQLAlchemyRepository(session), batch_cache
+    )
+
+
+coalescing = config.get_coalescing_options()
+coalescer = (
+    AllocationCoalescer(
+        get_session,
+        repository_factory=make_repository,
+        catalogue=catalogue,
+        idempotency=idempotency,
+        **coalescing,
+    )
+    if coalescing
+    else None
+)
 app = Flask(__name__)
 
 
 @app.route("/allocate", methods=["POST"])
 def allocate_endpoint():
     """Allocate order line to database batches."""
-    session = get_session()
-    repo = repository.SQLAlchemyRepository(session)
     line = model.OrderLine(
         request.json["orderid"],
         request.json["sku"],
@@ -35,8 +62,46 @@ def allocate_endpoint():
     )
 
     try:
-        batchref = services.allocate(line, repo, session)
+        if coalescer is not None:
+            batchref = coalescer.allocate(line)
+        else:
+            session = get_session()
+            repo = make_repository(session)
+            batchref = services.allocate(
+                line, repo, session, catalogue, idempotency=idempotency
+            )
     except (model.OutOfStock, services.InvalidSku) as e:
         return {"message": str(e)}, 400
 
     return {"batchref": batchref}, 201
+
+
+@app.route("/availability/<sku>", methods=["GET"])
+def availability_endpoint(sku: model.Sku):
+    """Report the quantity of a sku that can be promised, by batch and ETA."""
+    session = get_session()
+    try:
+        rows = views.availability(sku, session)
+        # Skus whose batches are all closed have nothing left to promise.
+        known = bool(rows) or catalogue.contains(
+            sku, repository.SQLAlchemyRepository(session)
+        )
+    finally:
+        session.close()
+    if not known:
+        return {"message": f"Invalid sku {sku}"}, 404
+
+    return {
+        "sku": sku,
+        "available_qty": sum(row["available_qty"] for row in rows),
+        "batches": [
+            dict(row, eta=row["eta"].isoformat() if row["eta"] else None)
+            for row in rows
+        ],
+    }, 200
+
+
+@app.route("/metrics/pool", methods=["GET"])
+def pool_metrics_endpoint():
+    """Report database connection pool usage."""
+    return config.get_pool_metrics(engine), 200
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Bulk batch ingestion entrypoint for purchasing feeds.
+
+Streams a CSV or NDJSON file of batches (reference, sku, qty, eta) into the
+database without loading it in memory:
+
+    python -m corelib.allocation.entrypoints.ingest shipments.csv
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import argparse
+import csv
+import json
+from datetime import date
+from pathlib import Path
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+)
+
+from sqlalchemy.orm import sessionmaker
+
+import corelib.allocation.config as config
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    Quantity,
+    Reference,
+    Sku,
+)
+
+
+def to_batch(record: Dict) -> Batch:
+    """Build a batch from a purchasing feed record.
+
+    Args:
+        record: mapping with reference, sku, qty and an optional ISO eta.
+
+    Returns:
+        batch: purchased batch.
+    """
+    eta = record.get("eta") or None
+    return Batch(
+        Reference(record["reference"]),
+        Sku(record["sku"]),
+        Quantity(int(record["qty"])),
+        eta=date.fromisoformat(eta) if eta else None,
+    )
+
+
+def read_csv(stream: TextIO) -> Iterator[Batch]:
+    """Read batches from a CSV stream with a header row.
+
+    Args:
+        stream: text stream.
+
+    Returns:
+        batches: iterator over the batches, one row at a time.
+    """
+    for record in csv.DictReader(stream):
+        yield to_batch(record)
+
+
+def read_ndjson(stream: TextIO) -> Iterator[Batch]:
+    """Read batches from a newline delimited JSON stream.
+
+    Args:
+        stream: text stream.
+
+    Returns:
+        batches: iterator over the batches, one line at a time.
+    """
+    for line in stream:
+        if line.strip():
+            yield to_batch(json.loads(line))
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Ingest a purchasing feed file in a single transaction.
+
+    Args:
+        argv: command line arguments, sys.argv by default.
+
+    Returns:
+        count: number of batches added or updated.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--format", choices=sorted(READERS))
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--db-uri", default=None)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or args.path.suffix.lstrip(".").lower()
+    if fmt not in READERS:
+        parser.error(f"unknown format for {args.path}, use --format")
+
+    session = sessionmaker(bind=config.make_engine(args.db_uri))()
+    try:
+        with args.path.open(newline="") as stream:
+            count = SQLAlchemyRepository(session).add_many(
+                READERS[fmt](stream), chunk_size=args.chunk_size
+            )
+        session.commit()
+    finally:
+        session.close()
+
+    print(f"Ingested {count} batches from {args.path}")
+    return count
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Schema upgrade entrypoint for existing databases.
+
+Creates the missing tables and indexes, safe to run at every deployment:
+
+    python -m corelib.allocation.entrypoints.migrate
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import argparse
+from typing import (
+    List,
+    Optional,
+)
+
+import corelib.allocation.config as config
+from corelib.allocation.adapters.orm import upgrade_schema
+
+
+def main(argv: Optional[List[str]] = None) -> List[str]:
+    """Upgrade the schema of the configured database.
+
+    Args:
+        argv: command line arguments, sys.argv by default.
+
+    Returns:
+        created: names of the indexes created.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-uri", default=None)
+    args = parser.parse_args(argv)
+
+    engine = config.make_engine(args.db_uri)
+    try:
+        created = upgrade_schema(engine)
+    finally:
+        engine.dispose()
+
+    print(f"Created {len(created)} indexes: {', '.join(created) or '-'}")
+    return created
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""Async service module for allocation libray.
+
+Same use cases as the services module, awaiting the repository and the
+session instead of blocking on them.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import asyncio
+import random
+from dataclasses import replace
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Tuple,
+    TypeVar,
+)
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from corelib.allocation.adapters.async_repository import (
+    AsyncSQLAlchemyRepository,
+)
+from corelib.allocation.domain.model import (
+    AllocationResult,
+    OrderId,
+    OrderLine,
+    Sku,
+)
+from corelib.allocation.domain.model import allocate as _allocate
+from corelib.allocation.domain.model import allocate_many as _allocate_many
+from corelib.allocation.service_layer.services import (
+    BACKOFF,
+    RETRIES,
+    Concurrency,
+    is_valid_sku,
+)
+from corelib.exceptions import (
+    InvalidSku,
+    UnallocatedOrder,
+    VersionConflict,
+)
+
+T = TypeVar("T")
+
+
+async def _retry(
+    attempt: Callable[[], Awaitable[T]],
+    session: AsyncSession,
+    retries: int,
+    backoff: float,
+) -> T:
+    """Run a transaction again after version conflicts.
+
+    Args:
+        attempt: Transaction, committing on success.
+        session: Async data base session, rolled back after a conflict.
+        retries: Number of attempts after the first one.
+        backoff: Seconds before the first retry, doubled at each one and
+            jittered so the conflicting transactions spread out.
+
+    Returns:
+        result: Result of the successful attempt.
+    """
+    retry = 0
+    while True:
+        try:
+            return await attempt()
+        except VersionConflict:
+            await session.rollback()
+            if retry == retries:
+                raise
+            await asyncio.sleep(
+                backoff * 2**retry * random.uniform(0.5, 1.5)
+            )
+            retry += 1
+
+
+async def allocate(
+    line: OrderLine,
+    repo: AsyncSQLAlchemyRepository,
+    session: AsyncSession,
+    concurrency: Concurrency = Concurrency.optimistic,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> str:
+    """Allocate order line to available batches for a given repo.
+
+    Allocation is idempotent by orderid and sku: a retried request gets the
+    batch of the original one back, once the unique constraint of the
+    order lines rejected the duplicate.
+
+    Args:
+        line: Order line to allocate.
+        repo: Async data repository.
+        session: Async data base session.
+        concurrency: Guard against concurrent allocations of the sku.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+
+    Returns:
+        batchref: batch reference to which the order was assigned.
+    """
+
+    async def attempt() -> str:
+        version = await repo.get_version(
+            line.sku, for_update=concurrency is Concurrency.pessimistic
+        )
+        batches = await repo.list_for_sku(line.sku)
+        if not is_valid_sku(line.sku, batches) and not await repo.has_sku(
+            line.sku
+        ):
+            raise InvalidSku(f"Invalid sku {line.sku}")
+
+        batchref = _allocate(replace(line), batches)
+        await repo.bump_version(line.sku, version)
+
+        await session.commit()
+
+        return batchref
+
+    try:
+        return await _retry(attempt, session, retries, backoff)
+    except IntegrityError:
+        await session.rollback()
+        batchref = await repo.get_reference_by_order(line.orderid, line.sku)
+        if batchref is None:
+            raise
+        return batchref
+
+
+async def allocate_many(
+    lines: Iterable[OrderLine],
+    repo: AsyncSQLAlchemyRepository,
+    session: AsyncSession,
+    concurrency: Concurrency = Concurrency.optimistic,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> List[AllocationResult]:
+    """Allocate a burst of order lines with a single load and commit.
+
+    Lines repeating the orderid and sku of a previous line, in the burst or
+    already allocated, get the result of the original one.
+
+    Args:
+        lines: Order lines to allocate.
+        repo: Async data repository.
+        session: Async data base session.
+        concurrency: Guard against concurrent allocations of the skus.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+
+    Returns:
+        results: batch reference or error for each line, in the same order.
+    """
+    lines = list(lines)
+    first: Dict[Tuple[OrderId, Sku], OrderLine] = {}
+    for line in lines:
+        first.setdefault((line.orderid, line.sku), line)
+
+    async def attempt(pending: List[OrderLine]) -> List[AllocationResult]:
+        versions = {
+            sku: await repo.get_version(
+                sku, for_update=concurrency is Concurrency.pessimistic
+            )
+            for sku in sorted({line.sku for line in pending})
+        }
+        batches = [
+            batch for sku in versions for batch in await repo.list_for_sku(sku)
+        ]
+        # Skus whose batches are all closed are out of stock, not invalid.
+        skus = {b.sku for b in batches}
+        skus |= {
+            sku
+            for sku in versions
+            if sku not in skus and await repo.has_sku(sku)
+        }
+
+        allocated = iter(
+            _allocate_many(
+                [replace(line) for line in pending if line.sku in skus],
+                batches,
+            )
+        )
+        results = [
+            next(allocated)
+            if line.sku in skus
+            else AllocationResult(
+                line, error=InvalidSku(f"Invalid sku {line.sku}")
+            )
+            for line in pending
+        ]
+        for sku in sorted(skus):
+            await repo.bump_version(sku, versions[sku])
+
+        await session.commit()
+
+        return results
+
+    done: Dict[Tuple[OrderId, Sku], AllocationResult] = {}
+    pending = list(first.values())
+    while pending:
+        try:
+            results = await _retry(
+                lambda: attempt(pending), session, retries, backoff
+            )
+        except IntegrityError:
+            await session.rollback()
+            found = {}
+            for line in pending:
+                batchref = await repo.get_reference_by_order(
+                    line.orderid, line.sku
+                )
+                if batchref is not None:
+                    found[(line.orderid, line.sku)] = batchref
+            if not found:
+                raise
+            for key, batchref in found.items():
+                done[key] = AllocationResult(first[key], batchref)
+            pending = [
+                line
+                for line in pending
+                if (line.orderid, line.sku) not in found
+            ]
+            continue
+        for result in results:
+            done[(result.line.orderid, result.line.sku)] = result
+        pending = []
+
+    return [
+        replace(done[(line.orderid, line.sku)], line=line) for line in lines
+    ]
+
+
+async def deallocate(
+    orderid: OrderId,
+    sku: Sku,
+    repo: AsyncSQLAlchemyRepository,
+    session: AsyncSession,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> str:
+    """Cancel the allocation of an order line, looked up by its orderid.
+
+    Args:
+        orderid: Customer order identifier.
+        sku: Product identifier.
+        repo: Async data repository.
+        session: Async data base session.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+
+    Returns:
+        batchref: batch reference from which the line was deallocated.
+    """
+
+    async def attempt() -> str:
+        version = await repo.get_version(sku)
+        batch = await repo.get_by_order(orderid, sku)
+        line = None if batch is None else batch.get_line(orderid)
+        if batch is None or line is None:
+            raise UnallocatedOrder(
+                f"Order {orderid} is not allocated for sku: {sku}"
+            )
+
+        batch.deallocate(line)
+        await repo.bump_version(sku, version)
+
+        await session.commit()
+
+        return batch.reference
+
+    return await _retry(attempt, session, retries, backoff)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""SKU catalogue module.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import threading
+from typing import (
+    Iterable,
+    Set,
+)
+
+from corelib.allocation.adapters.repository import AbstractRepository
+from corelib.allocation.domain.model import Sku
+
+
+class SkuCatalogue:
+    """Set of the SKUs known to have batches, shared across requests.
+
+    Known SKUs are answered from memory. Any other SKU costs one EXISTS
+    query to the repository and is only remembered when it exists, so SKUs
+    whose first batch is added by another process are found on the next
+    request.
+    """
+
+    def __init__(self, skus: Iterable[Sku] = ()):
+        """Initialize the catalogue with already known SKUs.
+
+        Args:
+            skus: Product identifiers known to have batches.
+        """
+        self._known: Set[Sku] = set(skus)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of SKUs known to have batches."""
+        return len(self._known)
+
+    def add(self, sku: Sku) -> None:
+        """Record a SKU that just got a batch.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._known.add(sku)
+
+    def discard(self, sku: Sku) -> None:
+        """Forget a SKU, e.g. once its batches are removed.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._known.discard(sku)
+
+    def contains(self, sku: Sku, repo: AbstractRepository) -> bool:
+        """Test if a SKU has batches, asking the repository on a miss.
+
+        Args:
+            sku: Product identifier.
+            repo: Data repository.
+
+        Returns:
+            True if the SKU has at least one batch.
+        """
+        if sku in self._known:
+            return True
+        if not repo.has_sku(sku):
+            return False
+        self.add(sku)
+        return True
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Micro-batching of concurrent allocations of the same SKU.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import threading
+from concurrent.futures import Future
+from dataclasses import (
+    dataclass,
+    field,
+)
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+
+from sqlalchemy.orm.session import Session
+
+from corelib.allocation.adapters.repository import (
+    AbstractRepository,
+    SQLAlchemyRepository,
+)
+from corelib.allocation.domain.model import (
+    OrderLine,
+    Sku,
+)
+from corelib.allocation.service_layer import services
+from corelib.allocation.service_layer.catalogue import SkuCatalogue
+from corelib.allocation.service_layer.idempotency import IdempotencyCache
+
+
+@dataclass
+class _Group:
+    """Lines of one SKU waiting to be allocated together."""
+
+    lines: List[OrderLine] = field(default_factory=list)
+    futures: List[Future] = field(default_factory=list)
+    full: threading.Event = field(default_factory=threading.Event)
+
+
+@dataclass
+class _FlushLock:
+    """Lock serializing the flushes of one SKU, with its leaders count."""
+
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    leaders: int = 0
+
+
+class AllocationCoalescer:
+    """Allocate concurrent requests for a SKU in a single transaction.
+
+    The first request of a SKU leads a group: it waits up to window
+    seconds, or until max_batch requests joined, then allocates the whole
+    group in arrival order with services.allocate_many and hands each
+    caller its own batch reference or error. Groups of the same SKU are
+    flushed one at a time, requests arriving meanwhile form the next one;
+    the flush lock of a SKU is dropped once no leader holds or awaits it.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        repository_factory: Callable[
+            [Session], AbstractRepository
+        ] = SQLAlchemyRepository,
+        window: float = 0.002,
+        max_batch: int = 64,
+        catalogue: Optional[SkuCatalogue] = None,
+        idempotency: Optional[IdempotencyCache] = None,
+    ):
+        """Initialize the coalescer.
+
+        Args:
+            session_factory: Opens a database session per group.
+            repository_factory: Builds the repository on a session.
+            window: Seconds the leader of a group waits for more requests.
+            max_batch: Number of requests flushing a group at once.
+            catalogue: Known SKUs, shared with the direct allocations.
+            idempotency: Recent allocations, shared with the direct
+                allocations.
+        """
+        self.session_factory = session_factory
+        self.repository_factory = repository_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.catalogue = catalogue
+        self.idempotency = idempotency
+        self._groups: Dict[Sku, _Group] = {}
+        self._flush_locks: Dict[Sku, _FlushLock] = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, line: OrderLine) -> str:
+        """Allocate order line together with concurrent lines of its SKU.
+
+        Args:
+            line: Order line to allocate.
+
+        Returns:
+            batchref: batch reference to which the order was assigned.
+        """
+        future: Future = Future()
+        with self._lock:
+            group = self._groups.get(line.sku)
+            leader = group is None
+            if group is None:
+                group = self._groups[line.sku] = _Group()
+            group.lines.append(line)
+            group.futures.append(future)
+            if len(group.lines) >= self.max_batch:
+                self._close(line.sku, group)
+
+        if leader:
+            group.full.wait(self.window)
+            with self._lock:
+                self._close(line.sku, group)
+                flush_lock = self._flush_locks.setdefault(
+                    line.sku, _FlushLock()
+                )
+                flush_lock.leaders += 1
+            try:
+                with flush_lock.lock:
+                    self._flush(group)
+            finally:
+                with self._lock:
+                    flush_lock.leaders -= 1
+                    if not flush_lock.leaders:
+                        del self._flush_locks[line.sku]
+
+        return future.result()
+
+    def _close(self, sku: Sku, group: _Group) -> None:
+        """Stop a group from taking requests, called holding the lock."""
+        if self._groups.get(sku) is group:
+            del self._groups[sku]
+        group.full.set()
+
+    def _flush(self, group: _Group) -> None:
+        """Allocate the lines of a group in one transaction.
+
+        Any error, opening the session included, is handed to every caller
+        of the group.
+
+        Args:
+            group: Closed group.
+
+        Returns:
+            None
+        """
+        session = None
+        try:
+            session = self.session_factory()
+            results = services.allocate_many(
+                group.lines,
+                self.repository_factory(session),
+                session,
+                catalogue=self.catalogue,
+                idempotency=self.idempotency,
+            )
+        except Exception as e:
+            if session is not None:
+                session.rollback()
+            for future in group.futures:
+                future.set_exception(e)
+            return
+        finally:
+            if session is not None:
+                session.close()
+
+        for future, result in zip(group.futures, results):
+            if result.ok:
+                future.set_result(result.batchref)
+            else:
+                future.set_exception(result.error)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Event sourced allocation service.
+
+The batches of each SKU live in memory, rebuilt on first use from the
+event store, and every change is a single append to the log. A snapshot of
+the SKU is written every snapshot_every events so that restarting only
+replays a short tail. An event is applied in memory only once appended, so
+a failed append leaves the SKU as it was.
+
+It is a deployment of its own, not a log of the SQL services: services and
+the Flask API write the allocation tables and never append events, so a
+SKU is served either by them or by an EventSourcedAllocator, never both.
+Each SKU must have a single writer, e.g. one worker per shard. A writer
+whose state went stale because another one logged events of its SKU, say
+after a failover left both running, gets a VersionConflict and reloads
+the SKU on the next call.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import date
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from corelib.allocation.adapters.event_store import (
+    SkuState,
+    SQLEventStore,
+)
+from corelib.allocation.domain.events import (
+    Allocated,
+    BatchCreated,
+    Deallocated,
+    Event,
+    apply,
+)
+from corelib.allocation.domain.model import (
+    AllocationIndex,
+    Batch,
+    OrderId,
+    OrderLine,
+    Quantity,
+    Sku,
+)
+from corelib.exceptions import (
+    InvalidSku,
+    UnallocatedOrder,
+    VersionConflict,
+)
+
+
+class EventSourcedAllocator:
+    """Allocation service writing to an append-only event log."""
+
+    def __init__(self, store: SQLEventStore, snapshot_every: int = 1000):
+        """Initialize the service on the provided store.
+
+        Args:
+            store: Event log and snapshots.
+            snapshot_every: Number of events of a SKU between snapshots.
+        """
+        self.store = store
+        self.snapshot_every = snapshot_every
+        self._states: Dict[Sku, SkuState] = {}
+        self._indexes: Dict[Sku, AllocationIndex] = {}
+
+    def _state(self, sku: Sku) -> SkuState:
+        """Return the state of a SKU, rebuilding it from the store once."""
+        state = self._states.get(sku)
+        if state is None:
+            state = self._states[sku] = self.store.load(sku)
+            self._indexes[sku] = AllocationIndex(state.batches.values())
+        return state
+
+    def _record(
+        self, state: SkuState, event: Event, change: Callable[[], object]
+    ) -> None:
+        """Append an event, then apply it and snapshot the SKU if due.
+
+        The append is refused if another writer logged events of the SKU
+        since its state was loaded, then the state is dropped to be
+        rebuilt from the store.
+
+        Args:
+            state: State of the event SKU.
+            event: Domain event.
+            change: Applies the event to the state and the index.
+
+        Returns:
+            None
+        """
+        try:
+            state.seq = self.store.append([event], after=state.seq)
+        except VersionConflict:
+            self._states.pop(event.sku, None)
+            self._indexes.pop(event.sku, None)
+            raise
+        change()
+        state.tail += 1
+        if state.tail >= self.snapshot_every:
+            self.store.save_snapshot(
+                event.sku, state.seq, state.batches.values()
+            )
+            state.tail = 0
+
+    def batches(self, sku: Sku) -> List[Batch]:
+        """Return the batches of a SKU.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            batches: List of the batches with that sku.
+        """
+        return list(self._state(sku).batches.values())
+
+    def available_to_promise(
+        self, sku: Sku
+    ) -> List[Tuple[Optional[date], int]]:
+        """Return the cumulative available stock of a SKU over ETAs.
+
+        Args:
+            sku: Product identifier.
+
+        Returns:
+            timeline: (eta, qty) pairs, warehouse stock first with a None
+                eta, then one pair per shipment date.
+        """
+        self._state(sku)
+        return self._indexes[sku].available_to_promise(sku)
+
+    def earliest_eta(self, sku: Sku, qty: Quantity) -> Optional[date]:
+        """Return when a line of qty could be allocated, without doing it.
+
+        Answered from the index kept up to date by the allocations, in
+        O(log k) for k batches of the SKU.
+
+        Args:
+            sku: Product identifier.
+            qty: Quantity of the line.
+
+        Returns:
+            eta: Estimated time of arrival, None if warehouse stock fits.
+        """
+        state = self._state(sku)
+        if not state.batches:
+            raise InvalidSku(f"Invalid sku {sku}")
+        return self._indexes[sku].earliest_eta(sku, qty)
+
+    def add_batch(self, batch: Batch) -> None:
+        """Add a new batch, ignored if its reference already exists.
+
+        Args:
+            batch: Order batch without allocations.
+
+        Returns:
+            None
+        """
+        state = self._state(batch.sku)
+        if batch.reference in state.batches:
+            return
+
+        event = BatchCreated(
+            batch.sku, batch.reference, batch._purchased_quantity, batch.eta
+        )
+
+        def change() -> None:
+            """Add the created batch to the state and the index."""
+            apply(state.batches, event)
+            self._indexes[batch.sku].add(state.batches[batch.reference])
+
+        self._record(state, event, change)
+
+    def allocate(self, line: OrderLine) -> str:
+        """Allocate an order line and log it.
+
+        Args:
+            line: Order line to allocate.
+
+        Returns:
+            batchref: batch reference to which the order was assigned.
+        """
+        state = self._state(line.sku)
+        if not state.batches:
+            raise InvalidSku(f"Invalid sku {line.sku}")
+
+        index = self._indexes[line.sku]
+        batchref = index.find(line.sku, line.qty).reference
+        self._record(
+            state,
+            Allocated(line.sku, line.orderid, line.qty, batchref),
+            lambda: index.allocate(line),
+        )
+        return batchref
+
+    def deallocate(self, orderid: OrderId, sku: Sku) -> str:
+        """Deallocate the line of an order and log it.
+
+        Args:
+            orderid: Customer order identifier.
+            sku: Product identifier.
+
+        Returns:
+            batchref: reference of the batch the line was deallocated from.
+        """
+        state = self._state(sku)
+        index = self._indexes[sku]
+        batch = index.locate(orderid, sku)
+        line = None if batch is None else batch.get_line(orderid)
+        if batch is None or line is None:
+            raise UnallocatedOrder(
+                f"Order {orderid} is not allocated for sku: {sku}"
+            )
+
+        self._record(
+            state,
+            Deallocated(sku, orderid, line.qty, batch.reference),
+            lambda: index.deallocate(orderid, sku),
+        )
+        return batch.reference
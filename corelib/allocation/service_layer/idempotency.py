@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Idempotency cache module.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import threading
+from collections import OrderedDict
+from typing import (
+    Optional,
+    Tuple,
+)
+
+from corelib.allocation.domain.model import (
+    OrderId,
+    Sku,
+)
+
+AllocationKey = Tuple[OrderId, Sku]
+
+
+class IdempotencyCache:
+    """Batch references of the latest allocations, by orderid and sku.
+
+    A bounded, least recently used, in-process front for the unique
+    (orderid, sku) constraint of the order lines: a retried request found
+    here is answered without loading any batch. Entries must be discarded
+    when the line is deallocated.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        """Initialize an empty cache.
+
+        Args:
+            maxsize: Maximum number of allocations remembered.
+        """
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[AllocationKey, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of allocations remembered."""
+        return len(self._entries)
+
+    def get(self, key: AllocationKey) -> Optional[str]:
+        """Return the batch an order line was allocated to.
+
+        Args:
+            key: Customer order identifier and product identifier.
+
+        Returns:
+            batchref: Batch reference, None if unknown.
+        """
+        with self._lock:
+            batchref = self._entries.get(key)
+            if batchref is not None:
+                self._entries.move_to_end(key)
+            return batchref
+
+    def add(self, key: AllocationKey, batchref: str) -> None:
+        """Remember the batch an order line was allocated to.
+
+        Args:
+            key: Customer order identifier and product identifier.
+            batchref: Batch reference.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries[key] = batchref
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: AllocationKey) -> None:
+        """Forget an order line, once deallocated.
+
+        Args:
+            key: Customer order identifier and product identifier.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
@@ -5,21 +5,48 @@ Created on: 20/6/22
 @author: Heber Trujillo <heber.trj.urt@gmail.com>
 Licence,
 """
+import random
+import time
+from dataclasses import replace
+from enum import Enum
 from typing import (
+    Callable,
+    Dict,
+    Iterable,
     List,
-    Type,
+    Optional,
+    Tuple,
+    TypeVar,
 )
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.session import Session
 
-from corelib.allocation.adapters.repository import AbstractRepository
+from corelib.allocation.adapters.repository import (
+    AbstractRepository,
+    SQLAlchemyRepository,
+)
 from corelib.allocation.domain.model import (
+    AllocationResult,
     Batch,
+    OrderId,
     OrderLine,
     Sku,
 )
 from corelib.allocation.domain.model import allocate as _allocate
-from corelib.exceptions import InvalidSku
+from corelib.allocation.domain.model import allocate_many as _allocate_many
+from corelib.allocation.service_layer.catalogue import SkuCatalogue
+from corelib.allocation.service_layer.idempotency import IdempotencyCache
+from corelib.exceptions import (
+    InvalidSku,
+    OutOfStock,
+    UnallocatedOrder,
+    VersionConflict,
+)
+
+T = TypeVar("T")
+RETRIES = 5
+BACKOFF = 0.005
 
 
 def is_valid_sku(sku: Sku, batches: List[Batch]) -> bool:
@@ -32,28 +59,360 @@ def is_valid_sku(sku: Sku, batches: List[Batch]) -> bool:
     Returns:
         True if sku is in batches list.
     """
-    return sku in {b.sku for b in batches}
+    return any(b.sku == sku for b in batches)
+
+
+class Concurrency(Enum):
+    """Ways to stop concurrent transactions over-allocating a SKU.
+
+    Both check the product version on commit; pessimistic also locks the
+    product row first, so transactions on a hot SKU queue instead of
+    retrying. Transactions on different SKUs never wait for each other.
+    """
+
+    optimistic = "optimistic"
+    pessimistic = "pessimistic"
+
+
+def _retry(
+    attempt: Callable[[], T],
+    session: Session,
+    retries: int,
+    backoff: float,
+) -> T:
+    """Run a transaction again after version conflicts.
+
+    Args:
+        attempt: Transaction, committing on success.
+        session: data base session, rolled back after a conflict.
+        retries: Number of attempts after the first one.
+        backoff: Seconds before the first retry, doubled at each one and
+            jittered so the conflicting transactions spread out.
+
+    Returns:
+        result: Result of the successful attempt.
+    """
+    retry = 0
+    while True:
+        try:
+            return attempt()
+        except VersionConflict:
+            session.rollback()
+            if retry == retries:
+                raise
+            time.sleep(backoff * 2**retry * random.uniform(0.5, 1.5))
+            retry += 1
+
+
+def _remembered(
+    line: OrderLine,
+    repo: AbstractRepository,
+    idempotency: IdempotencyCache,
+) -> Optional[str]:
+    """Return the batch of a remembered allocation still in the database.
+
+    The cache may be stale: the line can have been deallocated or archived
+    by another worker, then it is forgotten.
+
+    Args:
+        line: Order line to allocate.
+        repo: Data repository.
+        idempotency: Recent allocations.
+
+    Returns:
+        batchref: batch reference of the line, None if not allocated.
+    """
+    key = (line.orderid, line.sku)
+    if idempotency.get(key) is None:
+        return None
+    batchref = repo.get_reference_by_order(line.orderid, line.sku)
+    if batchref is None:
+        idempotency.discard(key)
+        return None
+    idempotency.add(key, batchref)
+    return batchref
 
 
 def allocate(
-    line: OrderLine, repo: Type[AbstractRepository], session: Session
+    line: OrderLine,
+    repo: AbstractRepository,
+    session: Session,
+    catalogue: Optional[SkuCatalogue] = None,
+    concurrency: Concurrency = Concurrency.optimistic,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+    idempotency: Optional[IdempotencyCache] = None,
 ) -> str:
     """Allocate order line to available batches for a given repo.
 
+    Allocation is idempotent by orderid and sku: a retried request gets the
+    batch of the original one back, looked up without loading the batches
+    of the sku when the idempotency cache remembers it, or else after the
+    unique constraint of the order lines rejected the duplicate.
+
     Args:
         line: Order line to allocate.
         repo: Data repository.
         session: data base session.
+        catalogue: Known SKUs, rejecting invalid ones before any batch is
+            loaded.
+        concurrency: Guard against concurrent allocations of the sku.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+        idempotency: Recent allocations, answered without loading batches.
 
     Returns:
         batchref: batch reference to which the order was assigned.
     """
-    batches = repo.list()
-    if not is_valid_sku(line.sku, batches):
+    key = (line.orderid, line.sku)
+    if idempotency is not None:
+        batchref = _remembered(line, repo, idempotency)
+        if batchref is not None:
+            return batchref
+
+    if catalogue is not None and not catalogue.contains(line.sku, repo):
         raise InvalidSku(f"Invalid sku {line.sku}")
 
-    batchref = _allocate(line, batches)
+    def attempt() -> str:
+        version = repo.get_version(
+            line.sku, for_update=concurrency is Concurrency.pessimistic
+        )
+        batches = repo.list_for_sku(line.sku)
+        if not is_valid_sku(line.sku, batches) and not repo.has_sku(line.sku):
+            raise InvalidSku(f"Invalid sku {line.sku}")
+
+        # A line rolled back by a previous attempt stays attached to its
+        # former batch, each attempt allocates its own copy.
+        batchref = _allocate(replace(line), batches)
+        repo.bump_version(line.sku, version)
+
+        session.commit()
+
+        return batchref
+
+    try:
+        batchref = _retry(attempt, session, retries, backoff)
+    except IntegrityError:
+        session.rollback()
+        batchref = repo.get_reference_by_order(line.orderid, line.sku)
+        if batchref is None:
+            raise
+
+    if idempotency is not None:
+        idempotency.add(key, batchref)
+
+    return batchref
+
+
+def allocate_in_database(
+    line: OrderLine,
+    repo: SQLAlchemyRepository,
+    session: Session,
+    concurrency: Concurrency = Concurrency.optimistic,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> str:
+    """Allocate order line inside the database, without loading batches.
+
+    Same outcome as allocate, through the set-based fast path of the sql
+    repository, guarded by the same product version check.
+
+    Args:
+        line: Order line to allocate.
+        repo: SQL data repository.
+        session: data base session.
+        concurrency: Guard against concurrent allocations of the sku.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+
+    Returns:
+        batchref: batch reference to which the order was assigned.
+    """
+
+    def attempt() -> str:
+        version = repo.get_version(
+            line.sku, for_update=concurrency is Concurrency.pessimistic
+        )
+        batchref = repo.allocate_in_database(line)
+        if batchref is None:
+            if not repo.has_sku(line.sku):
+                raise InvalidSku(f"Invalid sku {line.sku}")
+            raise OutOfStock(f"Out of stock for sku: {line.sku}")
+        repo.bump_version(line.sku, version)
+
+        session.commit()
+
+        return batchref
+
+    return _retry(attempt, session, retries, backoff)
+
+
+def allocate_many(
+    lines: Iterable[OrderLine],
+    repo: AbstractRepository,
+    session: Session,
+    concurrency: Concurrency = Concurrency.optimistic,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+    catalogue: Optional[SkuCatalogue] = None,
+    idempotency: Optional[IdempotencyCache] = None,
+) -> List[AllocationResult]:
+    """Allocate a burst of order lines with a single load and commit.
+
+    Lines repeating the orderid and sku of a previous line, in the burst or
+    already allocated, get the result of the original one.
+
+    Args:
+        lines: Order lines to allocate.
+        repo: Data repository.
+        session: data base session.
+        concurrency: Guard against concurrent allocations of the skus.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+        catalogue: Known SKUs, rejecting invalid ones before any batch is
+            loaded.
+        idempotency: Recent allocations, answered without loading batches.
+
+    Returns:
+        results: batch reference or error for each line, in the same order.
+    """
+    lines = list(lines)
+    first: Dict[Tuple[OrderId, Sku], OrderLine] = {}
+    for line in lines:
+        first.setdefault((line.orderid, line.sku), line)
+
+    done: Dict[Tuple[OrderId, Sku], AllocationResult] = {}
+    for key, line in first.items():
+        if idempotency is not None:
+            batchref = _remembered(line, repo, idempotency)
+            if batchref is not None:
+                done[key] = AllocationResult(line, batchref)
+                continue
+        if catalogue is not None and not catalogue.contains(line.sku, repo):
+            done[key] = AllocationResult(
+                line, error=InvalidSku(f"Invalid sku {line.sku}")
+            )
+
+    def attempt(pending: List[OrderLine]) -> List[AllocationResult]:
+        versions = {
+            sku: repo.get_version(
+                sku, for_update=concurrency is Concurrency.pessimistic
+            )
+            for sku in sorted({line.sku for line in pending})
+        }
+        batches = [
+            batch for sku in versions for batch in repo.list_for_sku(sku)
+        ]
+        # Skus whose batches are all closed are out of stock, not invalid.
+        skus = {b.sku for b in batches}
+        skus |= {
+            sku for sku in versions if sku not in skus and repo.has_sku(sku)
+        }
+
+        allocated = iter(
+            _allocate_many(
+                [replace(line) for line in pending if line.sku in skus],
+                batches,
+            )
+        )
+        results = [
+            next(allocated)
+            if line.sku in skus
+            else AllocationResult(
+                line, error=InvalidSku(f"Invalid sku {line.sku}")
+            )
+            for line in pending
+        ]
+        for sku in sorted(skus):
+            repo.bump_version(sku, versions[sku])
+
+        session.commit()
+
+        return results
+
+    pending = [line for key, line in first.items() if key not in done]
+    while pending:
+        try:
+            results = _retry(
+                lambda: attempt(pending), session, retries, backoff
+            )
+        except IntegrityError:
+            session.rollback()
+            existing = {
+                (line.orderid, line.sku): repo.get_reference_by_order(
+                    line.orderid, line.sku
+                )
+                for line in pending
+            }
+            found = {k: ref for k, ref in existing.items() if ref is not None}
+            if not found:
+                raise
+            for key, batchref in found.items():
+                done[key] = AllocationResult(first[key], batchref)
+            pending = [
+                line
+                for line in pending
+                if (line.orderid, line.sku) not in found
+            ]
+            continue
+        for result in results:
+            done[(result.line.orderid, result.line.sku)] = result
+        pending = []
+
+    if idempotency is not None:
+        for key, result in done.items():
+            if result.batchref is not None:
+                idempotency.add(key, result.batchref)
+
+    return [
+        replace(done[(line.orderid, line.sku)], line=line) for line in lines
+    ]
+
+
+def deallocate(
+    orderid: OrderId,
+    sku: Sku,
+    repo: AbstractRepository,
+    session: Session,
+    idempotency: Optional[IdempotencyCache] = None,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> str:
+    """Cancel the allocation of an order line, looked up by its orderid.
+
+    Only the line is touched, through the repository, the batch and its
+    other lines are not loaded. The product version is bumped as well, so
+    allocations that read the batches before the cancellation retry on
+    fresh ones.
+
+    Args:
+        orderid: Customer order identifier.
+        sku: Product identifier.
+        repo: Data repository.
+        session: data base session.
+        idempotency: Recent allocations, the cancelled one is forgotten.
+        retries: Number of retries after a version conflict.
+        backoff: Seconds before the first retry.
+
+    Returns:
+        batchref: batch reference from which the line was deallocated.
+    """
+
+    def attempt() -> str:
+        version = repo.get_version(sku)
+        batchref = repo.deallocate(orderid, sku)
+        if batchref is None:
+            raise UnallocatedOrder(
+                f"Order {orderid} is not allocated for sku: {sku}"
+            )
+        repo.bump_version(sku, version)
+
+        session.commit()
+
+        return batchref
 
-    session.commit()
+    batchref = _retry(attempt, session, retries, backoff)
+    if idempotency is not None:
+        idempotency.discard((orderid, sku))
 
     return batchref
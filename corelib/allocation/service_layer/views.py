@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Read-only queries of the allocation read model.
+
+These never load a Batch, they only read the availability table kept up to
+date by the writes.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from typing import (
+    Any,
+    Dict,
+    List,
+)
+
+from sqlalchemy import select
+from sqlalchemy.orm.session import Session
+
+import corelib.allocation.adapters.orm as orm
+from corelib.allocation.domain.model import Sku
+
+
+def availability(sku: Sku, session: Session) -> List[Dict[str, Any]]:
+    """Return what can be promised of a product, batch by batch.
+
+    Warehouse stock comes first, then the shipments by ETA, as allocation
+    consumes them.
+
+    Args:
+        sku: Product identifier.
+        session: data base session.
+
+    Returns:
+        rows: batchref, eta and available_qty of each batch of the sku.
+    """
+    table = orm.availability
+    rows = session.execute(
+        select(table.c.batchref, table.c.eta, table.c.available_qty)
+        .where(table.c.sku == sku)
+        .order_by(table.c.eta.isnot(None), table.c.eta, table.c.batchref)
+    )
+    return [dict(row._mapping) for row in rows]
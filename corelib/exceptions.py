@@ -17,3 +17,15 @@ class InvalidSku(Exception):
     """Exception to express that SKU from an order line is invalid."""
 
     pass
+
+
+class UnallocatedOrder(Exception):
+    """Exception to express that an order line is not allocated to a batch."""
+
+    pass
+
+
+class VersionConflict(Exception):
+    """Exception to express that a SKU was allocated by another transaction."""
+
+    pass
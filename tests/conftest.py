@@ -5,11 +5,13 @@ Created on: 20/6/22
 @author: Heber Trujillo <heber.trj.urt@gmail.com>
 Licence,
 """
+import asyncio
 import time
 from datetime import date
 from pathlib import Path
 from typing import (
     Callable,
+    List,
     Tuple,
 )
 
@@ -20,6 +22,10 @@ from requests.exceptions import ConnectionError
 from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    create_async_engine,
+)
 from sqlalchemy.orm import (
     clear_mappers,
     sessionmaker,
@@ -89,6 +95,50 @@ def session(in_memory_db: Engine) -> Session:
     clear_mappers()
 
 
+@pytest.fixture
+def fresh_session() -> Session:
+    """Create a session bound to its own in memory database."""
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    start_mappers()
+    yield sessionmaker(bind=engine)()
+    clear_mappers()
+
+
+@pytest.fixture
+def async_session_factory(tmp_path: Path) -> sessionmaker:
+    """Create an aiosqlite database and return an async session factory."""
+    pytest.importorskip("aiosqlite")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/async.db")
+
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+
+    asyncio.run(create_all())
+    start_mappers()
+    yield sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    clear_mappers()
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def shard_engines(tmp_path: Path) -> List[Engine]:
+    """Create three sqlite file databases, one per shard."""
+    engines = []
+    for index in range(3):
+        engine = config.make_engine(f"sqlite:///{tmp_path}/shard-{index}.db")
+        metadata.create_all(engine)
+        engines.append(engine)
+    start_mappers()
+    yield engines
+    clear_mappers()
+    for engine in engines:
+        engine.dispose()
+
+
 @pytest.fixture
 def files() -> Tuple[Path, Path, Path]:
     """Create a temporary file and return its path."""
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""This module test closing and archiving exhausted batches.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy import (
+    func,
+    select,
+)
+from sqlalchemy.orm.session import Session
+
+import corelib.allocation.adapters.orm as orm
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import (
+    services,
+    views,
+)
+from corelib.exceptions import UnallocatedOrder
+
+
+def count(session: Session, table) -> int:
+    """Return the number of rows of a table."""
+    return session.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_closed_batches_leave_the_hot_queries(fresh_session: Session):
+    """Test exhausted or closed batches are not listed nor allocated."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("exhausted", "ARCHIVE-LAMP", 5, eta=None))
+    repo.add(Batch("cancelled", "ARCHIVE-LAMP", 50, eta=None))
+    repo.add(Batch("shipment", "ARCHIVE-LAMP", 20, eta=date(2022, 7, 1)))
+    fresh_session.commit()
+    services.allocate(OrderLine("o1", "ARCHIVE-LAMP", 5), repo, fresh_session)
+    repo.get("cancelled").close()
+    fresh_session.commit()
+
+    version = repo.get_version("ARCHIVE-LAMP")
+    assert repo.close_exhausted() == 1
+    fresh_session.commit()
+    assert repo.get_version("ARCHIVE-LAMP") == version + 1
+
+    assert {b.reference for b in repo.list_for_sku("ARCHIVE-LAMP")} == {
+        "shipment"
+    }
+    assert [b.reference for b in repo.list()] == ["shipment"]
+    assert [
+        row["batchref"]
+        for row in views.availability("ARCHIVE-LAMP", fresh_session)
+    ] == ["shipment"]
+    assert repo.allocate_in_database(OrderLine("o2", "ARCHIVE-LAMP", 1)) == (
+        "shipment"
+    )
+    assert repo.get_by_order("o1", "ARCHIVE-LAMP").reference == "exhausted"
+
+
+def test_archive_moves_consumed_batches_and_their_allocations(
+    fresh_session: Session,
+):
+    """Test archived batches keep their lines in the archive tables."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("old", "ARCHIVE-LAMP", 5, eta=date(2022, 1, 1)))
+    repo.add(Batch("recent", "ARCHIVE-LAMP", 5, eta=date(2022, 9, 1)))
+    repo.add(Batch("open", "ARCHIVE-LAMP", 20, eta=None))
+    fresh_session.commit()
+    for orderid, batchref in (("o1", "old"), ("o2", "recent")):
+        repo.get(batchref).allocate(OrderLine(orderid, "ARCHIVE-LAMP", 5))
+    repo.get("open").allocate(OrderLine("o3", "ARCHIVE-LAMP", 2))
+    fresh_session.commit()
+
+    version = repo.get_version("ARCHIVE-LAMP")
+    assert repo.archive(before=date(2022, 6, 1)) == 1
+    fresh_session.commit()
+    assert repo.get_version("ARCHIVE-LAMP") == version + 1
+    fresh_session.expunge_all()
+
+    assert count(fresh_session, orm.batches) == 2
+    assert count(fresh_session, orm.order_lines) == 2
+    assert count(fresh_session, orm.allocations) == 2
+    archived = fresh_session.execute(
+        select(
+            orm.archived_batches.c.reference,
+            orm.archived_order_lines.c.orderid,
+        )
+        .join(
+            orm.archived_allocations,
+            orm.archived_allocations.c.batch_id == orm.archived_batches.c.id,
+        )
+        .join(
+            orm.archived_order_lines,
+            orm.archived_allocations.c.orderline_id
+            == orm.archived_order_lines.c.id,
+        )
+    ).all()
+    assert [tuple(row) for row in archived] == [("old", "o1")]
+    assert [
+        row["batchref"]
+        for row in views.availability("ARCHIVE-LAMP", fresh_session)
+    ] == ["open", "recent"]
+    with pytest.raises(UnallocatedOrder):
+        services.deallocate("o1", "ARCHIVE-LAMP", repo, fresh_session)
+
+    assert repo.archive() == 1
+    assert repo.get("open").available_quantity == 18
+
+
+def test_archive_twice_after_the_hot_ids_are_freed(fresh_session: Session):
+    """Test ids of archived rows are not reused by the next batches."""
+    repo = SQLAlchemyRepository(fresh_session)
+    for batchref in ("first", "second"):
+        repo.add(Batch(batchref, "ARCHIVE-SOFA", 1, eta=None))
+        fresh_session.commit()
+        services.allocate(
+            OrderLine(f"o-{batchref}", "ARCHIVE-SOFA", 1), repo, fresh_session
+        )
+        assert repo.archive() == 1
+        fresh_session.commit()
+
+    assert count(fresh_session, orm.batches) == 0
+    archived = fresh_session.execute(
+        select(orm.archived_batches.c.id, orm.archived_batches.c.reference)
+    ).all()
+    assert sorted(reference for _, reference in archived) == [
+        "first",
+        "second",
+    ]
+    assert len({batch_id for batch_id, _ in archived}) == 2
+
+
+def test_deallocations_reopen_closed_batches(fresh_session: Session):
+    """Test stock freed in a closed batch can be allocated again."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("exhausted", "ARCHIVE-LAMP", 5, eta=None))
+    repo.add(Batch("cancelled", "ARCHIVE-LAMP", 5, eta=None))
+    fresh_session.commit()
+    services.allocate(OrderLine("o1", "ARCHIVE-LAMP", 5), repo, fresh_session)
+    services.allocate(OrderLine("o2", "ARCHIVE-LAMP", 5), repo, fresh_session)
+    assert repo.close_exhausted() == 2
+    fresh_session.commit()
+
+    services.deallocate("o1", "ARCHIVE-LAMP", repo, fresh_session)
+    batch = repo.get("cancelled")
+    batch.deallocate(batch.get_line("o2"))
+    fresh_session.commit()
+
+    assert not batch.closed
+    assert {b.reference for b in repo.list_for_sku("ARCHIVE-LAMP")} == {
+        "exhausted",
+        "cancelled",
+    }
+    assert {
+        row["batchref"]: row["available_qty"]
+        for row in views.availability("ARCHIVE-LAMP", fresh_session)
+    } == {"exhausted": 5, "cancelled": 5}
+    assert (
+        services.allocate(
+            OrderLine("o3", "ARCHIVE-LAMP", 5), repo, fresh_session
+        )
+        == "exhausted"
+    )
+    assert repo.archive() == 1
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""This module test the async repository and service layer on aiosqlite.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from corelib.allocation.adapters.async_repository import (
+    AsyncSQLAlchemyRepository,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import async_services
+from corelib.exceptions import (
+    InvalidSku,
+    OutOfStock,
+)
+
+
+async def add_batches(session_factory: sessionmaker, *batches: Batch):
+    """Persist batches in their own session."""
+    async with session_factory() as session:
+        repo = AsyncSQLAlchemyRepository(session)
+        for batch in batches:
+            repo.add(batch)
+        await session.commit()
+
+
+def test_async_allocate_and_deallocate(async_session_factory: sessionmaker):
+    """Test the async services allocate, persist and deallocate a line."""
+
+    async def scenario():
+        await add_batches(
+            async_session_factory,
+            Batch("async-1", "ASYNC-LAMP", 10, eta=None),
+            Batch("async-2", "OTHER-LAMP", 10, eta=None),
+        )
+        async with async_session_factory() as session:
+            repo = AsyncSQLAlchemyRepository(session)
+            batchref = await async_services.allocate(
+                OrderLine("o1", "ASYNC-LAMP", 4), repo, session
+            )
+            with pytest.raises(InvalidSku):
+                await async_services.allocate(
+                    OrderLine("o2", "MISSING-LAMP", 4), repo, session
+                )
+
+        async with async_session_factory() as session:
+            repo = AsyncSQLAlchemyRepository(session)
+            allocated = (await repo.get("async-1")).available_quantity
+            located = await repo.get_by_order("o1", "ASYNC-LAMP")
+            released = await async_services.deallocate(
+                "o1", "ASYNC-LAMP", repo, session
+            )
+
+        async with async_session_factory() as session:
+            repo = AsyncSQLAlchemyRepository(session)
+            available = (await repo.get("async-1")).available_quantity
+            version = await repo.get_version("ASYNC-LAMP")
+
+        return (
+            batchref,
+            allocated,
+            located.reference,
+            released,
+            available,
+            version,
+        )
+
+    assert asyncio.run(scenario()) == (
+        "async-1",
+        6,
+        "async-1",
+        "async-1",
+        10,
+        2,
+    )
+
+
+def test_async_allocations_in_flight(async_session_factory: sessionmaker):
+    """Test concurrent allocations on separate sessions all succeed."""
+
+    async def allocate(i: int) -> str:
+        async with async_session_factory() as session:
+            return await async_services.allocate(
+                OrderLine(f"o{i}", f"SKU-{i}", 1),
+                AsyncSQLAlchemyRepository(session),
+                session,
+            )
+
+    async def scenario():
+        await add_batches(
+            async_session_factory,
+            *(Batch(f"b{i}", f"SKU-{i}", 1, eta=None) for i in range(10)),
+        )
+        return await asyncio.gather(*(allocate(i) for i in range(10)))
+
+    assert asyncio.run(scenario()) == [f"b{i}" for i in range(10)]
+
+
+def test_async_closed_batches_are_out_of_stock(
+    async_session_factory: sessionmaker,
+):
+    """Test closed batches are not listed, and their sku stays valid."""
+    closed = Batch("async-closed", "CLOSED-LAMP", 10, eta=None)
+    closed.close()
+
+    async def scenario():
+        await add_batches(async_session_factory, closed)
+        async with async_session_factory() as session:
+            repo = AsyncSQLAlchemyRepository(session)
+            listed = await repo.list_for_sku("CLOSED-LAMP")
+            with pytest.raises(OutOfStock):
+                await async_services.allocate(
+                    OrderLine("o1", "CLOSED-LAMP", 1), repo, session
+                )
+            results = await async_services.allocate_many(
+                [OrderLine("o2", "CLOSED-LAMP", 1)], repo, session
+            )
+        return listed, type(results[0].error)
+
+    assert asyncio.run(scenario()) == ([], OutOfStock)
+
+
+def test_async_retried_allocations_get_the_original_batch(
+    async_session_factory: sessionmaker,
+):
+    """Test a retried line gets its batch back, not a second allocation."""
+
+    async def allocate(*lines: OrderLine):
+        async with async_session_factory() as session:
+            repo = AsyncSQLAlchemyRepository(session)
+            if len(lines) == 1:
+                return await async_services.allocate(lines[0], repo, session)
+            results = await async_services.allocate_many(lines, repo, session)
+            return [result.batchref for result in results]
+
+    async def scenario():
+        await add_batches(
+            async_session_factory,
+            Batch("retry-1", "RETRY-LAMP", 10, eta=None),
+            Batch("retry-2", "RETRY-LAMP", 10, eta=date(2022, 7, 1)),
+        )
+        original = await allocate(OrderLine("o1", "RETRY-LAMP", 10))
+        retried = await allocate(OrderLine("o1", "RETRY-LAMP", 10))
+        burst = await allocate(
+            OrderLine("o1", "RETRY-LAMP", 10),
+            OrderLine("o2", "RETRY-LAMP", 2),
+            OrderLine("o2", "RETRY-LAMP", 2),
+        )
+        return original, retried, burst
+
+    assert asyncio.run(scenario()) == (
+        "retry-1",
+        "retry-1",
+        ["retry-1", "retry-2", "retry-2"],
+    )
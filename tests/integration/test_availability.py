@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""This module test the availability read model follows every write.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import date
+
+from sqlalchemy.orm.session import Session
+
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import (
+    services,
+    views,
+)
+
+
+def available(session: Session, sku: str) -> dict:
+    """Return the available quantity by batch reference."""
+    return {
+        row["batchref"]: row["available_qty"]
+        for row in views.availability(sku, session)
+    }
+
+
+def test_availability_follows_allocations(fresh_session: Session):
+    """Test allocating and deallocating update the read model."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("shipment", "READ-LAMP", 20, eta=date(2022, 7, 1)))
+    repo.add(Batch("warehouse", "READ-LAMP", 10, eta=None))
+    repo.add(Batch("other", "OTHER-LAMP", 5, eta=None))
+    fresh_session.commit()
+
+    services.allocate(OrderLine("o1", "READ-LAMP", 4), repo, fresh_session)
+    services.allocate(OrderLine("o2", "READ-LAMP", 8), repo, fresh_session)
+
+    assert views.availability("READ-LAMP", fresh_session) == [
+        dict(batchref="warehouse", eta=None, available_qty=6),
+        dict(batchref="shipment", eta=date(2022, 7, 1), available_qty=12),
+    ]
+
+    services.deallocate("o2", "READ-LAMP", repo, fresh_session)
+    assert available(fresh_session, "READ-LAMP") == {
+        "warehouse": 6,
+        "shipment": 20,
+    }
+    assert available(fresh_session, "OTHER-LAMP") == {"other": 5}
+
+
+def test_availability_rolls_back_with_the_allocation(fresh_session: Session):
+    """Test the read model is written in the allocation transaction."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "READ-LAMP", 10, eta=None))
+    fresh_session.commit()
+
+    [batch] = repo.list_for_sku("READ-LAMP")
+    batch.allocate(OrderLine("o1", "READ-LAMP", 3))
+    fresh_session.flush()
+    assert available(fresh_session, "READ-LAMP") == {"b1": 7}
+
+    fresh_session.rollback()
+    assert available(fresh_session, "READ-LAMP") == {"b1": 10}
+
+
+def test_availability_follows_bulk_writes(fresh_session: Session):
+    """Test the writes bypassing the unit of work refresh the read model."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add_many([Batch("b1", "READ-LAMP", 10, eta=None)])
+    repo.allocate_in_database(OrderLine("o1", "READ-LAMP", 4))
+    assert available(fresh_session, "READ-LAMP") == {"b1": 6}
+
+    repo.add_many(
+        [
+            Batch("b1", "READ-LAMP", 15, eta=None),
+            Batch("b2", "READ-LAMP", 5, eta=None),
+        ]
+    )
+    fresh_session.commit()
+
+    assert available(fresh_session, "READ-LAMP") == {"b1": 11, "b2": 5}
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""This module test the batch cache shared by the request sessions.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import (
+    clear_mappers,
+    sessionmaker,
+)
+
+import corelib.allocation.config as config
+from corelib.allocation.adapters.orm import (
+    metadata,
+    start_mappers,
+)
+from corelib.allocation.adapters.repository import (
+    BatchCache,
+    CachingRepository,
+    ShardedRepository,
+    ShardedSession,
+    SQLAlchemyRepository,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+from corelib.exceptions import (
+    OutOfStock,
+    VersionConflict,
+)
+
+
+@pytest.fixture
+def get_session(tmp_path: Path) -> sessionmaker:
+    """Create a sqlite file database shared by several sessions."""
+    engine = config.make_engine(f"sqlite:///{tmp_path}/cache.db")
+    metadata.create_all(engine)
+    start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+    engine.dispose()
+
+
+def batch_selects(engine: Engine) -> List[str]:
+    """Record the statements reading the batches table."""
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, *args):
+        if "FROM batches" in statement:
+            statements.append(statement)
+
+    return statements
+
+
+def allocate(
+    get_session: sessionmaker, cache: BatchCache, orderid: str, qty: int
+) -> str:
+    """Allocate one line of CACHED-LAMP in a request session."""
+    session = get_session()
+    try:
+        repo = CachingRepository(SQLAlchemyRepository(session), cache)
+        return services.allocate(
+            OrderLine(orderid, "CACHED-LAMP", qty), repo, session
+        )
+    finally:
+        session.close()
+
+
+def available(get_session: sessionmaker, batchref: str) -> int:
+    """Read the available quantity of a batch in its own session."""
+    session = get_session()
+    try:
+        return SQLAlchemyRepository(session).get(batchref).available_quantity
+    finally:
+        session.close()
+
+
+def test_cached_batches_serve_the_next_requests(get_session: sessionmaker):
+    """Test a hit allocates without loading the batches again."""
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch("cached", "CACHED-LAMP", 10, eta=None)
+    )
+    session.commit()
+    session.close()
+    cache = BatchCache()
+
+    assert allocate(get_session, cache, "o1", 2) == "cached"
+    selects = batch_selects(session.get_bind())
+    assert allocate(get_session, cache, "o2", 3) == "cached"
+    assert allocate(get_session, cache, "o3", 1) == "cached"
+
+    assert selects == []
+    assert cache.stats.misses == 1
+    assert cache.stats.hits == 2
+    assert available(get_session, "cached") == 4
+
+
+def test_allocations_of_other_workers_bypass_the_cache(
+    get_session: sessionmaker,
+):
+    """Test a version bumped elsewhere makes the cached entry a miss."""
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch("cached", "CACHED-LAMP", 10, eta=None)
+    )
+    session.commit()
+    session.close()
+    cache = BatchCache()
+    allocate(get_session, cache, "o1", 2)
+
+    session = get_session()
+    services.allocate(
+        OrderLine("o2", "CACHED-LAMP", 7),
+        SQLAlchemyRepository(session),
+        session,
+    )
+    session.close()
+
+    with pytest.raises(OutOfStock):
+        allocate(get_session, cache, "o3", 2)
+    assert cache.stats.hits == 0
+    assert available(get_session, "cached") == 1
+
+
+def test_cached_batches_allocated_meanwhile_raise_a_conflict(
+    get_session: sessionmaker,
+):
+    """Test the version check catches a hit made stale by another commit."""
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch("cached", "CACHED-LAMP", 10, eta=None)
+    )
+    session.commit()
+    session.close()
+    cache = BatchCache()
+    allocate(get_session, cache, "o1", 2)
+
+    session = get_session()
+    repo = CachingRepository(SQLAlchemyRepository(session), cache)
+    version = repo.get_version("CACHED-LAMP")
+    [batch] = repo.list_for_sku("CACHED-LAMP")
+    allocate(get_session, cache, "o2", 8)
+    batch.allocate(OrderLine("o3", "CACHED-LAMP", 8))
+    with pytest.raises(VersionConflict):
+        repo.bump_version("CACHED-LAMP", version)
+    session.rollback()
+    session.close()
+
+    with pytest.raises(OutOfStock):
+        allocate(get_session, cache, "o3", 8)
+    assert available(get_session, "cached") == 0
+
+
+def test_rolled_back_allocations_are_not_cached(get_session: sessionmaker):
+    """Test only committed batches are published to the cache."""
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch("cached", "CACHED-LAMP", 10, eta=None)
+    )
+    session.commit()
+    cache = BatchCache()
+    repo = CachingRepository(SQLAlchemyRepository(session), cache)
+    version = repo.get_version("CACHED-LAMP")
+    [batch] = repo.list_for_sku("CACHED-LAMP")
+    batch.allocate(OrderLine("o1", "CACHED-LAMP", 10))
+    repo.bump_version("CACHED-LAMP", version)
+    session.flush()
+    session.rollback()
+    session.close()
+
+    assert allocate(get_session, cache, "o2", 10) == "cached"
+    assert cache.stats.hits == 1
+
+
+def test_cached_allocations_never_over_allocate(get_session: sessionmaker):
+    """Test many threads sharing the cache never exceed the stock."""
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch("cached", "CACHED-LAMP", 30, eta=None)
+    )
+    session.commit()
+    session.close()
+    cache = BatchCache()
+
+    def request(n: int) -> str:
+        try:
+            return allocate(get_session, cache, f"order-{n}", 1)
+        except (OutOfStock, VersionConflict) as e:
+            return type(e).__name__
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(request, range(60)))
+
+    assert results.count("cached") == 30
+    assert available(get_session, "cached") == 0
+    assert cache.stats.hits > 0
+
+
+def test_sharded_sessions_publish_their_batches(shard_engines: List[Engine]):
+    """Test the cache follows the session of the shard of each SKU."""
+    cache = BatchCache()
+
+    def request(orderid: str) -> str:
+        session = ShardedSession(
+            [sessionmaker(bind=e)() for e in shard_engines]
+        )
+        try:
+            return services.allocate(
+                OrderLine(orderid, "SHARD-LAMP", 1),
+                CachingRepository(ShardedRepository(session), cache),
+                session,
+            )
+        finally:
+            session.close()
+
+    session = ShardedSession([sessionmaker(bind=e)() for e in shard_engines])
+    ShardedRepository(session).add(
+        Batch("sharded", "SHARD-LAMP", 10, eta=None)
+    )
+    session.commit()
+    session.close()
+
+    assert [request(f"o{i}") for i in range(3)] == ["sharded"] * 3
+    assert cache.stats.misses == 1
+    assert cache.stats.hits == 2
+
+
+def test_batches_lowered_by_another_session_are_not_served(
+    get_session: sessionmaker,
+):
+    """Test an ingest cutting a cached batch makes the next request miss."""
+    session = get_session()
+    SQLAlchemyRepository(session).add(
+        Batch("cached", "CACHED-LAMP", 100, eta=None)
+    )
+    session.commit()
+    session.close()
+    cache = BatchCache()
+    allocate(get_session, cache, "o1", 1)
+
+    session = get_session()
+    SQLAlchemyRepository(session).add_many(
+        [Batch("cached", "CACHED-LAMP", 10, eta=None)]
+    )
+    session.commit()
+    session.close()
+
+    with pytest.raises(OutOfStock):
+        allocate(get_session, cache, "o2", 50)
+    assert allocate(get_session, cache, "o3", 9) == "cached"
+    assert cache.stats.misses == 2
+    assert available(get_session, "cached") == 0
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""This module stress test concurrent allocations of the same SKU.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from sqlalchemy.orm import (
+    clear_mappers,
+    sessionmaker,
+)
+
+import corelib.allocation.config as config
+from corelib.allocation.adapters.orm import (
+    metadata,
+    start_mappers,
+)
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+from corelib.exceptions import (
+    OutOfStock,
+    VersionConflict,
+)
+
+
+@pytest.fixture
+def get_session(tmp_path: Path) -> sessionmaker:
+    """Create a sqlite file database shared by several threads."""
+    engine = config.make_engine(f"sqlite:///{tmp_path}/stress.db")
+    metadata.create_all(engine)
+    start_mappers()
+    yield sessionmaker(bind=engine)
+    clear_mappers()
+    engine.dispose()
+
+
+@pytest.mark.parametrize("concurrency", list(services.Concurrency))
+def test_concurrent_allocations_never_over_allocate(
+    get_session: sessionmaker, concurrency: services.Concurrency
+):
+    """Test many threads allocating one SKU never exceed its stock."""
+    session = get_session()
+    repo = SQLAlchemyRepository(session)
+    repo.add(Batch("stock", "STRESS-LAMP", 30, eta=None))
+    repo.add(Batch("other", "CALM-LAMP", 30, eta=None))
+    session.commit()
+    session.close()
+
+    def allocate(n: int) -> str:
+        session = get_session()
+        try:
+            return services.allocate(
+                OrderLine(f"order-{n}", "STRESS-LAMP", 1),
+                SQLAlchemyRepository(session),
+                session,
+                concurrency=concurrency,
+                retries=20,
+                backoff=0.001,
+            )
+        except (OutOfStock, VersionConflict) as e:
+            return type(e).__name__
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(allocate, range(60)))
+
+    session = get_session()
+    [[allocated]] = session.execute(
+        "SELECT COUNT(*) FROM allocations JOIN batches"
+        " ON batches.id = allocations.batch_id"
+        " WHERE batches.reference = 'stock'"
+    )
+    assert allocated == results.count("stock") <= 30
+    assert results.count("stock") + results.count("OutOfStock") > 30
+    [[version]] = session.execute(
+        "SELECT version_number FROM products WHERE sku = 'STRESS-LAMP'"
+    )
+    # The batch added to the product bumped it once.
+    assert version == allocated + 1
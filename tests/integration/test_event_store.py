@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""This module test the event store and the event sourced allocator.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import date
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from corelib.allocation.adapters.event_store import SQLEventStore
+from corelib.allocation.domain.events import (
+    Allocated,
+    BatchCreated,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer.event_sourced import (
+    EventSourcedAllocator,
+)
+from corelib.exceptions import (
+    InvalidSku,
+    OutOfStock,
+    UnallocatedOrder,
+    VersionConflict,
+)
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> SQLEventStore:
+    """Create an event store on a local SQLite file."""
+    return SQLEventStore(create_engine(f"sqlite:///{tmp_path}/events.db"))
+
+
+def test_store_reads_the_events_of_a_sku_in_order(store: SQLEventStore):
+    """Test events round trip and are filtered by sku and sequence."""
+    created = BatchCreated("RED-CHAIR", "b1", 10, date(2022, 7, 1))
+    allocated = Allocated("RED-CHAIR", "o1", 4, "b1")
+    store.append([created, BatchCreated("BLUE-VASE", "b2", 5)])
+    seq = store.append([allocated])
+
+    assert [e for _, e in store.read("RED-CHAIR")] == [created, allocated]
+    assert [e for _, e in store.read("RED-CHAIR", after=seq - 1)] == [
+        allocated
+    ]
+
+
+def test_allocator_rebuilds_from_snapshot_and_tail(store: SQLEventStore):
+    """Test a restarted allocator finds the state of the previous one."""
+    allocator = EventSourcedAllocator(store, snapshot_every=3)
+    allocator.add_batch(Batch("b1", "RED-CHAIR", 10, eta=None))
+    allocator.add_batch(Batch("b2", "RED-CHAIR", 10, eta=date(2022, 7, 1)))
+    for orderid in ("o1", "o2", "o3"):
+        allocator.allocate(OrderLine(orderid, "RED-CHAIR", 4))
+    assert allocator.deallocate("o1", "RED-CHAIR") == "b1"
+
+    seq, snapshot = store.load_snapshot("RED-CHAIR")
+    assert seq == 6
+    assert snapshot["b1"].available_quantity == 6
+    allocator.allocate(OrderLine("o4", "RED-CHAIR", 5))
+
+    restarted = EventSourcedAllocator(store, snapshot_every=3)
+    assert store.load("RED-CHAIR").tail == 1
+    assert {
+        b.reference: b.available_quantity
+        for b in restarted.batches("RED-CHAIR")
+    } == {"b1": 1, "b2": 6}
+    assert restarted.available_to_promise("RED-CHAIR") == [
+        (None, 1),
+        (date(2022, 7, 1), 7),
+    ]
+    assert restarted.earliest_eta("RED-CHAIR", 6) == date(2022, 7, 1)
+    assert restarted.allocate(OrderLine("o5", "RED-CHAIR", 6)) == "b2"
+    assert restarted.available_to_promise("RED-CHAIR")[-1][1] == 1
+
+
+def test_allocator_errors(store: SQLEventStore):
+    """Test invalid skus, missing stock and unknown orders are reported."""
+    allocator = EventSourcedAllocator(store)
+    allocator.add_batch(Batch("b1", "RED-CHAIR", 1, eta=None))
+    allocator.add_batch(Batch("b1", "RED-CHAIR", 5, eta=None))
+
+    with pytest.raises(InvalidSku):
+        allocator.allocate(OrderLine("o1", "MISSING", 1))
+    with pytest.raises(InvalidSku):
+        allocator.earliest_eta("MISSING", 1)
+    with pytest.raises(OutOfStock):
+        allocator.allocate(OrderLine("o1", "RED-CHAIR", 2))
+    with pytest.raises(UnallocatedOrder):
+        allocator.deallocate("o1", "RED-CHAIR")
+    assert [e.qty for _, e in store.read("RED-CHAIR")] == [1]
+
+
+def test_failed_appends_leave_the_allocator_unchanged(store: SQLEventStore):
+    """Test events are applied in memory only once they are logged."""
+    allocator = EventSourcedAllocator(store)
+    allocator.add_batch(Batch("b1", "RED-CHAIR", 10, eta=None))
+    allocator.allocate(OrderLine("o1", "RED-CHAIR", 4))
+
+    def append(new_events, after=None):
+        raise ConnectionError("event log unavailable")
+
+    store.append = append
+    with pytest.raises(ConnectionError):
+        allocator.add_batch(Batch("b2", "RED-CHAIR", 10, eta=None))
+    with pytest.raises(ConnectionError):
+        allocator.allocate(OrderLine("o2", "RED-CHAIR", 4))
+    with pytest.raises(ConnectionError):
+        allocator.deallocate("o1", "RED-CHAIR")
+
+    [batch] = allocator.batches("RED-CHAIR")
+    assert batch.reference == "b1"
+    assert batch.available_quantity == 6
+    assert allocator.available_to_promise("RED-CHAIR") == [(None, 6)]
+
+    del store.append
+    assert allocator.deallocate("o1", "RED-CHAIR") == "b1"
+    assert EventSourcedAllocator(store).batches("RED-CHAIR")[0] == batch
+    assert batch.available_quantity == 10
+
+
+def test_stale_writers_reload_before_allocating(store: SQLEventStore):
+    """Test a second writer of a sku cannot allocate from a stale state."""
+    first = EventSourcedAllocator(store)
+    first.add_batch(Batch("b1", "RED-CHAIR", 10, eta=None))
+    second = EventSourcedAllocator(store)
+    assert second.batches("RED-CHAIR")[0].available_quantity == 10
+    assert first.allocate(OrderLine("o1", "RED-CHAIR", 8)) == "b1"
+
+    with pytest.raises(VersionConflict):
+        second.allocate(OrderLine("o2", "RED-CHAIR", 8))
+    with pytest.raises(OutOfStock):
+        second.allocate(OrderLine("o2", "RED-CHAIR", 8))
+    assert second.allocate(OrderLine("o2", "RED-CHAIR", 2)) == "b1"
+
+    with pytest.raises(VersionConflict):
+        first.deallocate("o1", "RED-CHAIR")
+    assert first.deallocate("o1", "RED-CHAIR") == "b1"
+    assert EventSourcedAllocator(store).available_to_promise("RED-CHAIR") == [
+        (None, 8)
+    ]
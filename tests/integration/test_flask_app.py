@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""This module test the API endpoints with the Flask test client.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy.orm import clear_mappers
+
+import corelib.allocation.config as config
+from corelib.allocation.adapters.orm import metadata
+
+MODULE = "corelib.allocation.entrypoints.flask_app"
+
+
+@pytest.fixture
+def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FlaskClient:
+    """Import the API on a sqlite file database and return a test client."""
+    uri = f"sqlite:///{tmp_path}/api.db"
+    monkeypatch.setattr(config, "get_postgres_uri", lambda: uri)
+    monkeypatch.delenv("ALLOCATE_WINDOW_MS", raising=False)
+    sys.modules.pop(MODULE, None)
+    flask_app = importlib.import_module(MODULE)
+    metadata.create_all(flask_app.engine)
+    yield flask_app.app.test_client()
+    clear_mappers()
+    flask_app.engine.dispose()
+    sys.modules.pop(MODULE, None)
+
+
+def add_batch(client: FlaskClient, ref: str, sku: str, qty: int, eta=None):
+    """Store a batch through the session of the API."""
+    flask_app = sys.modules[MODULE]
+    session = flask_app.get_session()
+    flask_app.repository.SQLAlchemyRepository(session).add(
+        flask_app.model.Batch(ref, sku, qty, eta)
+    )
+    session.commit()
+    session.close()
+
+
+def test_availability_reports_the_stock_of_each_batch(client: FlaskClient):
+    """Test the availability endpoint after an allocation."""
+    add_batch(client, "api-batch", "API-LAMP", 10)
+    response = client.post(
+        "/allocate", json=dict(orderid="o1", sku="API-LAMP", qty=4)
+    )
+    assert response.status_code == 201
+
+    response = client.get("/availability/API-LAMP")
+
+    assert response.status_code == 200
+    assert response.json == {
+        "sku": "API-LAMP",
+        "available_qty": 6,
+        "batches": [
+            {"batchref": "api-batch", "eta": None, "available_qty": 6}
+        ],
+    }
+
+
+def test_availability_of_a_sku_with_only_closed_batches(client: FlaskClient):
+    """Test a known sku with nothing left reports 0, an unknown one 404."""
+    add_batch(client, "api-batch", "API-CHAIR", 4)
+    client.post("/allocate", json=dict(orderid="o1", sku="API-CHAIR", qty=4))
+    flask_app = sys.modules[MODULE]
+    session = flask_app.get_session()
+    assert flask_app.repository.SQLAlchemyRepository(session).close_exhausted()
+    session.commit()
+    session.close()
+
+    response = client.get("/availability/API-CHAIR")
+    assert response.status_code == 200
+    assert response.json == {
+        "sku": "API-CHAIR",
+        "available_qty": 0,
+        "batches": [],
+    }
+    assert client.get("/availability/MISSING-CHAIR").status_code == 404
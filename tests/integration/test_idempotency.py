@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""This module test retried allocations are idempotent by orderid and sku.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+from corelib.allocation.service_layer.idempotency import IdempotencyCache
+from corelib.exceptions import InvalidSku
+
+
+def count_lines(session: Session, orderid: str) -> int:
+    """Count the order lines stored for an order."""
+    [[count]] = session.execute(
+        "SELECT COUNT(*) FROM order_lines WHERE orderid=:orderid",
+        dict(orderid=orderid),
+    )
+    return count
+
+
+def test_retried_allocation_returns_the_original_batch(
+    fresh_session: Session,
+):
+    """Test a retry finds the first allocation through the constraint."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("in-stock", "RETRY-LAMP", 5, eta=None))
+    repo.add(Batch("later", "RETRY-LAMP", 100, eta=None))
+    fresh_session.commit()
+
+    line = OrderLine("o1", "RETRY-LAMP", 5)
+    assert services.allocate(line, repo, fresh_session) == "in-stock"
+    assert services.allocate(line, repo, fresh_session) == "in-stock"
+
+    assert count_lines(fresh_session, "o1") == 1
+    assert repo.get("later").available_quantity == 100
+
+
+def test_cached_allocation_is_not_reloaded(fresh_session: Session):
+    """Test the idempotency cache answers retries with a reference lookup."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "RETRY-LAMP", 10, eta=None))
+    fresh_session.commit()
+    cache = IdempotencyCache()
+
+    line = OrderLine("o1", "RETRY-LAMP", 4)
+    assert services.allocate(line, repo, fresh_session, idempotency=cache)
+
+    class OrderLookupOnly(SQLAlchemyRepository):
+        def list_for_sku(self, sku):
+            raise AssertionError("batches loaded on a remembered retry")
+
+        def get_by_order(self, orderid, sku):
+            raise AssertionError("batch loaded on a remembered retry")
+
+    repo_without_batches = OrderLookupOnly(fresh_session)
+    assert (
+        services.allocate(
+            line, repo_without_batches, fresh_session, idempotency=cache
+        )
+        == "b1"
+    )
+
+    services.deallocate("o1", "RETRY-LAMP", repo, fresh_session, cache)
+    assert len(cache) == 0
+
+
+def test_stale_cached_allocation_is_allocated_again(fresh_session: Session):
+    """Test a line deallocated or archived elsewhere is not answered."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "RETRY-LAMP", 10, eta=None))
+    fresh_session.commit()
+    cache = IdempotencyCache()
+
+    line = OrderLine("o1", "RETRY-LAMP", 4)
+    services.allocate(line, repo, fresh_session, idempotency=cache)
+    services.deallocate("o1", "RETRY-LAMP", repo, fresh_session)
+
+    assert services.allocate(line, repo, fresh_session, idempotency=cache)
+    assert count_lines(fresh_session, "o1") == 1
+    assert repo.get("b1").available_quantity == 6
+
+    [result] = services.allocate_many(
+        [OrderLine("o1", "RETRY-LAMP", 4)],
+        repo,
+        fresh_session,
+        idempotency=cache,
+    )
+    assert result.batchref == "b1"
+    assert count_lines(fresh_session, "o1") == 1
+
+    line = OrderLine("o2", "RETRY-LAMP", 6)
+    services.allocate(line, repo, fresh_session, idempotency=cache)
+    assert repo.archive() == 1
+    fresh_session.commit()
+    [result] = services.allocate_many(
+        [line], repo, fresh_session, idempotency=cache
+    )
+    assert isinstance(result.error, InvalidSku)
+    assert cache.get(("o2", "RETRY-LAMP")) is None
+
+
+def test_deallocated_order_can_be_allocated_again(fresh_session: Session):
+    """Test deallocating removes the line, freeing its orderid and sku."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "RETRY-LAMP", 10, eta=None))
+    fresh_session.commit()
+
+    services.allocate(OrderLine("o1", "RETRY-LAMP", 4), repo, fresh_session)
+    services.deallocate("o1", "RETRY-LAMP", repo, fresh_session)
+    assert count_lines(fresh_session, "o1") == 0
+
+    line = OrderLine("o1", "RETRY-LAMP", 6)
+    assert services.allocate(line, repo, fresh_session) == "b1"
+    assert repo.get("b1").available_quantity == 4
+
+
+def test_allocate_many_answers_repeated_lines_once(fresh_session: Session):
+    """Test repeated lines, in the burst or stored, are not duplicated."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "RETRY-LAMP", 10, eta=None))
+    fresh_session.commit()
+    services.allocate(OrderLine("o1", "RETRY-LAMP", 2), repo, fresh_session)
+
+    lines = [
+        OrderLine("o1", "RETRY-LAMP", 2),
+        OrderLine("o2", "RETRY-LAMP", 3),
+        OrderLine("o2", "RETRY-LAMP", 3),
+    ]
+    results = services.allocate_many(lines, repo, fresh_session)
+
+    assert [r.batchref for r in results] == ["b1", "b1", "b1"]
+    assert [r.line for r in results] == lines
+    assert repo.get("b1").available_quantity == 5
+
+
+def test_order_lines_are_unique_by_orderid_and_sku(fresh_session: Session):
+    """Test the database rejects a second line for the same order and sku."""
+    insert = (
+        "INSERT INTO order_lines (orderid, sku, qty)"
+        " VALUES ('o1', 'RETRY-LAMP', 1)"
+    )
+    fresh_session.execute(insert)
+
+    with pytest.raises(IntegrityError):
+        fresh_session.execute(insert)
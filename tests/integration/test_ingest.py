@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""This module test the bulk batch ingestion against a database.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import date
+from pathlib import Path
+
+from _pytest.fixtures import FixtureFunction
+from sqlalchemy import create_engine
+
+from corelib.allocation.adapters.orm import metadata
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import Batch
+from corelib.allocation.entrypoints.ingest import main
+
+
+def test_add_many_upserts_batches_by_reference(session: FixtureFunction):
+    """Test chunks insert new references and update existing ones."""
+    repo = SQLAlchemyRepository(session)
+    repo.add_many(
+        (Batch(f"ingest-{i}", "FEED-SOFA", 10, eta=None) for i in range(5)),
+        chunk_size=2,
+    )
+    session.commit()
+
+    count = repo.add_many(
+        [
+            Batch("ingest-1", "FEED-SOFA", 99, eta=date(2022, 7, 1)),
+            Batch("ingest-5", "FEED-SOFA", 10, eta=None),
+        ],
+        chunk_size=2,
+    )
+    session.commit()
+
+    rows = dict(
+        list(
+            session.execute(
+                "SELECT reference, _purchased_quantity FROM batches"
+                " WHERE sku='FEED-SOFA'"
+            )
+        )
+    )
+    assert count == 2
+    assert len(rows) == 6
+    assert rows["ingest-1"] == 99
+    assert repo.get("ingest-1").eta == date(2022, 7, 1)
+    # One version bump per chunk, so cached batches of the sku go stale.
+    assert repo.get_version("FEED-SOFA") == 4
+    session.execute("DELETE FROM batches WHERE sku='FEED-SOFA'")
+    session.execute("DELETE FROM products WHERE sku='FEED-SOFA'")
+    session.commit()
+
+
+def test_ingest_entrypoint_streams_a_csv_file(tmp_path: Path):
+    """Test the command line ingests a CSV feed into the database."""
+    db_uri = f"sqlite:///{tmp_path / 'allocation.db'}"
+    engine = create_engine(db_uri)
+    metadata.create_all(engine)
+    feed = tmp_path / "shipments.csv"
+    feed.write_text(
+        "reference,sku,qty,eta\n"
+        + "".join(f"ship-{i},FEED-LAMP,{i},2022-07-01\n" for i in range(25))
+    )
+
+    count = main([str(feed), "--chunk-size", "10", "--db-uri", db_uri])
+
+    assert count == 25
+    [[stored]] = engine.execute("SELECT count(*) FROM batches")
+    assert stored == 25
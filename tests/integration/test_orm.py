@@ -1,7 +1,110 @@
 # -*- coding: utf-8 -*-
-"""
+"""This module test the loading strategies of the object relational mapper.
 
 Created on: 20/6/22
 @author: Heber Trujillo <heber.trj.urt@gmail.com>
 Licence,
 """
+import uuid
+from typing import List
+
+import pytest
+from _pytest.fixtures import FixtureFunction
+from sqlalchemy import event
+
+from corelib.allocation.adapters.orm import AllocationsLoading
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer.services import allocate
+
+
+def delete_sku(session: FixtureFunction, sku: str) -> None:
+    """Remove the rows of a sku so other tests see an empty database.
+
+    Args:
+        session: Database session.
+        sku: product identifier.
+
+    Returns:
+        None
+    """
+    session.execute(
+        "DELETE FROM allocations WHERE batch_id IN "
+        "(SELECT id FROM batches WHERE sku=:sku)",
+        dict(sku=sku),
+    )
+    session.execute("DELETE FROM batches WHERE sku=:sku", dict(sku=sku))
+    session.execute("DELETE FROM order_lines WHERE sku=:sku", dict(sku=sku))
+    session.commit()
+
+
+def count_allocation_statements(
+    session: FixtureFunction,
+    batches: int,
+    allocations_loading: AllocationsLoading,
+) -> int:
+    """Count the SQL statements issued to allocate one line.
+
+    Args:
+        session: Database session.
+        batches: number of batches, each holding one allocation.
+        allocations_loading: strategy to load batch allocations.
+
+    Returns:
+        statements: number of statements executed by the allocation.
+    """
+    sku = f"sku-{uuid.uuid4().hex[:6]}"
+    repo = SQLAlchemyRepository(session, allocations_loading)
+    for i in range(batches):
+        batch = Batch(f"{sku}-batch-{i}", sku, 100, eta=None)
+        batch.allocate(OrderLine(f"{sku}-order-{i}", sku, 1))
+        repo.add(batch)
+    session.commit()
+    session.close()
+
+    statements: List[str] = []
+
+    def count(conn, cursor, statement, *args):
+        """Record each statement sent to the database."""
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        allocate(OrderLine(f"{sku}-new-order", sku, 10), repo, session)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+        delete_sku(session, sku)
+
+    return len(statements)
+
+
+@pytest.mark.parametrize(
+    "allocations_loading",
+    [
+        AllocationsLoading.selectin,
+        AllocationsLoading.joined,
+        AllocationsLoading.aggregated,
+    ],
+)
+def test_allocation_statements_do_not_grow_with_batches(
+    session: FixtureFunction, allocations_loading: AllocationsLoading
+):
+    """Test eager loading avoids one SELECT per batch."""
+    few = count_allocation_statements(session, 2, allocations_loading)
+    many = count_allocation_statements(session, 20, allocations_loading)
+
+    assert few == many
+
+
+def test_lazy_allocations_issue_one_select_per_batch(
+    session: FixtureFunction,
+):
+    """Test lazy loading is the N+1 case the eager strategies remove."""
+    few = count_allocation_statements(session, 2, AllocationsLoading.lazy)
+    many = count_allocation_statements(session, 20, AllocationsLoading.lazy)
+
+    assert many - few == 18
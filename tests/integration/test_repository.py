@@ -6,9 +6,14 @@ Created on: 20/6/22
 Licence,
 """
 from _pytest.fixtures import FixtureFunction
+from sqlalchemy import (
+    event,
+    inspect,
+)
 from sqlalchemy.engine.cursor import CursorResult
 from sqlalchemy.orm.session import Session
 
+from corelib.allocation.adapters.orm import AllocationsLoading
 from corelib.allocation.adapters.repository import SQLAlchemyRepository
 from corelib.allocation.domain.model import (
     Batch,
@@ -17,23 +22,27 @@ from corelib.allocation.domain.model import (
 )
 
 
-def insert_order_line(session: Session) -> CursorResult:
+def insert_order_line(
+    session: Session, orderid: str = "order1"
+) -> CursorResult:
     """Insert order data via raw SQL to test the repo.get() method.
 
     Args:
         session: Database session.
+        orderid: Customer order identifier.
 
     Returns:
         orderline_id: Order line database identifier.
     """
     session.execute(
         "INSERT INTO order_lines (orderid, sku, qty)"
-        'VALUES ("order1", "GENERIC-SOFA", 12)'
+        'VALUES (:orderid, "GENERIC-SOFA", 12)',
+        dict(orderid=orderid),
     )
 
     orderline_id = session.execute(
         "SELECT id FROM order_lines WHERE orderid=:orderid AND sku=:sku",
-        dict(orderid="order1", sku="GENERIC-SOFA"),
+        dict(orderid=orderid, sku="GENERIC-SOFA"),
     )
 
     return orderline_id
@@ -121,3 +130,112 @@ def test_repository_can_retrieve_a_batch_with_allocations(
     assert retrieved._allocations == {
         OrderLine("order1", "GENERIC-SOFA", 12),
     }
+    assert retrieved.available_quantity == 88
+
+
+def test_loaded_batch_quantities_follow_database_changes(
+    session: FixtureFunction,
+):
+    """Test running counters are rebuilt when the ORM reloads allocations."""
+    batch_id = list(insert_batch(session, "batch4"))[0][0]
+    repo = SQLAlchemyRepository(session)
+    retrieved = repo.get("batch4")
+    assert retrieved.available_quantity == 100
+
+    orderline_id = list(insert_order_line(session, "order4"))[0][0]
+    insert_allocations(session, orderline_id, batch_id)
+    session.expire(retrieved)
+
+    assert retrieved.allocated_quantity == 12
+    assert retrieved.available_quantity == 88
+
+
+def test_repository_finds_the_batch_of_an_order(session: FixtureFunction):
+    """Test a batch can be looked up by the orderid it holds."""
+    batch = Batch("batch5", "WOBBLY-CHAIR", 100, eta=None)
+    batch.allocate(OrderLine("order5", "WOBBLY-CHAIR", 10))
+    other = Batch("batch5b", "OTHER-CHAIR", 100, eta=None)
+    other.allocate(OrderLine("order5", "OTHER-CHAIR", 10))
+    repo = SQLAlchemyRepository(session)
+    repo.add(batch)
+    repo.add(other)
+    session.commit()
+
+    assert repo.get_by_order("order5", "WOBBLY-CHAIR") == batch
+    assert repo.get_by_order("order5", "OTHER-CHAIR") == other
+    assert repo.get_by_order("order6", "WOBBLY-CHAIR") is None
+    assert {b.reference for b in repo.list_for_order("order5")} == {
+        "batch5",
+        "batch5b",
+    }
+    assert repo.list_for_order("order6") == []
+
+
+def test_repository_lists_only_the_batches_of_a_sku(
+    session: FixtureFunction,
+):
+    """Test batches can be loaded for a single sku."""
+    repo = SQLAlchemyRepository(session)
+    repo.add(Batch("batch6", "TALL-LAMP", 100, eta=None))
+    repo.add(Batch("batch7", "TALL-LAMP", 100, eta=None))
+    repo.add(Batch("batch8", "SHORT-LAMP", 100, eta=None))
+    session.commit()
+
+    batches = repo.list_for_sku("TALL-LAMP")
+
+    assert {b.reference for b in batches} == {"batch6", "batch7"}
+    assert repo.list_for_sku("MISSING-LAMP") == []
+    assert repo.has_sku("TALL-LAMP")
+    assert not repo.has_sku("MISSING-LAMP")
+
+
+def test_repository_computes_allocated_quantity_in_the_database(
+    session: FixtureFunction,
+):
+    """Test aggregated loading gives availability without the order lines."""
+    batch = Batch("batch9", "HEAVY-SHELF", 100, eta=None)
+    batch.allocate(OrderLine("order9", "HEAVY-SHELF", 10))
+    batch.allocate(OrderLine("order10", "HEAVY-SHELF", 15))
+    empty = Batch("batch10", "HEAVY-SHELF", 50, eta=None)
+    SQLAlchemyRepository(session).add(batch)
+    SQLAlchemyRepository(session).add(empty)
+    session.commit()
+    session.close()
+
+    repo = SQLAlchemyRepository(session, AllocationsLoading.aggregated)
+    retrieved = {b.reference: b for b in repo.list_for_sku("HEAVY-SHELF")}
+
+    assert retrieved["batch9"].available_quantity == 75
+    assert retrieved["batch10"].available_quantity == 50
+    assert "_allocations" in inspect(retrieved["batch9"]).unloaded
+    assert repo.get("batch9").allocated_quantity == 25
+
+
+def test_repository_deallocates_without_loading_the_batch(
+    session: FixtureFunction,
+):
+    """Test a line is deallocated with neither its batch nor lines loaded."""
+    batch = Batch("batch11", "LOOSE-SHELF", 100, eta=None)
+    batch.allocate(OrderLine("order11", "LOOSE-SHELF", 10))
+    batch.allocate(OrderLine("order12", "LOOSE-SHELF", 15))
+    repo = SQLAlchemyRepository(session)
+    repo.add(batch)
+    session.commit()
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        assert repo.deallocate("order11", "LOOSE-SHELF") == "batch11"
+        assert repo.deallocate("order11", "LOOSE-SHELF") is None
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    session.commit()
+
+    assert not any("_purchased_quantity" in s for s in statements)
+    assert batch.available_quantity == 85
+    assert repo.get_by_order("order12", "LOOSE-SHELF") == batch
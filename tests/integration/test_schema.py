@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""This module test the schema constraints and the upgrade of old databases.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from pathlib import Path
+
+import pytest
+from sqlalchemy import (
+    create_engine,
+    inspect,
+)
+from sqlalchemy.exc import IntegrityError
+
+from corelib.allocation.adapters.orm import metadata
+from corelib.allocation.entrypoints import migrate
+
+LEGACY_SCHEMA = (
+    "CREATE TABLE order_lines (id INTEGER PRIMARY KEY, sku VARCHAR(255),"
+    " qty INTEGER NOT NULL, orderid VARCHAR(255))",
+    "CREATE TABLE batches (id INTEGER PRIMARY KEY, reference VARCHAR(255),"
+    " sku VARCHAR(255), _purchased_quantity INTEGER NOT NULL, eta DATE)",
+    "CREATE TABLE allocations (id INTEGER PRIMARY KEY,"
+    " orderline_id INTEGER REFERENCES order_lines (id),"
+    " batch_id INTEGER REFERENCES batches (id))",
+)
+
+
+def test_batch_references_are_unique(tmp_path: Path):
+    """Test the database rejects a second batch with the same reference."""
+    engine = create_engine(f"sqlite:///{tmp_path}/unique.db")
+    metadata.create_all(engine)
+    insert = (
+        "INSERT INTO batches (reference, sku, _purchased_quantity)"
+        " VALUES ('batch1', 'RED-CHAIR', 10)"
+    )
+    with engine.begin() as conn:
+        conn.execute(insert)
+
+    with pytest.raises(IntegrityError):
+        with engine.begin() as conn:
+            conn.execute(insert)
+
+
+def test_migrate_adds_the_indexes_to_a_legacy_database(tmp_path: Path):
+    """Test the upgrade creates the missing indexes and read model once."""
+    uri = f"sqlite:///{tmp_path}/legacy.db"
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(statement)
+        conn.execute(
+            "INSERT INTO batches (reference, sku, _purchased_quantity)"
+            " VALUES ('batch1', 'RED-CHAIR', 10)"
+        )
+
+    created = migrate.main(["--db-uri", uri])
+
+    expected = {ix.name for t in metadata.sorted_tables for ix in t.indexes}
+    assert set(created) == expected
+    [reference] = [
+        ix
+        for ix in inspect(engine).get_indexes("batches")
+        if ix["column_names"] == ["reference"]
+    ]
+    assert reference["unique"]
+    assert "closed" in {
+        c["name"] for c in inspect(engine).get_columns("batches")
+    }
+    with engine.connect() as conn:
+        [row] = conn.execute(
+            "SELECT batchref, available_qty FROM availability"
+        )
+    assert tuple(row) == ("batch1", 10)
+    assert migrate.main(["--db-uri", uri]) == []
+
+
+def test_migrate_refuses_duplicated_references(tmp_path: Path):
+    """Test the upgrade fails on duplicates, then completes once fixed."""
+    uri = f"sqlite:///{tmp_path}/duplicated.db"
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(statement)
+        for _ in range(2):
+            conn.execute(
+                "INSERT INTO batches (reference, sku, _purchased_quantity)"
+                " VALUES ('batch1', 'RED-CHAIR', 10)"
+            )
+
+    with pytest.raises(IntegrityError):
+        migrate.main(["--db-uri", uri])
+
+    with engine.begin() as conn:
+        conn.execute("DELETE FROM batches WHERE id = 2")
+    migrate.main(["--db-uri", uri])
+    with engine.connect() as conn:
+        [row] = conn.execute(
+            "SELECT batchref, available_qty FROM availability"
+        )
+    assert tuple(row) == ("batch1", 10)
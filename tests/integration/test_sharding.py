@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""This module test the SKU sharded repository on several sqlite files.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from typing import List
+
+import pytest
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+
+from corelib.allocation.adapters.repository import (
+    RepositoryTyep,
+    ShardedRepository,
+    ShardedSession,
+    repository_maker,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+
+
+def make_session(engines: List[Engine]) -> ShardedSession:
+    """Open one session per shard engine."""
+    return ShardedSession([sessionmaker(bind=e)() for e in engines])
+
+
+def shard_rows(engine: Engine) -> List[str]:
+    """Return the batch references stored in one shard."""
+    with engine.connect() as conn:
+        return sorted(conn.execute("SELECT reference FROM batches").scalars())
+
+
+def test_sharded_repository_is_registered():
+    """Test the repository maker returns the sharded repository."""
+    assert repository_maker(RepositoryTyep.sharded) is ShardedRepository
+
+
+def test_sharded_repository_routes_skus_to_a_single_shard(
+    shard_engines: List[Engine],
+):
+    """Test batches land in the shard of their SKU, hashed or mapped."""
+    session = make_session(shard_engines)
+    repo = ShardedRepository(session, shard_map={"HOT-LAMP": 2})
+    skus = ["HOT-LAMP"] + [f"SKU-{i}" for i in range(12)]
+    repo.add_many(Batch(f"b-{sku}", sku, 10, eta=None) for sku in skus)
+    repo.add(Batch("b2-HOT-LAMP", "HOT-LAMP", 5, eta=None))
+    session.commit()
+
+    assert repo.shard_for("HOT-LAMP") == 2
+    assert ShardedRepository(session).shard_for("SKU-3") == repo.shard_for(
+        "SKU-3"
+    )
+    for sku in skus:
+        stored = shard_rows(shard_engines[repo.shard_for(sku)])
+        assert f"b-{sku}" in stored
+    assert sum(len(shard_rows(e)) for e in shard_engines) == len(skus) + 1
+    assert {b.reference for b in repo.list_for_sku("HOT-LAMP")} == {
+        "b-HOT-LAMP",
+        "b2-HOT-LAMP",
+    }
+
+
+def test_sharded_repository_fans_out_lookups_without_sku(
+    shard_engines: List[Engine],
+):
+    """Test list and get search every shard."""
+    session = make_session(shard_engines)
+    repo = ShardedRepository(session)
+    skus = [f"SKU-{i}" for i in range(9)]
+    for sku in skus:
+        repo.add(Batch(f"b-{sku}", sku, 10, eta=None))
+    session.commit()
+
+    assert {b.sku for b in repo.list()} == set(skus)
+    assert repo.get("b-SKU-7").sku == "SKU-7"
+    with pytest.raises(NoResultFound):
+        repo.get("missing")
+
+
+def test_services_allocate_and_deallocate_on_a_shard(
+    shard_engines: List[Engine],
+):
+    """Test the service layer works unchanged on the sharded unit of work."""
+    session = make_session(shard_engines)
+    repo = ShardedRepository(session)
+    repo.add(Batch("shard-batch", "SHARD-TABLE", 10, eta=None))
+    session.commit()
+
+    line = OrderLine("o1", "SHARD-TABLE", 4)
+    assert services.allocate(line, repo, session) == "shard-batch"
+    session.close()
+
+    session = make_session(shard_engines)
+    repo = ShardedRepository(session)
+    assert repo.get_by_order("o1", "SHARD-TABLE").reference == "shard-batch"
+    assert [b.reference for b in repo.list_for_order("o1")] == ["shard-batch"]
+    assert repo.get("shard-batch").available_quantity == 6
+    services.deallocate("o1", "SHARD-TABLE", repo, session)
+    assert repo.get("shard-batch").available_quantity == 10
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""This module test the set-based allocation path against the domain model.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import random
+from datetime import (
+    date,
+    timedelta,
+)
+from typing import (
+    List,
+    Optional,
+)
+
+import pytest
+from sqlalchemy.orm.session import Session
+
+from corelib.allocation.adapters.repository import SQLAlchemyRepository
+from corelib.allocation.domain import model
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer import services
+from corelib.exceptions import (
+    InvalidSku,
+    OutOfStock,
+)
+
+SKUS = ("PROP-LAMP", "PROP-CHAIR")
+
+
+def random_batches(rng: random.Random) -> List[Batch]:
+    """Draw batches with colliding ETAs, warehouse stock included."""
+    today = date(2022, 7, 1)
+    return [
+        Batch(
+            f"b{i}",
+            rng.choice(SKUS),
+            rng.randint(0, 20),
+            eta=rng.choice(
+                [None, today, today + timedelta(rng.randint(1, 3))]
+            ),
+        )
+        for i in range(rng.randint(0, 8))
+    ]
+
+
+def random_lines(rng: random.Random) -> List[OrderLine]:
+    """Draw lines, retrying some of them, maybe with another quantity."""
+    lines = [
+        OrderLine(f"o{i}", rng.choice(SKUS), rng.randint(1, 8))
+        for i in range(rng.randint(1, 15))
+    ]
+    retries = [
+        OrderLine(line.orderid, line.sku, rng.choice([line.qty, 1]))
+        for line in rng.sample(lines, k=len(lines) // 3)
+    ]
+    return lines + retries
+
+
+def domain_allocate(line: OrderLine, batches: List[Batch]) -> Optional[str]:
+    """Allocate with the domain model, None if out of stock."""
+    try:
+        return model.allocate(line, batches)
+    except OutOfStock:
+        return None
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_allocate_in_database_matches_the_domain_model(
+    fresh_session: Session, seed: int
+):
+    """Test random stocks and orders are allocated as the domain does."""
+    rng = random.Random(seed)
+    batches = random_batches(rng)
+    repo = SQLAlchemyRepository(fresh_session)
+    for batch in batches:
+        repo.add(
+            Batch(
+                batch.reference,
+                batch.sku,
+                batch._purchased_quantity,
+                batch.eta,
+            )
+        )
+    fresh_session.commit()
+
+    allocated = {}
+    for line in random_lines(rng):
+        key = (line.orderid, line.sku)
+        expected = allocated.get(key) or domain_allocate(line, batches)
+        assert repo.allocate_in_database(line) == expected
+        if expected is not None:
+            allocated[key] = expected
+
+    fresh_session.commit()
+    fresh_session.expire_all()
+    for batch in batches:
+        stored = repo.get(batch.reference)
+        assert stored._allocations == batch._allocations
+        assert stored.available_quantity == batch.available_quantity
+
+
+def test_allocate_in_database_service_errors(fresh_session: Session):
+    """Test the fast path service reports invalid skus and missing stock."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "FAST-LAMP", 5, eta=None))
+    fresh_session.commit()
+
+    line = OrderLine("o1", "FAST-LAMP", 5)
+    assert services.allocate_in_database(line, repo, fresh_session) == "b1"
+    with pytest.raises(OutOfStock):
+        services.allocate_in_database(
+            OrderLine("o2", "FAST-LAMP", 1), repo, fresh_session
+        )
+    with pytest.raises(InvalidSku):
+        services.allocate_in_database(
+            OrderLine("o3", "MISSING-LAMP", 1), repo, fresh_session
+        )
+
+
+def test_allocate_in_database_service_bumps_the_product_version(
+    fresh_session: Session,
+):
+    """Test the fast path is guarded by the product version check."""
+    repo = SQLAlchemyRepository(fresh_session)
+    repo.add(Batch("b1", "FAST-CHAIR", 5, eta=None))
+    fresh_session.commit()
+
+    services.allocate_in_database(
+        OrderLine("o1", "FAST-CHAIR", 1), repo, fresh_session
+    )
+    assert repo.get_version("FAST-CHAIR") == 2
+    services.allocate_in_database(
+        OrderLine("o2", "FAST-CHAIR", 1), repo, fresh_session
+    )
+    assert repo.get_version("FAST-CHAIR") == 3
@@ -1,7 +1,230 @@
 # -*- coding: utf-8 -*-
-"""
+"""This module test the allocation index of the domain model.
 
 Created on: 20/6/22
 @author: Heber Trujillo <heber.trj.urt@gmail.com>
 Licence,
 """
+import random
+from datetime import (
+    date,
+    timedelta,
+)
+from typing import (
+    List,
+    Optional,
+)
+
+import pytest
+
+from corelib.allocation.domain.model import (
+    AllocationIndex,
+    Batch,
+    OrderLine,
+)
+from corelib.exceptions import (
+    OutOfStock,
+    UnallocatedOrder,
+)
+
+today = date.today()
+tomorrow = today + timedelta(days=1)
+later = tomorrow + timedelta(days=10)
+
+
+def sorted_allocate(line: OrderLine, batches: List[Batch]) -> Optional[str]:
+    """Reference allocation scanning every batch in ETA order.
+
+    Args:
+        line: Order line.
+        batches: List of order batches.
+
+    Returns:
+        batch_reference: allocated batch reference, None if out of stock.
+    """
+    for batch in sorted(batches):
+        if batch.can_allocate(line):
+            batch.allocate(line)
+            return batch.reference
+    return None
+
+
+@pytest.mark.unit
+def test_index_prefers_current_stock_batches_to_shipments():
+    """Test the index allocates to warehouse stock first."""
+    shipment_batch = Batch("shipment", "RETRO_CLOCK", 100, eta=tomorrow)
+    in_stock_batch = Batch("in-stock-batch", "RETRO_CLOCK", 100, eta=None)
+    index = AllocationIndex([shipment_batch, in_stock_batch])
+
+    batchref = index.allocate(OrderLine("oref", "RETRO_CLOCK", 10))
+
+    assert batchref == "in-stock-batch"
+    assert in_stock_batch.available_quantity == 90
+    assert shipment_batch.available_quantity == 100
+
+
+@pytest.mark.unit
+def test_index_skips_batches_that_cannot_fit_the_line():
+    """Test the index moves on to the next batch when one is used up."""
+    earliest = Batch("speedy-batch", "MINIMAL-TABLE", 10, eta=today)
+    medium = Batch("normal-batch", "MINIMAL-TABLE", 5, eta=tomorrow)
+    latest = Batch("slow-batch", "MINIMAL-TABLE", 100, eta=later)
+    index = AllocationIndex([latest, medium, earliest])
+
+    refs = [
+        index.allocate(OrderLine(f"o{i}", "MINIMAL-TABLE", qty))
+        for i, qty in enumerate([10, 6, 5])
+    ]
+
+    assert refs == ["speedy-batch", "slow-batch", "normal-batch"]
+
+
+@pytest.mark.unit
+def test_index_raises_out_of_stock_for_unknown_sku():
+    """Test the index raises out of stock when no batch has the sku."""
+    index = AllocationIndex([Batch("batch1", "SMALL-DESK", 10, eta=today)])
+
+    with pytest.raises(OutOfStock, match="BIG-DESK"):
+        index.allocate(OrderLine("order1", "BIG-DESK", 1))
+
+
+@pytest.mark.unit
+def test_index_sees_batches_changed_after_refresh():
+    """Test the index uses the available quantity given by refresh."""
+    batch = Batch("batch1", "SMALL-DESK", 10, eta=today)
+    index = AllocationIndex([batch])
+    index.allocate(OrderLine("order1", "SMALL-DESK", 10))
+
+    batch.deallocate(OrderLine("order1", "SMALL-DESK", 10))
+    index.refresh(batch)
+
+    assert index.allocate(OrderLine("order2", "SMALL-DESK", 10)) == "batch1"
+
+
+@pytest.mark.unit
+def test_index_matches_sorted_allocation():
+    """Test the index picks the same batches as a full sorted scan."""
+    rng = random.Random(42)
+    etas = [None, today, tomorrow, later]
+    specs = [
+        (f"b{i}", rng.choice(["LAMP", "SOFA"]), rng.randint(0, 30))
+        for i in range(40)
+    ]
+    eta_of = {ref: rng.choice(etas) for ref, _, _ in specs}
+    indexed = [Batch(ref, sku, qty, eta_of[ref]) for ref, sku, qty in specs]
+    scanned = [Batch(ref, sku, qty, eta_of[ref]) for ref, sku, qty in specs]
+    index = AllocationIndex(indexed)
+
+    for i in range(300):
+        line = OrderLine(
+            f"o{i}", rng.choice(["LAMP", "SOFA"]), rng.randint(1, 8)
+        )
+        expected = sorted_allocate(line, scanned)
+        try:
+            assert index.allocate(line) == expected
+        except OutOfStock:
+            assert expected is None
+
+
+@pytest.mark.unit
+def test_index_locates_and_deallocates_orders():
+    """Test the orderid index follows allocations and deallocations."""
+    allocated = Batch("allocated", "SMALL-DESK", 10, eta=None)
+    allocated.allocate(OrderLine("order1", "SMALL-DESK", 4))
+    shipment = Batch("shipment", "SMALL-DESK", 10, eta=tomorrow)
+    index = AllocationIndex([allocated, shipment])
+    index.allocate(OrderLine("order2", "SMALL-DESK", 8))
+
+    assert index.locate("order1", "SMALL-DESK") is allocated
+    assert index.locate("order2", "SMALL-DESK") is shipment
+
+    assert index.deallocate("order2", "SMALL-DESK") == "shipment"
+    assert index.locate("order2", "SMALL-DESK") is None
+    assert shipment.available_quantity == 10
+    assert index.allocate(OrderLine("order3", "SMALL-DESK", 6)) == "allocated"
+    assert index.locate("order3", "SMALL-DESK") is allocated
+
+    chair = Batch("chair", "SMALL-CHAIR", 10, eta=None)
+    index.add(chair)
+    index.allocate(OrderLine("order3", "SMALL-CHAIR", 1))
+    assert index.locate_order("order3") == [allocated, chair]
+    assert index.locate_order("order2") == []
+
+
+@pytest.mark.unit
+def test_index_raises_unallocated_order_for_unknown_orders():
+    """Test deallocating an unknown order raises the right exception."""
+    index = AllocationIndex([Batch("batch1", "SMALL-DESK", 10, eta=today)])
+
+    with pytest.raises(UnallocatedOrder, match="order1"):
+        index.deallocate("order1", "SMALL-DESK")
+
+
+@pytest.mark.unit
+def test_index_available_to_promise_follows_allocations():
+    """Test the cumulative stock by ETA is updated by every allocation."""
+    index = AllocationIndex(
+        [
+            Batch("later", "SMALL-DESK", 30, eta=later),
+            Batch("tomorrow1", "SMALL-DESK", 5, eta=tomorrow),
+            Batch("in-stock", "SMALL-DESK", 10, eta=None),
+            Batch("tomorrow2", "SMALL-DESK", 15, eta=tomorrow),
+        ]
+    )
+
+    assert index.available_to_promise("SMALL-DESK") == [
+        (None, 10),
+        (tomorrow, 30),
+        (later, 60),
+    ]
+    assert index.earliest_eta("SMALL-DESK", 10) is None
+    assert index.earliest_eta("SMALL-DESK", 11) == tomorrow
+    assert index.earliest_eta("SMALL-DESK", 16) == later
+
+    index.allocate(OrderLine("order1", "SMALL-DESK", 8))
+    index.allocate(OrderLine("order2", "SMALL-DESK", 14))
+
+    assert index.available_to_promise("SMALL-DESK") == [
+        (None, 2),
+        (tomorrow, 8),
+        (later, 38),
+    ]
+    assert index.available_by("SMALL-DESK", today) == 2
+    assert index.available_by("SMALL-DESK", tomorrow) == 8
+    assert index.earliest_eta("SMALL-DESK", 3) == tomorrow
+    with pytest.raises(OutOfStock, match="SMALL-DESK"):
+        index.earliest_eta("SMALL-DESK", 31)
+    assert index.available_to_promise("UNKNOWN") == []
+
+
+@pytest.mark.unit
+def test_index_available_to_promise_matches_scanning_batches():
+    """Test the trees agree with scanning the batches after each change."""
+    rng = random.Random(24)
+    etas = [None, today, tomorrow, later]
+    batches = [
+        Batch(f"b{i}", "SMALL-DESK", rng.randint(1, 20), rng.choice(etas))
+        for i in range(40)
+    ]
+    index = AllocationIndex(batches)
+
+    for i in range(150):
+        try:
+            index.allocate(OrderLine(f"o{i}", "SMALL-DESK", rng.randint(1, 8)))
+        except OutOfStock:
+            pass
+        eta = rng.choice(etas)
+        expected = sum(
+            b.available_quantity
+            for b in batches
+            if b.eta is None or (eta is not None and b.eta <= eta)
+        )
+        assert index.available_by("SMALL-DESK", eta) == expected
+
+        qty = rng.randint(1, 20)
+        fitting = [b for b in sorted(batches) if b.available_quantity >= qty]
+        if fitting:
+            assert index.earliest_eta("SMALL-DESK", qty) == fitting[0].eta
+        else:
+            with pytest.raises(OutOfStock):
+                index.earliest_eta("SMALL-DESK", qty)
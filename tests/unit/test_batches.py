@@ -17,6 +17,8 @@ from corelib.allocation.domain.model import (
     Batch,
     OrderLine,
     allocate,
+    allocate_many,
+    available_to_promise,
 )
 from corelib.exceptions import OutOfStock
 
@@ -142,3 +144,122 @@ def test_raises_out_of_stock_exception_if_cannot_allocate():
 
     with pytest.raises(OutOfStock, match="SMALL-DESK"):
         allocate(line=OrderLine("order2", "SMALL-DESK", 11), batches=[batch])
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "batch_line",
+    [["DECORATIVE-TRINKET", "DECORATIVE-TRINKET", 20, 2]],
+    indirect=True,
+)
+def test_deallocating_restores_the_available_quantity(batch_line: Callable):
+    """Test deallocation gives the line quantity back to the batch."""
+    batch, line = batch_line
+    batch.allocate(line)
+    batch.deallocate(line)
+    assert batch.allocated_quantity == 0
+    assert batch.available_quantity == 20
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "batch_line",
+    [["EXPENSIVE-FOOTSTOOL", "EXPENSIVE-FOOTSTOOL", 20, 2]],
+    indirect=True,
+)
+def test_can_only_deallocate_allocated_lines(batch_line: Callable):
+    """Test deallocating an unknown line leaves the batch untouched."""
+    batch, line = batch_line
+    batch.deallocate(line)
+    assert batch.available_quantity == 20
+
+
+@pytest.mark.unit
+def test_allocated_quantity_is_rebuilt_after_reset():
+    """Test the running counter matches the allocations after a reset."""
+    batch = Batch("batch1", "SMALL-DESK", 20, eta=today)
+    batch.allocate(OrderLine("order1", "SMALL-DESK", 5))
+    batch._allocations.add(OrderLine("order2", "SMALL-DESK", 3))
+
+    batch.reset_allocation_cache()
+
+    assert batch.allocated_quantity == 8
+    assert batch.available_quantity == 12
+
+
+@pytest.mark.unit
+def test_allocate_many_matches_sequential_allocation():
+    """Test bulk allocation gives the same batches as one call per line."""
+    lines = [
+        OrderLine("o1", "SMALL-DESK", 8),
+        OrderLine("o2", "RETRO-CLOCK", 5),
+        OrderLine("o3", "SMALL-DESK", 8),
+        OrderLine("o4", "SMALL-DESK", 2),
+        OrderLine("o5", "SMALL-DESK", 20),
+    ]
+
+    def make_batches():
+        """Create fresh batches for each allocation run."""
+        return [
+            Batch("desk-later", "SMALL-DESK", 10, eta=tomorrow),
+            Batch("desk-stock", "SMALL-DESK", 10, eta=None),
+            Batch("clock-stock", "RETRO-CLOCK", 10, eta=None),
+        ]
+
+    sequential_batches = make_batches()
+    expected = []
+    for line in lines:
+        try:
+            expected.append(allocate(line, sequential_batches))
+        except OutOfStock:
+            expected.append(None)
+
+    results = allocate_many(lines, make_batches())
+
+    assert [r.line for r in results] == lines
+    assert [r.batchref for r in results] == expected
+    assert [r.ok for r in results] == [True, True, True, True, False]
+    assert isinstance(results[-1].error, OutOfStock)
+
+
+@pytest.mark.unit
+def test_get_line_follows_allocations():
+    """Test the orderid lookup table is kept up to date."""
+    batch = Batch("batch1", "SMALL-DESK", 20, eta=today)
+    line = OrderLine("order1", "SMALL-DESK", 5)
+    assert batch.get_line("order1") is None
+
+    batch.allocate(line)
+    assert batch.get_line("order1") == line
+
+    batch.deallocate(line)
+    assert batch.get_line("order1") is None
+
+
+@pytest.mark.unit
+def test_closed_batches_take_no_new_allocations():
+    """Test allocate skips closed batches until a deallocation reopens them."""
+    in_stock = Batch("in-stock-batch", "RETRO_CLOCK", 100, eta=None)
+    shipment = Batch("shipment", "RETRO_CLOCK", 100, eta=tomorrow)
+    line = OrderLine("oref", "RETRO_CLOCK", 10)
+    in_stock.allocate(line)
+    in_stock.close()
+
+    assert not in_stock.can_allocate(OrderLine("o2", "RETRO_CLOCK", 1))
+    batchref = allocate(
+        OrderLine("o2", "RETRO_CLOCK", 10), [in_stock, shipment]
+    )
+    assert batchref == "shipment"
+    assert shipment.available_quantity == 90
+    assert available_to_promise("RETRO_CLOCK", [in_stock, shipment]) == [
+        (None, 0),
+        (tomorrow, 90),
+    ]
+
+    in_stock.deallocate(line)
+    assert in_stock.available_quantity == 100
+    assert not in_stock.closed
+    batchref = allocate(
+        OrderLine("o3", "RETRO_CLOCK", 91), [in_stock, shipment]
+    )
+    assert batchref == "in-stock-batch"
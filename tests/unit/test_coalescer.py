@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""This module test the micro-batching allocation coalescer.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from corelib.allocation.adapters.repository import InMemoryRepository
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+from corelib.allocation.service_layer.catalogue import SkuCatalogue
+from corelib.allocation.service_layer.coalescer import AllocationCoalescer
+from corelib.allocation.service_layer.idempotency import IdempotencyCache
+from corelib.exceptions import (
+    InvalidSku,
+    OutOfStock,
+)
+
+
+class FakeSession:
+    """Fake session counting its commits."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.commits = 0
+
+    def commit(self):
+        """Fake commit action."""
+        self.commits += 1
+
+    def rollback(self):
+        """Fake rollback action."""
+
+    def close(self):
+        """Fake close action."""
+
+
+def make_coalescer(repo, session, **kwargs) -> AllocationCoalescer:
+    """Create a coalescer whose groups all use the same fakes."""
+    return AllocationCoalescer(lambda: session, lambda _: repo, **kwargs)
+
+
+@pytest.mark.unit
+def test_concurrent_requests_share_one_transaction():
+    """Test requests within the window are allocated in one commit."""
+    repo = InMemoryRepository([Batch("b1", "HOT-LAMP", 10, eta=None)])
+    session = FakeSession()
+    coalescer = make_coalescer(repo, session, window=1.0, max_batch=4)
+    barrier = threading.Barrier(4)
+
+    def allocate(orderid):
+        barrier.wait()
+        try:
+            return coalescer.allocate(OrderLine(orderid, "HOT-LAMP", 3))
+        except OutOfStock as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(allocate, ["o1", "o2", "o3", "o4"]))
+
+    assert session.commits == 1
+    assert results.count("b1") == 3
+    assert sum(isinstance(r, OutOfStock) for r in results) == 1
+    assert repo.get("b1").available_quantity == 1
+
+
+@pytest.mark.unit
+def test_each_caller_gets_its_own_error():
+    """Test a lone request is flushed after the window with its own error."""
+    repo = InMemoryRepository([Batch("b1", "HOT-LAMP", 10, eta=None)])
+    session = FakeSession()
+    coalescer = make_coalescer(repo, session, window=0.001)
+
+    assert coalescer.allocate(OrderLine("o1", "HOT-LAMP", 3)) == "b1"
+    with pytest.raises(InvalidSku):
+        coalescer.allocate(OrderLine("o2", "COLD-LAMP", 3))
+    assert session.commits == 2
+
+
+@pytest.mark.unit
+def test_coalesced_requests_share_the_request_caches():
+    """Test the catalogue and idempotency cache apply to coalesced lines."""
+    repo = InMemoryRepository([Batch("b1", "HOT-LAMP", 10, eta=None)])
+    session = FakeSession()
+    catalogue = SkuCatalogue()
+    idempotency = IdempotencyCache()
+    coalescer = make_coalescer(
+        repo,
+        session,
+        window=0.001,
+        catalogue=catalogue,
+        idempotency=idempotency,
+    )
+
+    assert coalescer.allocate(OrderLine("o1", "HOT-LAMP", 3)) == "b1"
+    assert idempotency.get(("o1", "HOT-LAMP")) == "b1"
+    assert len(catalogue) == 1
+    assert coalescer.allocate(OrderLine("o1", "HOT-LAMP", 3)) == "b1"
+    with pytest.raises(InvalidSku):
+        coalescer.allocate(OrderLine("o2", "COLD-LAMP", 3))
+    assert repo.get("b1").available_quantity == 7
+
+
+@pytest.mark.unit
+def test_failing_sessions_reach_every_caller():
+    """Test callers get the error of a session that cannot be opened."""
+
+    def session_factory():
+        raise ConnectionError("database unavailable")
+
+    coalescer = AllocationCoalescer(
+        session_factory, lambda _: None, window=1.0, max_batch=2
+    )
+    barrier = threading.Barrier(2)
+
+    def allocate(orderid):
+        barrier.wait()
+        try:
+            return coalescer.allocate(OrderLine(orderid, "HOT-LAMP", 1))
+        except ConnectionError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(allocate, ["o1", "o2"]))
+
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert coalescer._flush_locks == {}
+
+
+@pytest.mark.unit
+def test_flush_locks_are_dropped_once_idle():
+    """Test the flush lock of a SKU does not outlive its groups."""
+    repo = InMemoryRepository(
+        [Batch(f"b{i}", f"SKU-{i}", 10, eta=None) for i in range(5)]
+    )
+    coalescer = make_coalescer(repo, FakeSession(), window=0.001)
+
+    for i in range(5):
+        assert coalescer.allocate(OrderLine("o1", f"SKU-{i}", 1)) == f"b{i}"
+
+    assert coalescer._flush_locks == {}
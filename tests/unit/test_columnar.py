@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""This module test the columnar allocation engine.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import random
+from datetime import (
+    date,
+    timedelta,
+)
+from typing import (
+    List,
+    Optional,
+)
+
+import pytest
+
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+    allocate,
+)
+from corelib.exceptions import OutOfStock
+
+pytest.importorskip("numpy")
+
+from corelib.allocation.domain.columnar import ColumnarAllocator  # noqa: E402
+
+today = date.today()
+
+
+def object_model_allocate(
+    lines: List[OrderLine], batches: List[Batch]
+) -> List[Optional[str]]:
+    """Allocate lines one by one with the object model.
+
+    Args:
+        lines: Order lines.
+        batches: List of order batches.
+
+    Returns:
+        batch_references: Reference per line, None if out of stock.
+    """
+    refs = []
+    for line in lines:
+        try:
+            refs.append(allocate(line, batches))
+        except OutOfStock:
+            refs.append(None)
+    return refs
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("seed", range(10))
+def test_columnar_engine_matches_object_model(seed: int):
+    """Test the columnar engine picks the same batches on random inputs."""
+    rng = random.Random(seed)
+    skus = [f"SKU-{i}" for i in range(5)]
+    etas = [None] + [today + timedelta(days=d) for d in range(4)]
+
+    def make_batches():
+        """Create the same random batches on every call."""
+        batch_rng = random.Random(seed)
+        return [
+            Batch(
+                f"batch-{i}",
+                batch_rng.choice(skus),
+                batch_rng.randint(0, 60),
+                eta=batch_rng.choice(etas),
+            )
+            for i in range(30)
+        ]
+
+    lines = [
+        OrderLine(
+            f"order-{i}",
+            rng.choice(skus + ["UNKNOWN-SKU"]),
+            rng.choice([0, 1, 2, 3, 5, 8, 13, 40]),
+        )
+        for i in range(600)
+    ]
+
+    expected = object_model_allocate(lines, make_batches())
+    allocator = ColumnarAllocator(make_batches())
+
+    assert allocator.allocate_lines(lines) == expected
+
+
+@pytest.mark.unit
+def test_columnar_engine_keeps_remaining_quantities():
+    """Test the remaining column reflects the allocated lines."""
+    allocator = ColumnarAllocator(
+        [
+            Batch("shipment", "RETRO-CLOCK", 100, eta=today),
+            Batch("in-stock", "RETRO-CLOCK", 10, eta=None),
+        ]
+    )
+
+    refs = allocator.allocate_lines(
+        [OrderLine(f"o{i}", "RETRO-CLOCK", 4) for i in range(4)]
+    )
+
+    assert refs == ["in-stock", "in-stock", "shipment", "shipment"]
+    assert allocator.references.tolist() == ["in-stock", "shipment"]
+    assert allocator.remaining.tolist() == [2, 92]
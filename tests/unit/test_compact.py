@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""This module test the compact domain objects used by simulations.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import random
+from datetime import (
+    date,
+    timedelta,
+)
+from typing import Optional
+
+import pytest
+
+from corelib.allocation.domain import compact
+from corelib.allocation.domain.compact import (
+    CompactBatch,
+    CompactLine,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+    allocate,
+)
+from corelib.exceptions import OutOfStock
+
+today = date.today()
+
+
+def try_allocate(allocator, line, batches) -> Optional[str]:
+    """Return the batch a line is allocated to, None if out of stock."""
+    try:
+        return allocator(line, batches)
+    except OutOfStock:
+        return None
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_allocation_matches_the_domain_model(seed: int):
+    """Test compact batches pick the same batches as the domain model."""
+    rng = random.Random(seed)
+    batches = [
+        Batch(
+            f"b{i}",
+            rng.choice(["LAMP", "SOFA"]),
+            rng.randint(1, 30),
+            rng.choice([None, today + timedelta(days=rng.randint(1, 9))]),
+        )
+        for i in range(8)
+    ]
+    compacts = [CompactBatch.of(batch) for batch in batches]
+
+    for i in range(60):
+        sku, qty = rng.choice(["LAMP", "SOFA"]), rng.randint(1, 10)
+        assert try_allocate(
+            compact.allocate, CompactLine(f"o{i}", sku, qty), compacts
+        ) == try_allocate(allocate, OrderLine(f"o{i}", sku, qty), batches)
+
+    assert [c.available_quantity for c in compacts] == [
+        b.available_quantity for b in batches
+    ]
+
+
+@pytest.mark.unit
+def test_compact_batches_round_trip_and_deallocate():
+    """Test conversions keep the allocations, deallocation reopens."""
+    batch = Batch("b1", "LAMP", 10, eta=today)
+    batch.allocate(OrderLine("o1", "LAMP", 4))
+    batch.allocate(OrderLine("o2", "LAMP", 6))
+    batch.close()
+
+    compact_batch = CompactBatch.of(batch)
+    assert compact_batch.lines == {"o1": 4, "o2": 6}
+    assert compact_batch.available_quantity == 0
+    assert not compact_batch.can_allocate(CompactLine("o3", "LAMP", 0))
+
+    compact_batch.deallocate("o1")
+    compact_batch.deallocate("o1")
+    assert compact_batch.available_quantity == 4
+    assert not compact_batch.closed
+
+    restored = compact_batch.to_batch()
+    assert restored == batch
+    assert restored._allocations == {OrderLine("o2", "LAMP", 6)}
+    assert restored.available_quantity == 4
+    assert not hasattr(compact_batch, "__dict__")
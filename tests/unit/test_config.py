@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""This module test the engine factory of the configuration module.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from pathlib import Path
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+import corelib.allocation.config as config
+
+
+@pytest.mark.unit
+def test_engine_options_come_from_the_environment(monkeypatch: MonkeyPatch):
+    """Test pool and Postgres options are read from the environment."""
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT", "5000")
+
+    options = config.get_engine_options(config.get_postgres_uri())
+
+    assert options["poolclass"] is config.MeteredQueuePool
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"] is False
+    assert options["pool_recycle"] == 1800
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    assert options["executemany_mode"] == "values_plus_batch"
+
+
+@pytest.mark.unit
+def test_in_memory_sqlite_keeps_default_pool():
+    """Test an in memory database is not given a queue pool."""
+    assert config.get_engine_options("sqlite://") == {}
+
+
+@pytest.mark.unit
+def test_pool_metrics_count_checkouts(tmp_path: Path):
+    """Test the metered pool reports checkouts and occupancy."""
+    engine = config.make_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+
+    with engine.connect():
+        busy = config.get_pool_metrics(engine)
+    with engine.connect():
+        pass
+    metrics = config.get_pool_metrics(engine)
+
+    assert busy["checked_out"] == 1
+    assert metrics["checked_out"] == 0
+    assert metrics["checkouts"] == 2
+    assert metrics["timeouts"] == 0
+    assert metrics["max_wait_seconds"] >= 0
+
+
+@pytest.mark.unit
+def test_coalescing_is_enabled_by_the_environment(monkeypatch: MonkeyPatch):
+    """Test the allocation window and batch size are read in milliseconds."""
+    monkeypatch.delenv("ALLOCATE_WINDOW_MS", raising=False)
+    assert config.get_coalescing_options() == {}
+
+    monkeypatch.setenv("ALLOCATE_WINDOW_MS", "5")
+    monkeypatch.setenv("ALLOCATE_MAX_BATCH", "32")
+
+    assert config.get_coalescing_options() == dict(window=0.005, max_batch=32)
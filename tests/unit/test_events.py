@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""This module test replaying domain events on batches.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import date
+
+import pytest
+
+from corelib.allocation.domain.events import (
+    Allocated,
+    BatchCreated,
+    Deallocated,
+    replay,
+)
+from corelib.allocation.domain.model import OrderLine
+
+
+@pytest.mark.unit
+def test_replay_rebuilds_batches_and_allocations():
+    """Test events applied in order give the batches their final state."""
+    batches = replay(
+        {},
+        [
+            BatchCreated("RED-CHAIR", "b1", 10, date(2022, 7, 1)),
+            BatchCreated("RED-CHAIR", "b2", 5),
+            Allocated("RED-CHAIR", "o1", 4, "b1"),
+            Allocated("RED-CHAIR", "o2", 3, "b2"),
+            Deallocated("RED-CHAIR", "o2", 3, "b2"),
+        ],
+    )
+
+    assert batches["b1"].eta == date(2022, 7, 1)
+    assert batches["b1"].available_quantity == 6
+    assert batches["b1"]._allocations == {OrderLine("o1", "RED-CHAIR", 4)}
+    assert batches["b2"].available_quantity == 5
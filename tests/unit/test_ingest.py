@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""This module test the purchasing feed readers.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+import io
+from datetime import date
+
+import pytest
+
+from corelib.allocation.entrypoints.ingest import (
+    read_csv,
+    read_ndjson,
+)
+
+
+@pytest.mark.unit
+def test_read_csv_streams_batches():
+    """Test CSV rows become batches, empty eta meaning warehouse stock."""
+    stream = io.StringIO(
+        "reference,sku,qty,eta\n"
+        "b1,TALL-LAMP,100,2022-07-01\n"
+        "b2,TALL-LAMP,50,\n"
+    )
+
+    batches = list(read_csv(stream))
+
+    assert [b.reference for b in batches] == ["b1", "b2"]
+    assert batches[0].eta == date(2022, 7, 1)
+    assert batches[1].eta is None
+    assert batches[1].available_quantity == 50
+
+
+@pytest.mark.unit
+def test_read_ndjson_streams_batches():
+    """Test NDJSON lines become batches, skipping blank lines."""
+    stream = io.StringIO(
+        '{"reference": "b1", "sku": "HEAVY-SHELF", "qty": 10, "eta": null}\n'
+        "\n"
+        '{"reference": "b2", "sku": "HEAVY-SHELF", "qty": 5,'
+        ' "eta": "2022-07-02"}\n'
+    )
+
+    batches = list(read_ndjson(stream))
+
+    assert [b.reference for b in batches] == ["b1", "b2"]
+    assert batches[0].eta is None
+    assert batches[1].eta == date(2022, 7, 2)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""This module test the in-memory repository.
+
+Created on: 18/10/26
+@author: Heber Trujillo <heber.trj.urt@gmail.com>
+Licence,
+"""
+from datetime import (
+    date,
+    timedelta,
+)
+
+import pytest
+
+from corelib.allocation.adapters.repository import (
+    BatchCache,
+    CachingRepository,
+    InMemoryRepository,
+)
+from corelib.allocation.domain.model import (
+    Batch,
+    OrderLine,
+)
+
+
+@pytest.mark.unit
+def test_in_memory_repository_indexes_batches_by_reference_and_sku():
+    """Test batches can be looked up by reference and listed by sku."""
+    lamp = Batch("b1", "TALL-LAMP", 100, eta=None)
+    other_lamp = Batch("b2", "TALL-LAMP", 100, eta=None)
+    shelf = Batch("b3", "HEAVY-SHELF", 100, eta=None)
+    repo = InMemoryRepository([lamp, other_lamp])
+    repo.add(shelf)
+    repo.add(Batch("b1", "TALL-LAMP", 5, eta=None))
+
+    assert repo.get("b1") is lamp
+    assert repo.list_for_sku("TALL-LAMP") == [lamp, other_lamp]
+    assert repo.list_for_sku("MISSING-SKU") == []
+    assert len(repo.list()) == 3
+
+
+@pytest.mark.unit
+def test_in_memory_repository_follows_order_allocations():
+    """Test order lookups see allocations made outside the repository."""
+    first = Batch("b1", "TALL-LAMP", 10, eta=None)
+    second = Batch("b2", "TALL-LAMP", 10, eta=None)
+    repo = InMemoryRepository([first, second])
+    line = OrderLine("o1", "TALL-LAMP", 5)
+
+    assert repo.get_by_order("o1", "TALL-LAMP") is None
+
+    second.allocate(line)
+    assert repo.get_by_order("o1", "TALL-LAMP") is second
+
+    second.deallocate(line)
+    first.allocate(line)
+    assert repo.get_by_order("o1", "TALL-LAMP") is first
+    assert repo.get_by_order("o1", "HEAVY-SHELF") is None
+
+    shelf = Batch("b3", "HEAVY-SHELF", 10, eta=None)
+    shelf.allocate(OrderLine("o1", "HEAVY-SHELF", 1))
+    repo.add(shelf)
+    assert repo.list_for_order("o1") == [first, shelf]
+    assert repo.list_for_order("o2") == []
+
+
+@pytest.mark.unit
+def test_in_memory_repository_upserts_many_batches():
+    """Test add_many adds new batches and amends existing ones."""
+    existing = Batch("b1", "TALL-LAMP", 100, eta=None)
+    existing.allocate(OrderLine("o1", "TALL-LAMP", 10))
+    repo = InMemoryRepository([existing])
+    tomorrow = date.today() + timedelta(days=1)
+
+    count = repo.add_many(
+        iter(
+            [
+                Batch("b1", "TALL-LAMP", 50, eta=tomorrow),
+                Batch("b2", "TALL-LAMP", 20, eta=None),
+            ]
+        )
+    )
+
+    assert count == 2
+    assert repo.get("b1") is existing
+    assert existing.eta == tomorrow
+    assert existing.available_quantity == 40
+    assert repo.get("b2").available_quantity == 20
+
+
+class FakeClock:
+    """Fake monotonic clock."""
+
+    now = 0.0
+
+    def __call__(self) -> float:
+        """Return the current fake time."""
+        return self.now
+
+
+@pytest.mark.unit
+def test_caching_repository_serves_hot_skus_from_memory():
+    """Test hits, misses and evictions of the least recently used sku."""
+    repo = CachingRepository(
+        InMemoryRepository(
+            [
+                Batch("b1", "TALL-LAMP", 100, eta=None),
+                Batch("b2", "HEAVY-SHELF", 100, eta=None),
+                Batch("b3", "WOBBLY-CHAIR", 100, eta=None),
+            ]
+        ),
+        BatchCache(maxsize=2),
+    )
+
+    repo.list_for_sku("TALL-LAMP")
+    repo.list_for_sku("HEAVY-SHELF")
+    repo.list_for_sku("TALL-LAMP")
+    repo.list_for_sku("WOBBLY-CHAIR")
+    repo.list_for_sku("HEAVY-SHELF")
+
+    assert repo.stats.hits == 1
+    assert repo.stats.misses == 4
+    assert repo.stats.evictions == 2
+
+
+@pytest.mark.unit
+def test_caching_repository_reloads_expired_and_invalidated_skus():
+    """Test entries older than the ttl or written to get reloaded."""
+    clock = FakeClock()
+    repo = CachingRepository(
+        InMemoryRepository([Batch("b1", "TALL-LAMP", 100, eta=None)]),
+        BatchCache(ttl=10.0, clock=clock),
+    )
+    repo.list_for_sku("TALL-LAMP")
+
+    clock.now = 11.0
+    repo.list_for_sku("TALL-LAMP")
+    repo.add(Batch("b2", "TALL-LAMP", 100, eta=None))
+    batches = repo.list_for_sku("TALL-LAMP")
+
+    assert {b.reference for b in batches} == {"b1", "b2"}
+    assert repo.stats.hits == 0
+    assert repo.stats.misses == 3
+    assert repo.stats.invalidations == 1
+
+
+@pytest.mark.unit
+def test_caching_repository_knows_skus_with_only_closed_batches():
+    """Test has_sku is not answered from the cached open batches."""
+    closed = Batch("b1", "TALL-LAMP", 100, eta=None)
+    closed.close()
+    repo = CachingRepository(InMemoryRepository([closed]))
+
+    assert repo.list_for_sku("TALL-LAMP") == []
+    assert repo.has_sku("TALL-LAMP")
+    assert not repo.has_sku("MISSING-LAMP")
@@ -12,8 +12,18 @@ from corelib.allocation.domain.model import (
     Batch,
     OrderLine,
 )
-from corelib.allocation.service_layer.services import allocate
-from corelib.exceptions import InvalidSku
+from corelib.allocation.service_layer.catalogue import SkuCatalogue
+from corelib.allocation.service_layer.idempotency import IdempotencyCache
+from corelib.allocation.service_layer.services import (
+    allocate,
+    allocate_many,
+    deallocate,
+)
+from corelib.exceptions import (
+    InvalidSku,
+    OutOfStock,
+    UnallocatedOrder,
+)
 
 
 class FakeSession:
@@ -49,6 +59,21 @@ def test_error_for_invalid_sku():
         allocate(line, repo, FakeSession())
 
 
+@pytest.mark.unit
+def test_out_of_stock_for_skus_with_only_closed_batches():
+    """Test closed batches are not loaded but keep their sku valid."""
+    batch = Batch("b1", "CLOSED-LAMP", 100, eta=None)
+    batch.close()
+    repo = InMemoryRepository([batch])
+    line = OrderLine("o1", "CLOSED-LAMP", 10)
+
+    assert repo.list() == []
+    with pytest.raises(OutOfStock, match="CLOSED-LAMP"):
+        allocate(line, repo, FakeSession())
+    [result] = allocate_many([line], repo, FakeSession())
+    assert isinstance(result.error, OutOfStock)
+
+
 @pytest.mark.unit
 def test_commits():
     """Test that data was persisted."""
@@ -59,3 +84,144 @@ def test_commits():
 
     allocate(line, repo, session)
     assert session.committed is True
+
+
+@pytest.mark.unit
+def test_allocate_many_returns_a_result_per_line():
+    """Test bulk allocation reports batchref or error for each line."""
+    batch = Batch("b1", "COMPLICATED-LAMP", 15, eta=None)
+    repo = InMemoryRepository([batch])
+    lines = [
+        OrderLine("o1", "COMPLICATED-LAMP", 10),
+        OrderLine("o2", "NONEXISTENTSKU", 10),
+        OrderLine("o3", "COMPLICATED-LAMP", 10),
+        OrderLine("o4", "COMPLICATED-LAMP", 5),
+    ]
+
+    results = allocate_many(lines, repo, FakeSession())
+
+    assert [r.batchref for r in results] == ["b1", None, None, "b1"]
+    assert isinstance(results[1].error, InvalidSku)
+    assert isinstance(results[2].error, OutOfStock)
+    assert batch.available_quantity == 0
+
+
+@pytest.mark.unit
+def test_allocate_many_commits_once():
+    """Test bulk allocation persists all the lines in a single commit."""
+
+    class CountingSession(FakeSession):
+        """Fake session counting commits."""
+
+        commits = 0
+
+        def commit(self):
+            """Count commit action."""
+            self.commits += 1
+
+    batch = Batch("b1", "OMINOUS-MIRROR", 100, eta=None)
+    session = CountingSession()
+    lines = [OrderLine(f"o{i}", "OMINOUS-MIRROR", 1) for i in range(10)]
+
+    allocate_many(lines, InMemoryRepository([batch]), session)
+
+    assert session.commits == 1
+
+
+@pytest.mark.unit
+def test_deallocate_by_orderid():
+    """Test a line can be cancelled knowing only its orderid and sku."""
+    batch = Batch("b1", "BLUE-PLINTH", 100, eta=None)
+    repo = InMemoryRepository([batch])
+    session = FakeSession()
+    allocate(OrderLine("o1", "BLUE-PLINTH", 10), repo, session)
+
+    result = deallocate("o1", "BLUE-PLINTH", repo, session)
+
+    assert result == "b1"
+    assert batch.available_quantity == 100
+    assert session.committed is True
+
+
+@pytest.mark.unit
+def test_error_for_unallocated_order():
+    """Test deallocating an order that was never allocated."""
+    repo = InMemoryRepository([Batch("b1", "BLUE-PLINTH", 100, eta=None)])
+
+    with pytest.raises(UnallocatedOrder, match="o1"):
+        deallocate("o1", "BLUE-PLINTH", repo, FakeSession())
+
+
+@pytest.mark.unit
+def test_allocate_only_loads_the_line_sku():
+    """Test the service layer never loads the whole batch catalogue."""
+
+    class SkuOnlyRepository(InMemoryRepository):
+        """In-memory repository refusing to list every batch."""
+
+        def list(self):
+            """Fail if the whole catalogue is requested."""
+            raise AssertionError("list() loads every batch")
+
+    repo = SkuOnlyRepository(
+        [
+            Batch("b1", "ORNATE-SOFA", 100, eta=None),
+            Batch("b2", "PLAIN-SOFA", 100, eta=None),
+        ]
+    )
+
+    assert allocate(OrderLine("o1", "PLAIN-SOFA", 10), repo, FakeSession())
+    results = allocate_many(
+        [OrderLine("o2", "ORNATE-SOFA", 10)], repo, FakeSession()
+    )
+    assert results[0].batchref == "b1"
+
+
+@pytest.mark.unit
+def test_catalogue_rejects_invalid_skus_without_loading_batches():
+    """Test the sku catalogue answers known skus from memory."""
+
+    class CountingRepository(InMemoryRepository):
+        """In-memory repository counting its queries."""
+
+        exists_queries = 0
+
+        def has_sku(self, sku):
+            """Count the EXISTS queries."""
+            self.exists_queries += 1
+            return super().has_sku(sku)
+
+        def list_for_sku(self, sku):
+            """Fail if batches of an unknown sku are loaded."""
+            if not super().has_sku(sku):
+                raise AssertionError("loaded batches of an invalid sku")
+            return super().list_for_sku(sku)
+
+    repo = CountingRepository([Batch("b1", "SMALL-TABLE", 100, eta=None)])
+    catalogue = SkuCatalogue()
+
+    with pytest.raises(InvalidSku):
+        allocate(
+            OrderLine("o1", "NONEXISTENT", 1), repo, FakeSession(), catalogue
+        )
+    for orderid in ("o2", "o3"):
+        line = OrderLine(orderid, "SMALL-TABLE", 1)
+        assert allocate(line, repo, FakeSession(), catalogue) == "b1"
+
+    assert repo.exists_queries == 2
+    assert len(catalogue) == 1
+
+
+@pytest.mark.unit
+def test_idempotency_cache_keeps_the_latest_allocations():
+    """Test the cache is bounded, evicting the least recently used key."""
+    cache = IdempotencyCache(maxsize=2)
+    cache.add(("o1", "LAMP"), "b1")
+    cache.add(("o2", "LAMP"), "b2")
+    assert cache.get(("o1", "LAMP")) == "b1"
+
+    cache.add(("o3", "LAMP"), "b3")
+
+    assert cache.get(("o2", "LAMP")) is None
+    assert cache.get(("o1", "LAMP")) == "b1"
+    assert len(cache) == 2